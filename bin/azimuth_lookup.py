@@ -0,0 +1,132 @@
+import argparse, json, sys, time
+import numpy as np
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from obstruction.lookup import AzimuthTable, bulk_query
+
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Look up the optimal dome azimuth (and dwell time/clear azimuth window) for given hour angles & declinations, using the output of optimal_azimuth.py'
+        )
+
+parser.add_argument('table', action='store', type=str, help='optimal azimuth table (csv) generated w/ optimal_azimuth.py')
+parser.add_argument('-w', '--dwell', action='store', type=str, default=None, help='dwell cube (npy) generated w/ optimal_azimuth.py -d; enables the clear azimuth window')
+parser.add_argument('-i', '--interpolate', default=False, action='store_true', help='interpolate the optimal azimuth between grid points')
+
+subparsers = parser.add_subparsers(dest='mode', required=True)
+
+query_parser = subparsers.add_parser('query', help='look up a single pointing')
+query_parser.add_argument('--ha', action='store', type=float, default=0.0, help='telescope hour angle: 0 to 24 h | default: 0 h')
+query_parser.add_argument('--dec', action='store', type=float, default=0.0, help='telescope declination -90 to 90 deg | default: 0 deg')
+
+bulk_parser = subparsers.add_parser('bulk', help='look up "ha,dec" lines (HA in hours) from a file or stdin; writes csv to stdout')
+bulk_parser.add_argument('file', action='store', type=str, nargs='?', default='-', help='input file | default: stdin')
+
+serve_parser = subparsers.add_parser('serve', help='serve queries over HTTP on localhost, e.g. GET /?ha=1.5&dec=30 (HA in hours)')
+serve_parser.add_argument('-p', '--port', action='store', type=int, default=8421, help='port | default: 8421')
+
+benchmark_parser = subparsers.add_parser('benchmark', help='measure the latency & throughput of queries')
+benchmark_parser.add_argument('-n', action='store', type=int, default=100000, help='no. queries | default: 100000')
+
+args = parser.parse_args()
+
+
+def to_json(result):
+    """Convert a (scalar) query result to json; NaN becomes null."""
+    return {key: None if np.isnan(value) else float(value) for key, value in result.items()}
+
+
+def bulk(table, lines, out):
+    """Answer "ha,dec" queries in chunks, see obstruction.lookup.bulk_query; report the lines that could not be parsed."""
+    n_queries, n_skipped = bulk_query(table, lines, out, interpolate=args.interpolate)
+
+    if n_skipped:
+        print('WARNING: {} of {} lines could not be parsed (skipped)'.format(n_skipped, n_queries + n_skipped), file=sys.stderr)
+
+
+def serve(table, port):
+    """Serve single/bulk queries as json over HTTP; bound to localhost only."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+
+            try:
+                ha = np.array([float(h) for h in params['ha'][0].split(',')])
+                dec = np.array([float(d) for d in params['dec'][0].split(',')])
+
+                result = table.query(ha*15, dec, interpolate=args.interpolate)
+                body = [to_json({key: value[i] for key, value in result.items()}) for i in range(ha.size)]
+
+                status = 200
+            except (KeyError, ValueError) as ex:
+                body = {'error': str(ex)}
+                status = 400
+
+            payload = json.dumps(body[0] if isinstance(body, list) and len(body) == 1 else body).encode()
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    print('Serving optimal azimuth queries at http://127.0.0.1:{}/?ha=<h>&dec=<deg>'.format(port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def benchmark(table, n):
+    """Measure the latency of single queries & the throughput of bulk queries."""
+    rng = np.random.default_rng(0)
+
+    ha = rng.uniform(0, 360, n)
+    dec = rng.uniform(-90, 90, n)
+
+    n_single = min(n, 10000)
+
+    for interpolate in (False, True):
+        start = time.perf_counter()
+
+        for i in range(n_single):
+            table.best_azimuth(ha[i], dec[i], interpolate=interpolate)
+
+        latency = (time.perf_counter() - start)/n_single
+
+        start = time.perf_counter()
+        table.query(ha, dec, interpolate=interpolate)
+        throughput = n/(time.perf_counter() - start)
+
+        print('interpolate={}: single query latency = {:.1f} us; bulk throughput = {:.3g} queries/s'.format(interpolate, latency*1e6, throughput))
+
+
+if __name__ == '__main__':
+    table = AzimuthTable.load(args.table, dwell_path=args.dwell)
+
+    if args.mode == 'query':
+        result = table.query(args.ha*15, args.dec, interpolate=args.interpolate)
+
+        print(json.dumps(to_json(result)))
+
+    elif args.mode == 'bulk':
+        if args.file == '-':
+            bulk(table, sys.stdin, sys.stdout)
+        else:
+            with open(args.file, 'r') as lines:
+                bulk(table, lines, sys.stdout)
+
+    elif args.mode == 'serve':
+        serve(table, args.port)
+
+    elif args.mode == 'benchmark':
+        benchmark(table, args.n)
@@ -0,0 +1,293 @@
+import argparse, json, os, subprocess, sys, tempfile, time
+import numpy as np
+
+from pathlib import Path
+
+from obstruction.aperture import AMBIGUOUS, APERTURE_TYPES
+from obstruction.cube import quantize
+from obstruction.engine import ApertureSet
+
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Benchmarks of the obstruction engine & a regression check of the (fast) obstruction kernels against golden reference cubes'
+        )
+
+subparsers = parser.add_subparsers(dest='mode', required=True)
+
+latency_parser = subparsers.add_parser('latency', help='single pose latency per aperture & sample rate')
+latency_parser.add_argument('--rates', action='store', type=str, default='3,4,6,10', help='comma separated sample rates | default: 3,4,6,10')
+latency_parser.add_argument('-n', action='store', type=int, default=20, help='no. poses timed per aperture & rate | default: 20')
+
+grid_parser = subparsers.add_parser('grid', help='poses (HA, Dec) per second in grid mode, i.e. 360 dome azimuths per pose')
+grid_parser.add_argument('-n', action='store', type=int, default=8, help='no. HA slices (of 181 Decs) timed | default: 8')
+
+memory_parser = subparsers.add_parser('memory', help='wall time & peak memory of obstruction_grid.py & optimal_azimuth.py (a full run, in a temporary directory)')
+memory_parser.add_argument('-a', '--aperture', action='store', type=str, default='guider', help='select aperture: telescope, finder, guider | default: guider')
+memory_parser.add_argument('-q', '--quantize', default=False, action='store_true', help='generate a quantized cube, see obstruction_grid.py -q')
+
+golden_parser = subparsers.add_parser('golden', help='compare the obstruction kernels against the golden reference cubes')
+golden_parser.add_argument('--update', default=False, action='store_true', help='(re)generate the golden reference cubes w/ the ray-by-ray Aperture.obstruction; takes a few minutes')
+golden_parser.add_argument('-t', '--tolerance', action='store', type=float, default=1e-9, help='max. absolute difference w/ the reference | default: 1e-9')
+
+parser.add_argument('-o', '--output', action='store', type=str, default=None, help='also store the results as json')
+
+args = parser.parse_args()
+
+
+BIN = Path(__file__).resolve().parent
+GOLDEN = BIN / 'resources' / 'golden'
+
+# The (small) grid of the golden cubes, indexed as (az, ha, dec)
+GOLDEN_AZ = np.arange(0, 360, 30, dtype=float)
+GOLDEN_HA = np.arange(0, 360, 30, dtype=float)
+GOLDEN_DEC = np.arange(-90, 91, 15, dtype=float)
+
+# No. additional (random) poses at the edges of the slit
+N_EDGE_POSES = 64
+
+
+def timed(function, *args, **kwargs):
+    """Return the result of a function call & its wall time in seconds."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+
+    return result, time.perf_counter() - start
+
+
+def latency(rates, n):
+    """Time the single pose latency of Aperture.obstruction & Aperture.obstruction_batch."""
+    rng = np.random.default_rng(0)
+    poses = np.column_stack([rng.uniform(0, 360, n), rng.uniform(-90, 90, n), rng.uniform(0, 360, n)])
+
+    results = []
+
+    for name, aperture_type in APERTURE_TYPES.items():
+        for rate in rates:
+            aperture = aperture_type(rate=rate)
+
+            # The samples are memoized on first use
+            aperture.obstruction_batch(*poses[0])
+
+            times = {}
+
+            for label, method, kwargs in [('obstruction', 'obstruction', {}), ('obstruction_batch', 'obstruction_batch', {}), ('obstruction_batch (traced)', 'obstruction_batch', {'fast_path': False})]:
+                function = getattr(aperture, method)
+                times[label] = float(np.median([timed(function, *pose, **kwargs)[1] for pose in poses]))
+
+            result = {'aperture': name, 'rate': rate, 'n_rays': aperture.get_ray_count()}
+            result.update({key: value*1e3 for key, value in times.items()})
+
+            print('[{}] rate {:>2} ({:>3} rays): '.format(name, rate, aperture.get_ray_count()) + ', '.join('{} {:.3f} ms'.format(key, value*1e3) for key, value in times.items()))
+
+            results.append(result)
+
+    return results
+
+
+def grid(n):
+    """Time the obstruction of HA slices (all Decs & dome azimuths), like obstruction_grid.py."""
+    azimuths = np.linspace(0, 359, 360)
+    dec = np.linspace(-90, 90, 181)
+
+    ha_values = np.linspace(0, 360, n, endpoint=False)
+
+    results = []
+
+    cases = [(name, aperture_type(), kwargs) for name, aperture_type in APERTURE_TYPES.items() for kwargs in ({}, {'fast_path': False})]
+    cases += [('telescope_guider_finder', ApertureSet([aperture_type() for aperture_type in APERTURE_TYPES.values()]), kwargs) for kwargs in ({}, {'fast_path': False})]
+
+    for name, engine, kwargs in cases:
+        engine.obstruction_profile(ha_values[0], dec[:1], azimuths[:1])
+
+        duration = sum(timed(engine.obstruction_profile, ha, dec, azimuths, **kwargs)[1] for ha in ha_values)
+
+        n_poses = n*dec.size
+
+        result = {
+            'aperture': name,
+            'fast_path': kwargs.get('fast_path', True),
+            'poses_per_second': n_poses/duration,
+            'cells_per_second': n_poses*azimuths.size/duration,
+        }
+
+        print('[{}] fast_path={}: {:.0f} poses/s ({:.3g} cells/s)'.format(name, result['fast_path'], result['poses_per_second'], result['cells_per_second']))
+
+        results.append(result)
+
+    return results
+
+
+def run_measured(command, cwd, stdin=None):
+    """Run a command; return its wall time in seconds & its peak resident memory in MB."""
+    env = dict(os.environ, PYTHONPATH=str(BIN) + os.pathsep + os.environ.get('PYTHONPATH', ''))
+
+    start = time.perf_counter()
+
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    process.stdin.write((stdin or '').encode())
+    process.stdin.close()
+
+    # The resource usage of this very child (ru_maxrss is in kB on Linux)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    duration = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError('{} failed:\n{}'.format(' '.join(command), process.stderr.read().decode()))
+
+    return duration, usage.ru_maxrss/1024
+
+
+def memory(aperture, quantized):
+    """Measure the wall time & peak memory of a full obstruction_grid.py & optimal_azimuth.py run."""
+    flags = ['-q'] if quantized else []
+    fn = 'obstruction_cube_{}{}.npy'.format(aperture, '_counts' if quantized else '')
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as cwd:
+        for script, command, stdin in [
+            ('obstruction_grid.py', [sys.executable, str(BIN / 'obstruction_grid.py'), '-a', aperture] + flags, None),
+            ('optimal_azimuth.py', [sys.executable, str(BIN / 'optimal_azimuth.py'), '-a', aperture, '-d'], fn + '\n'),
+        ]:
+            duration, peak = run_measured(command, cwd, stdin=stdin)
+
+            print('[{}] {}: {:.1f} s, peak memory {:.0f} MB'.format(aperture, script, duration, peak))
+
+            results.append({'aperture': aperture, 'script': script, 'seconds': duration, 'peak_mb': peak})
+
+    return results
+
+
+def golden_path(name):
+    return GOLDEN / 'golden_{}.npz'.format(name)
+
+
+def edge_poses(aperture, n):
+    """Draw random (HA, Dec, Az) poses that cannot be classified as fully clear/blocked."""
+    rng = np.random.default_rng(0)
+
+    ha, dec, az = rng.uniform(0, 360, 200*n), rng.uniform(-90, 90, 200*n), rng.uniform(0, 360, 200*n)
+
+    is_ambiguous = aperture._classify(ha, dec, az) == AMBIGUOUS
+
+    return np.column_stack([ha[is_ambiguous], dec[is_ambiguous], az[is_ambiguous]])[:n]
+
+
+def update_golden():
+    """Generate the golden cubes w/ the ray-by-ray reference, Aperture.obstruction."""
+    GOLDEN.mkdir(parents=True, exist_ok=True)
+
+    for name, aperture_type in APERTURE_TYPES.items():
+        aperture = aperture_type()
+
+        start = time.perf_counter()
+
+        cube = np.array([[[aperture.obstruction(ha, dec, az) for dec in GOLDEN_DEC] for ha in GOLDEN_HA] for az in GOLDEN_AZ])
+
+        poses = edge_poses(aperture, N_EDGE_POSES)
+        ratios = np.array([aperture.obstruction(*pose) for pose in poses])
+
+        np.savez_compressed(
+            golden_path(name),
+            azimuths=GOLDEN_AZ, ha=GOLDEN_HA, dec=GOLDEN_DEC, cube=cube,
+            poses=poses, ratios=ratios,
+            parameters=json.dumps(aperture.get_parameters(), sort_keys=True),
+        )
+
+        print('[{}] golden cube of {} cells & {} edge poses stored in {:.0f} s'.format(name, cube.size, len(poses), time.perf_counter() - start))
+
+
+def check_golden(tolerance):
+    """
+    Compare the (fast) obstruction kernels against the golden cubes;
+    return the results & whether all kernels are within the tolerance.
+    """
+    results = []
+    passed = True
+
+    apertures = {name: aperture_type() for name, aperture_type in APERTURE_TYPES.items()}
+    aperture_set = ApertureSet(apertures.values())
+
+    golden = {}
+
+    for name, aperture in apertures.items():
+        with np.load(golden_path(name)) as golden_file:
+            golden[name] = {key: golden_file[key] for key in golden_file.files}
+
+        if str(golden[name]['parameters']) != json.dumps(aperture.get_parameters(), sort_keys=True):
+            print('[{}] the golden cube is stale, i.e. the geometry or sampling changed; regenerate it w/ --update'.format(name))
+            passed = False
+
+    # The cubes share their grid, which is reshaped to (ha, dec) poses vs azimuths
+    reference = golden['telescope']
+    ha, dec = np.meshgrid(reference['ha'], reference['dec'], indexing='ij')
+    azimuths = reference['azimuths']
+
+    def as_cube(profile):
+        return np.moveaxis(profile, -1, 0)
+
+    kernels = {}
+
+    for name, aperture in apertures.items():
+        az_grid, ha_grid, dec_grid = np.meshgrid(azimuths, reference['ha'], reference['dec'], indexing='ij')
+        poses = golden[name]['poses']
+
+        kernels[name] = [
+            ('obstruction_batch', lambda a=aperture: a.obstruction_batch(ha_grid, dec_grid, az_grid)),
+            ('obstruction_batch (traced)', lambda a=aperture: a.obstruction_batch(ha_grid, dec_grid, az_grid, fast_path=False)),
+            ('obstruction_profile', lambda a=aperture: as_cube(a.obstruction_profile(ha, dec, azimuths))),
+            ('obstruction_profile (traced)', lambda a=aperture: as_cube(a.obstruction_profile(ha, dec, azimuths, fast_path=False))),
+            ('obstruction_profile (exact)', lambda a=aperture: as_cube(a.obstruction_profile(ha, dec, azimuths, exact=True))),
+            ('ApertureSet', lambda n=name: as_cube(aperture_set.obstruction_profile(ha, dec, azimuths)[n])),
+            ('ApertureSet (exact)', lambda n=name: as_cube(aperture_set.obstruction_profile(ha, dec, azimuths, exact=True)[n])),
+            ('quantize', lambda a=aperture, n=name: quantize(golden[n]['cube'], a.get_weight_denominator())/a.get_weight_denominator()),
+            ('edge poses', lambda a=aperture, p=poses: a.obstruction_batch(*p.T)),
+            ('edge poses (exact)', lambda a=aperture, p=poses: np.array([a.azimuth_profile(h, d)(z)[0, 0] for h, d, z in p])),
+        ]
+
+    for name, aperture in apertures.items():
+        for kernel, function in kernels[name]:
+            expected = golden[name]['ratios'] if kernel.startswith('edge poses') else golden[name]['cube']
+
+            ratio, duration = timed(function)
+
+            error = np.abs(np.asarray(ratio, dtype=float) - expected)
+            n_failed = int(np.sum(~(error <= tolerance)))
+
+            passed &= n_failed == 0
+
+            print('[{}] {:<28} max |error| {:.2e}, {} of {} cells > {:.0e} ({:.0f} ms){}'.format(name, kernel, error.max(), n_failed, error.size, tolerance, duration*1e3, '' if n_failed == 0 else ' FAILED'))
+
+            results.append({'aperture': name, 'kernel': kernel, 'max_error': float(error.max()), 'n_failed': n_failed, 'n_cells': int(error.size), 'seconds': duration})
+
+    return results, passed
+
+
+if __name__ == '__main__':
+    passed = True
+
+    if args.mode == 'latency':
+        results = latency([int(rate) for rate in args.rates.split(',')], args.n)
+
+    elif args.mode == 'grid':
+        results = grid(args.n)
+
+    elif args.mode == 'memory':
+        results = memory(args.aperture, args.quantize)
+
+    elif args.mode == 'golden':
+        if args.update:
+            update_golden()
+
+        results, passed = check_golden(args.tolerance)
+
+        print('All kernels are within the tolerance' if passed else 'Some kernels deviate from the golden cubes!')
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump({'mode': args.mode, 'results': results, 'passed': passed}, output, indent=2)
+
+    sys.exit(0 if passed else 1)
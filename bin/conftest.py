@@ -0,0 +1 @@
+# Makes the obstruction package importable by the tests (pytest adds the directory of this file to sys.path)
@@ -0,0 +1,45 @@
+import argparse, time
+import numpy as np
+
+from obstruction.schedule import DomeScheduler
+
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Plan the dome azimuth for an ordered list of targets, s.t. the aperture(s) stay clear w/ a minimal no. dome moves (and slew), using the dwell cube of optimal_azimuth.py -d'
+        )
+
+parser.add_argument('targets', action='store', type=str, help='csv file w/ "ra,dec,duration" lines in order of observation; RA in hours, Dec in degrees, duration in minutes')
+parser.add_argument('dwell', action='store', type=str, help='dwell cube (npy) generated w/ optimal_azimuth.py -d')
+parser.add_argument('--start', action='store', type=str, required=True, help='UTC start time of the first target, e.g. 2024-03-01T20:00:00')
+parser.add_argument('-s', '--step', action='store', type=float, default=120.0, help='time step in seconds | default: 120 s')
+parser.add_argument('-m', '--margin', action='store', type=int, default=0, help='no. degrees on either side of the dome azimuth that should be clear too | default: 0')
+parser.add_argument('--move_cost', action='store', type=float, default=360.0, help='cost of a dome move, in degrees of slew | default: 360')
+parser.add_argument('--az', action='store', type=float, default=None, help='dome azimuth at the start | default: free')
+parser.add_argument('-o', '--output', action='store', type=str, default=None, help='store the schedule per step as csv')
+
+args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    scheduler = DomeScheduler.load(args.dwell)
+
+    targets = [(ra*15, dec, duration*60) for ra, dec, duration in np.loadtxt(args.targets, delimiter=',', ndmin=2, comments='#')]
+
+    start = time.perf_counter()
+
+    plan = scheduler.plan(targets, args.start, step=args.step, margin=args.margin, move_cost=args.move_cost, initial_az=args.az)
+
+    duration = time.perf_counter() - start
+
+    for k, from_az, to_az in plan['moves']:
+        print('{} [target {}] move dome {:.0f} -> {:.0f} deg'.format(str(plan['time'][k])[:19], plan['target'][k], from_az, to_az))
+
+    print('{} moves, {:.0f} deg slew in total, {} of {} steps obstructed; planned in {:.0f} ms'.format(plan['n_moves'], plan['slew'], plan['n_obstructed'], plan['time'].size, duration*1e3))
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            output.write('time,target,ha,dec,az,clear\n')
+
+            for k in range(plan['time'].size):
+                output.write('{},{},{:.4f},{:.4f},{:.0f},{:d}\n'.format(str(plan['time'][k])[:19], plan['target'][k], plan['ha'][k], plan['dec'][k], plan['az'][k], plan['clear'][k]))
@@ -0,0 +1,82 @@
+import argparse, dataclasses, time
+import numpy as np
+
+from obstruction.config import Geometry, load_geometry
+from obstruction.sweep import clear_sky_fraction, geometry_grid, sweep
+
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Sweep geometry parameters (e.g. the slit width) & compute, per geometry, the fraction of the sky for which the aperture can be kept clear; the geometries are evaluated concurrently'
+        )
+
+parser.add_argument('-p', '--parameter', action='append', type=str, required=True, help='geometry parameter & values, as name=v1,v2,... or name=start:stop:step (stop included), e.g. slit_width=1.4:2.4:0.1; may be repeated')
+parser.add_argument('-a', '--aperture', action='store', type=str, default='guider', help='select aperture: telescope, finder, guider | default: guider')
+parser.add_argument('-r', '--rate', action='store', type=int, default=3, help='sample rate of the aperture | default: 3')
+parser.add_argument('-n', action='store', type=int, default=2000, help='no. pointings spread over the sky | default: 2000')
+parser.add_argument('--min_alt', action='store', type=float, default=20.0, help='min. altitude of the pointings in degrees | default: 20 deg')
+parser.add_argument('-g', '--requirement', action='store', type=float, default=0.0, help='max. obstruction ratio of a clear aperture | default: 0')
+parser.add_argument('--target', action='store', type=float, default=None, help='report the geometries that keep the aperture clear over at least this fraction of the sky, e.g. 0.95')
+parser.add_argument('-j', '--jobs', action='store', type=int, default=-1, help='no. processes | default: all cores')
+
+args = parser.parse_args()
+
+FIELDS = [field.name for field in dataclasses.fields(Geometry)]
+
+
+def parse_values(text):
+    """Parse v1,v2,... or start:stop:step (stop included)."""
+    if ':' in text:
+        start, stop, step = (float(value) for value in text.split(':'))
+
+        return list(np.round(np.arange(start, stop + step/2, step), 12))
+
+    return [float(value) for value in text.split(',')]
+
+
+if __name__ == '__main__':
+    axes = {}
+
+    for parameter in args.parameter:
+        name, _, values = parameter.partition('=')
+
+        if name not in FIELDS:
+            parser.error('unknown geometry parameter "{}"; choose from {}'.format(name, ', '.join(FIELDS)))
+
+        axes[name] = parse_values(values)
+
+    base = load_geometry()
+    geometries = geometry_grid(base, **axes)
+
+    start = time.perf_counter()
+
+    fractions = sweep(
+        geometries, function=clear_sky_fraction, n_jobs=args.jobs,
+        aperture=args.aperture, rate=args.rate, n_poses=args.n, min_altitude=args.min_alt, requirement=args.requirement,
+    )
+
+    duration = time.perf_counter() - start
+
+    print(','.join(list(axes) + ['clear_fraction']))
+
+    for geometry, fraction in zip(geometries, fractions):
+        print(','.join(['{:g}'.format(getattr(geometry, name)) for name in axes] + ['{:.4f}'.format(fraction)]))
+
+    print('[{}] {} geometries x {} pointings (altitude > {:g} deg) in {:.1f} s; config: {}'.format(
+        args.aperture, len(geometries), args.n, args.min_alt, duration,
+        ', '.join('{}={:g}'.format(name, getattr(base, name)) for name in axes)
+    ))
+
+    if args.target is not None:
+        passing = [geometry for geometry, fraction in zip(geometries, fractions) if fraction >= args.target]
+
+        if not passing:
+            print('No geometry keeps the {} clear over {:.0%} of the sky'.format(args.aperture, args.target))
+        else:
+            # The first passing geometry along the (sorted) grid, e.g. the smallest slit width
+            best = min(passing, key=lambda geometry: tuple(getattr(geometry, name) for name in axes))
+
+            print('{} of {} geometries keep the {} clear over {:.0%} of the sky; the first: {}'.format(
+                len(passing), len(geometries), args.aperture, args.target,
+                ', '.join('{}={:g}'.format(name, getattr(best, name)) for name in axes)
+            ))
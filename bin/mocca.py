@@ -1,6 +1,6 @@
-import argparse
+import argparse, sys
 
-from obstruction.aperture import TelescopeAperture, GuiderAperture, FinderAperture
+from obstruction.aperture import APERTURE_TYPES
 
 parser = argparse.ArgumentParser(
             allow_abbrev=True, 
@@ -10,28 +10,71 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--az', action='store', type=float, default=0.0, help='dome azimuth: 0 to 360 deg | default: 0 deg')
 parser.add_argument('--ha', action='store', type=float, default=0.0, help='telescope hour angle: 0 to 24 h | default: 0 h')
 parser.add_argument('--dec', action='store', type=float, default=0.0, help='telescope declination -90 to 90 deg | default: 0 deg')
-parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture: telescope, finder, guider | default: telescope')
+parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture: telescope, finder, guider; comma separated or "all" for several | default: telescope')
 parser.add_argument('-r', '--rate', action='store', type=int, default=4, help='no. radial circles of rays (for decent results > 3; preferably 10+) | default: 4')
+parser.add_argument('-t', '--tolerance', action='store', type=float, default=None, help='sample the aperture w/ an adaptive no. quasi-random rays until the 95%% confidence interval is below this tolerance, e.g. 0.01 (ignores -r)')
 parser.add_argument('-v', '--visualise', default=False, action='store_true')
+parser.add_argument('-b', '--batch', action='store', type=str, default=None, help='read query records (ha in h, dec & az in deg; other fields are passed through) from a csv/ndjson file, or - for stdin, and stream the results to stdout')
+parser.add_argument('-f', '--format', action='store', type=str, default=None, help='record format of the batch: csv, ndjson | default: from the file extension; csv for stdin')
+parser.add_argument('-c', '--chunk_size', action='store', type=int, default=1024, help='no. batch records evaluated at once | default: 1024')
 
 args = parser.parse_args()
 
+
+def run_batch(names):
+    """Stream the obstruction of the apertures for the query records of the batch file/stdin."""
+    from obstruction.batch import detect_format, stream_obstruction
+
+    apertures = [APERTURE_TYPES[name](rate=args.rate) for name in names]
+
+    format = args.format or ('csv' if args.batch == '-' else detect_format(args.batch))
+
+    if format not in ('csv', 'ndjson'):
+        parser.error('unknown format "{}"; choose from csv, ndjson'.format(format))
+
+    source = sys.stdin if args.batch == '-' else open(args.batch, newline='')
+
+    try:
+        n_records, n_errors = stream_obstruction(apertures, source, sys.stdout, format=format, chunk_size=args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    if n_errors:
+        print('WARNING: {} of {} records could not be evaluated (see the error field)'.format(n_errors, n_records), file=sys.stderr)
+
+
 if __name__ == '__main__':    
     blockage = None
+    error = None
+    aperture = None
+
+    names = list(APERTURE_TYPES) if args.aperture == 'all' else args.aperture.split(',')
+
+    if args.batch is not None:
+        unknown = [name for name in names if name not in APERTURE_TYPES]
+
+        if unknown:
+            parser.error('unknown aperture(s) {}; choose from {}'.format(', '.join(unknown), ', '.join(APERTURE_TYPES)))
 
-    if args.aperture == 'telescope':
-        telescope = TelescopeAperture(rate=args.rate)
-        blockage = telescope.obstruction(args.ha*15, args.dec, args.az, plot_result=args.visualise)
+        run_batch(names)
+        sys.exit()
 
-    elif args.aperture == 'guider':
-        guider = GuiderAperture(rate=args.rate)
-        blockage = guider.obstruction(args.ha*15, args.dec, args.az, plot_result=args.visualise)
+    if args.aperture in APERTURE_TYPES:
+        aperture = APERTURE_TYPES[args.aperture](rate=args.rate)
 
-    elif args.aperture == 'finder':
-        finder = FinderAperture(rate=args.rate)
-        blockage = finder.obstruction(args.ha*15, args.dec, args.az, plot_result=args.visualise)
+    if aperture is not None:
+        if args.visualise:
+            # The ray-by-ray calculation keeps track of the obstructed sample points
+            blockage = aperture.obstruction(args.ha*15, args.dec, args.az, plot_result=True)
+        elif args.tolerance is not None:
+            blockage, error, n_rays = aperture.obstruction_estimate(args.ha*15, args.dec, args.az, tolerance=args.tolerance)
+        else:
+            blockage = float(aperture.obstruction_batch(args.ha*15, args.dec, args.az))
 
-    if blockage is not None:
+    if blockage is not None and error is not None:
+        print('Obstruction = {:.2%} +/- {:.2%} ({} rays)'.format(float(blockage), float(error), int(n_rays)))
+    elif blockage is not None:
         print('Obstruction = {:.2%}'.format(blockage))
     else:
         print('ERROR:The % obstruction could not be computed!')
\ No newline at end of file
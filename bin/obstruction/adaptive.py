@@ -0,0 +1,265 @@
+import numpy as np
+
+from obstruction.aperture import within_limits
+
+# Corner offsets of a cell, as (az, ha, dec) multiples of its size; corner c = 4*i_az + 2*i_ha + i_dec
+CORNERS = np.array([[i >> 2 & 1, i >> 1 & 1, i & 1] for i in range(8)], dtype=np.int64)
+
+
+class AdaptiveGrid:
+    """
+    Octree of the % obstruction over (dome Az, HA, Dec). It starts from
+    a coarse lattice and recursively splits only the cells whose corners
+    disagree, i.e. the cells in the transition shell around the edges of
+    the slit; cells w/ equal corners are assumed to be uniform. The
+    obstruction at arbitrary coordinates is interpolated (trilinear)
+    from the corners of the leaf cell containing them, see __call__ and
+    resample.
+
+    If limits is set, the poses outside of the limits (see
+    obstruction.aperture.within_limits) are not traced, but masked
+    (NaN); cells that straddle the limits are refined like transitions.
+
+    Note: features that fit within a coarse cell w/o touching any of its
+    corners are missed; choose the coarse step accordingly.
+
+    Public methods
+    --------------
+
+    resample (ndarray): return the obstruction cube on a regular grid
+    get_statistics (dict): return the no. evaluations & leaf cells per level
+    """
+    def __init__(self, aperture, coarse_step=4, levels=5, tolerance=1e-9, az_range=(0, 360), ha_range=(0, 360), dec_range=(-90, 90), block_size=8192, chunk_size=4096, fast_path=True, limits=False):
+        """The AdaptiveGrid class constructor.
+
+        Parameters
+        ----------
+
+        aperture (Aperture): the aperture of which to compute the obstruction
+        coarse_step (int): step of the coarse lattice in degrees; has to divide 180 deg
+        levels (int): no. times a cell can be split; the finest step is coarse_step/2**levels
+        tolerance (float): max. difference between the corners of a cell for it to be uniform
+        az_range (tuple): (start, stop) of the refined dome azimuths; multiples of coarse_step
+        ha_range (tuple): (start, stop) of the refined hour angles; multiples of coarse_step
+        dec_range (tuple): (start, stop) of the refined declinations; multiples of coarse_step from -90 deg
+        block_size (int): no. coarse cells refined at once; bounds the memory usage
+        chunk_size (int): max. no. poses traced at once, see Aperture.obstruction_batch
+        fast_path (bool): if True, skip tracing poses that are fully clear/blocked, see Aperture.obstruction_batch
+        limits (bool): if True, mask the poses outside of the limits of the geometry of the aperture
+        """
+        if 180 % coarse_step != 0:
+            raise ValueError('The coarse step has to divide 180 deg...')
+
+        if any(value % coarse_step != 0 for value in az_range + ha_range + (dec_range[0] + 90, dec_range[1] + 90)):
+            raise ValueError('The ranges have to be multiples of the coarse step...')
+
+        self.aperture = aperture
+        self.levels = levels
+        self.tolerance = tolerance
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+        self.fast_path = fast_path
+        self.limits = limits
+
+        # Coordinates are stored as integer multiples of the finest step
+        self.step = coarse_step/2**levels
+
+        self._n_az = self._n_ha = int(round(360/self.step))
+        self._n_dec = int(round(180/self.step))
+
+        self._n_evaluations = 0
+
+        # Whether the lattice (ha, dec) are within the limits; -1 if not yet known
+        self._reachable = np.full((self._n_ha, self._n_dec + 1), -1, dtype=np.int8) if limits else None
+
+        # Leaf cells per level, as sorted keys of their origins & the values at their corners
+        self._leaves = []
+
+        self._build(az_range, ha_range, dec_range)
+
+    def _encode(self, az, ha, dec):
+        """Encode integer (az, ha, dec) coordinates as a single key."""
+        return (az*self._n_ha + ha)*(self._n_dec + 1) + dec
+
+    def _within_limits(self, ha, dec):
+        """
+        Return whether integer lattice (ha, dec) are within the limits;
+        computed once per (ha, dec), since they do not depend on the azimuth.
+        """
+        is_unknown = self._reachable[ha, dec] < 0
+
+        if is_unknown.any():
+            ha_new, dec_new = np.divmod(np.unique(ha[is_unknown]*(self._n_dec + 1) + dec[is_unknown]), self._n_dec + 1)
+
+            self._reachable[ha_new, dec_new] = within_limits(ha_new*self.step, dec_new*self.step - 90, self.aperture.geometry)
+
+        return self._reachable[ha, dec] == 1
+
+    def _evaluate(self, cache, az, ha, dec):
+        """
+        Return the obstruction at integer lattice coordinates; only the
+        vertices that are not in the cache, i.e. sorted (keys, values),
+        and within the limits (if set) are traced.
+        """
+        az = az % self._n_az
+        ha = ha % self._n_ha
+
+        keys, inverse = np.unique(self._encode(az, ha, dec), return_inverse=True)
+
+        known_keys, known_values = cache
+
+        is_known = np.zeros(keys.shape, dtype=bool)
+
+        if known_keys.size:
+            index = np.minimum(np.searchsorted(known_keys, keys), known_keys.size - 1)
+            is_known = known_keys[index] == keys
+
+        new_keys = keys[~is_known]
+
+        if new_keys.size:
+            dec_new = new_keys % (self._n_dec + 1)
+            ha_new = new_keys // (self._n_dec + 1) % self._n_ha
+            az_new = new_keys // ((self._n_dec + 1)*self._n_ha)
+
+            # Vertices outside of the limits are masked rather than traced
+            reachable = self._within_limits(ha_new, dec_new) if self.limits else np.ones(new_keys.shape, dtype=bool)
+
+            values = np.full(new_keys.shape, np.nan)
+
+            if reachable.any():
+                values[reachable] = self.aperture.obstruction_batch(ha_new[reachable]*self.step, dec_new[reachable]*self.step - 90, az_new[reachable]*self.step, chunk_size=self.chunk_size, fast_path=self.fast_path)
+
+            self._n_evaluations += int(np.count_nonzero(reachable))
+
+            known_keys = np.concatenate([known_keys, new_keys])
+            known_values = np.concatenate([known_values, values])
+
+            order = np.argsort(known_keys, kind='stable')
+
+            cache[:] = known_keys[order], known_values[order]
+
+        return cache[1][np.searchsorted(cache[0], keys)][inverse.ravel()]
+
+    def _build(self, az_range, ha_range, dec_range):
+        """Refine the coarse lattice level by level, a block of coarse cells at a time."""
+        coarse_size = 2**self.levels
+
+        # The cells of the coarse lattice, as (az, ha, dec) origins
+        az, ha, dec = np.meshgrid(
+            np.arange(int(round(az_range[0]/self.step)), int(round(az_range[1]/self.step)), coarse_size),
+            np.arange(int(round(ha_range[0]/self.step)), int(round(ha_range[1]/self.step)), coarse_size),
+            np.arange(int(round((dec_range[0] + 90)/self.step)), int(round((dec_range[1] + 90)/self.step)), coarse_size),
+            indexing='ij'
+        )
+        coarse_origins = np.stack([az.ravel(), ha.ravel(), dec.ravel()], axis=-1).astype(np.int64)
+
+        leaves = [([], []) for _ in range(self.levels + 1)]
+
+        for start in range(0, coarse_origins.shape[0], self.block_size):
+            origins = coarse_origins[start:start + self.block_size]
+            size = coarse_size
+
+            # Vertices are shared between the cells of a block (& between its levels)
+            cache = [np.empty(0, dtype=np.int64), np.empty(0)]
+
+            for level in range(self.levels + 1):
+                corners = origins[:, np.newaxis] + size*CORNERS
+
+                values = self._evaluate(cache, corners[..., 0].ravel(), corners[..., 1].ravel(), corners[..., 2].ravel()).reshape(-1, 8)
+
+                is_masked = np.isnan(values)
+
+                # Cells that are masked entirely are leaves; cells w/ some masked corners are split
+                is_leaf = is_masked.all(axis=1) | (~is_masked.any(axis=1) & (np.ptp(values, axis=1) <= self.tolerance))
+
+                if level == self.levels:
+                    is_leaf[:] = True
+
+                leaves[level][0].append(self._encode(*(origins[is_leaf]//size).T))
+                leaves[level][1].append(values[is_leaf])
+
+                # Split the remaining cells in 8
+                origins = (origins[~is_leaf, np.newaxis] + size//2*CORNERS).reshape(-1, 3)
+                size //= 2
+
+        for level, (keys, values) in enumerate(leaves):
+            keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+            values = np.concatenate(values) if values else np.empty((0, 8))
+
+            order = np.argsort(keys)
+
+            self._leaves.append((coarse_size >> level, keys[order], values[order]))
+
+    def __call__(self, ha, dec, dome_az):
+        """
+        Interpolate the obstruction at arbitrary coordinates; NaN if a
+        corner (w/ a non-zero weight) of the leaf is masked.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        dome_az (float ndarray): dome azimuths (clockwise convention)
+        """
+        ha, dec, dome_az = np.broadcast_arrays(ha, dec, dome_az)
+
+        shape = ha.shape
+
+        coordinates = np.stack([
+            np.ravel(dome_az)/self.step % self._n_az,
+            np.ravel(ha)/self.step % self._n_ha,
+            np.clip((np.ravel(dec) + 90)/self.step, 0, self._n_dec),
+        ], axis=-1)
+
+        ratio = np.full(coordinates.shape[0], np.nan)
+        todo = np.arange(coordinates.shape[0])
+
+        for size, keys, values in self._leaves:
+            if not todo.size or not keys.size:
+                continue
+
+            # The cell of each point at this level; points on the upper Dec boundary belong to the last cell
+            cell = np.floor(coordinates[todo]/size).astype(np.int64)
+            cell[:, 2] = np.minimum(cell[:, 2], self._n_dec//size - 1)
+
+            index = np.minimum(np.searchsorted(keys, self._encode(*cell.T)), keys.size - 1)
+            is_leaf = keys[index] == self._encode(*cell.T)
+
+            # Trilinear interpolation between the corners of the leaf
+            fraction = coordinates[todo[is_leaf]]/size - cell[is_leaf]
+            weights = np.prod(np.where(CORNERS, fraction[:, np.newaxis], 1 - fraction[:, np.newaxis]), axis=-1)
+
+            ratio[todo[is_leaf]] = np.sum(np.where(weights > 0, weights*values[index[is_leaf]], 0), axis=-1)
+
+            todo = todo[~is_leaf]
+
+        return ratio.reshape(shape)
+
+    def resample(self, azimuths, ha, dec):
+        """
+        Resample the obstruction to a regular cube, indexed as (az, ha, dec),
+        like the cube generated by obstruction_grid.py.
+
+        Parameters
+        ----------
+
+        azimuths (float ndarray): 1d array of dome azimuths (clockwise convention)
+        ha (float ndarray): 1d array of hour angles in degrees
+        dec (float ndarray): 1d array of declinations in degrees
+        """
+        ha_grid, dec_grid = np.meshgrid(ha, dec, indexing='ij')
+
+        cube = np.empty((np.size(azimuths), np.size(ha), np.size(dec)))
+
+        for i, az in enumerate(np.ravel(azimuths)):
+            cube[i] = self(ha_grid, dec_grid, az)
+
+        return cube
+
+    def get_statistics(self):
+        """Return the no. evaluated vertices and the no. leaf cells per cell size (in degrees)."""
+        return {
+            'evaluations': self._n_evaluations,
+            'leaves': {size*self.step: int(keys.size) for size, keys, _ in self._leaves},
+        }
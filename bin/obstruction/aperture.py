@@ -1,39 +1,31 @@
-import enum, configparser
+import enum, warnings
 import numpy as np
-import matplotlib.pyplot as plt
 
+from obstruction.config import load_geometry, resolve_geometry
+from obstruction.stats import STATS
 from obstruction.transformations import vec3, vec4, transform, rot_x, rot_z
-from pytransform3d import transformations as pt
 
-# Load the geometry parameters of the telescope/dome
-config = configparser.ConfigParser()
-config.read('resources/config.ini')
 
-# Telescope:
-L_1 = config['mount'].getfloat('length_1') # distance floor-HA axis
-L_2 = config['mount'].getfloat('length_2') # distance HA axis-Dec axis
-L_3 = config['mount'].getfloat('length_3') # distance Dec axis-tube center
-L_4 = config['guider'].getfloat('offset') # distance primary tube center-guider center
-L_5 = config['finder'].getfloat('offset') # distance guider center-finder center
+# Module-level names of the geometry parameters (for backwards compatibility), 
+# resolved lazily from the cached config; see obstruction.config
+_GEOMETRY_NAMES = {
+    'L_1': 'l_1', 'L_2': 'l_2', 'L_3': 'l_3', 'L_4': 'l_4', 'L_5': 'l_5',
+    'APERTURE_RADIUS': 'aperture_radius', 'APERTURE_SEC_RADIUS': 'aperture_sec_radius',
+    'GUIDER_RADIUS': 'guider_radius', 'GUIDER_SEC_RADIUS': 'guider_sec_radius',
+    'FINDER_RADIUS': 'finder_radius',
+    'RADIUS': 'radius', 'EXTENT': 'extent', 'SLIT_WIDTH': 'slit_width',
+    'LAT': 'latitude',
+}
 
-GUIDER_ANGLE = np.radians(config['guider'].getfloat('angle'))
-FINDER_ANGLE =  np.radians(config['finder'].getfloat('angle'))
 
-APERTURE_RADIUS = config['telescope'].getfloat('diameter')/2
-APERTURE_SEC_RADIUS = config['telescope'].getfloat('sec_diameter')/2
+def __getattr__(name):
+    if name in _GEOMETRY_NAMES:
+        return getattr(load_geometry(), _GEOMETRY_NAMES[name])
 
-GUIDER_RADIUS = config['guider'].getfloat('diameter')/2
-GUIDER_SEC_RADIUS = config['guider'].getfloat('sec_diameter')/2
+    if name in ('GUIDER_ANGLE', 'FINDER_ANGLE'):
+        return np.radians(getattr(load_geometry(), name.lower()))
 
-FINDER_RADIUS = config['finder'].getfloat('diameter')/2
-
-# Dome:
-RADIUS = config['dome'].getfloat('diameter')/2   # radius
-EXTENT = config['dome'].getfloat('extent')  # extent of cylindrical dome wall
-SLIT_WIDTH = config['dome'].getfloat('slit_width') # Slit width
-
-# Observatory:
-LAT = config['observatory'].getfloat('latitude') # degrees
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 class Instruments(enum.Enum):
@@ -47,7 +39,7 @@ class Instruments(enum.Enum):
         return c.TELESCOPE
 
 
-def plot_aperture(ap_x, ap_z, is_blocked, aperture_r, dome_az):
+def plot_aperture(ap_x, ap_z, is_blocked, aperture_r, dome_az, weights=None):
     """"Plot the aperture w/ obstructed sample points.
     
     Parameters
@@ -57,8 +49,15 @@ def plot_aperture(ap_x, ap_z, is_blocked, aperture_r, dome_az):
     is_blocked: boolean array of len(ap_x) signifying whether a point is obstructed
     aperture_r: radius of the aperture in meters
     dome_az: position of the dome (azimuth angle in deg)
+    weights: the fraction of the aperture each point represents; equal weights if None
     """
-    percentage = is_blocked[is_blocked].size/is_blocked.size
+    # Import matplotlib only when plotting; it dominates the import time
+    import matplotlib.pyplot as plt
+
+    if weights is None:
+        weights = np.full(is_blocked.size, 1/is_blocked.size)
+
+    percentage = is_blocked @ weights
 
     fig = plt.figure(figsize=(4.5, 4.5), num='MOCCA - Visualisation')
     frame = fig.add_subplot(1, 1, 1)
@@ -81,7 +80,16 @@ def plot_aperture(ap_x, ap_z, is_blocked, aperture_r, dome_az):
     plt.show()
 
 
-def find_intersection(point, direction):
+def _count_intersection(branch, t):
+    """Count a ray traced by find_intersection, its branch, and whether the intersection is NaN."""
+    STATS.count('rays')
+    STATS.count(branch)
+
+    if not np.isfinite(t):
+        STATS.count('errors.nan_intersection')
+
+
+def find_intersection(point, direction, geometry=None):
     """Find ray-capsule (i.e. ray-dome) intersection.
     
     Parameters
@@ -89,6 +97,7 @@ def find_intersection(point, direction):
 
     point: ray origin (3-vector)
     direction: ray unit direction vector
+    geometry: the Geometry of the dome | default: from the config
 
     Returns
     -------
@@ -98,29 +107,45 @@ def find_intersection(point, direction):
     """
     has_intersection = False
     t = None
+
+    geometry = resolve_geometry(geometry)
+    radius, extent = geometry.radius, geometry.extent
     
+    # A negative discriminant (i.e. an origin outside of the dome) yields NaN; Aperture.obstruction
+    # silences the numpy warnings once per pose, and the NaN is counted as an error (if enabled)
+
     # In case the ray is ~parallel to the dome z-axis
     if np.isclose(direction[0], 0) and np.isclose(direction[1], 0):
-        z = EXTENT + np.sqrt(RADIUS**2 - point[0]**2 - point[1]**2)
+        z = extent + np.sqrt(radius**2 - point[0]**2 - point[1]**2)
         t = z - point[2]
-        
+
+        if STATS.enabled:
+            _count_intersection('branch.parallel', t)
+
         has_intersection = True
         return has_intersection, t
     
     # If the direction vector is not (nearly) parallel to the dome z-axis
     a2 = direction[0]**2 + direction[1]**2
     a1 = point[0]*direction[0] + point[1]*direction[1]
-    a0 = point[0]**2 + point[1]**2 - RADIUS**2
+    a0 = point[0]**2 + point[1]**2 - radius**2
     
     delta = a1**2-a0*a2
     t     = (-a1+np.sqrt(delta))/a2
     
-    if point[2] + t * direction[2] >= EXTENT:
-        a0 = point[0]**2 + point[1]**2 + (point[2] - EXTENT)**2 - RADIUS**2
-        a1 = point[0]*direction[0] + point[1]*direction[1] + (point[2] - EXTENT)*direction[2]
+    branch = 'branch.cylinder'
+
+    if point[2] + t * direction[2] >= extent:
+        a0 = point[0]**2 + point[1]**2 + (point[2] - extent)**2 - radius**2
+        a1 = point[0]*direction[0] + point[1]*direction[1] + (point[2] - extent)*direction[2]
         
         t = -a1+np.sqrt(a1**2-a0)
-    
+
+        branch = 'branch.hemisphere'
+
+    if STATS.enabled:
+        _count_intersection(branch, t)
+
     if t:
         has_intersection = True
     
@@ -135,6 +160,586 @@ def get_ray_intersection(point, direction, t):
     return point + t*direction
 
 
+def find_intersections(points, directions, geometry=None):
+    """Find ray-capsule (i.e. ray-dome) intersections for arrays of rays.
+
+    Vectorized counterpart of find_intersection; the leading dimensions 
+    of points and directions are broadcast against each other.
+
+    Parameters
+    -----------
+
+    points: ray origins, array of shape (..., 3)
+    directions: ray unit direction vectors, array of shape (..., 3)
+    geometry: the Geometry of the dome | default: from the config
+
+    Returns
+    -------
+
+    has_intersection: boolean array signifying whether there is an intersection
+    t               : distances between the ray origins and intersections
+    """
+    px, py, pz = np.moveaxis(points, -1, 0)
+    dx, dy, dz = np.moveaxis(directions, -1, 0)
+
+    geometry = resolve_geometry(geometry)
+    radius, extent = geometry.radius, geometry.extent
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Rays ~parallel to the dome z-axis
+        is_parallel = np.isclose(dx, 0) & np.isclose(dy, 0)
+        t_parallel = extent + np.sqrt(radius**2 - px**2 - py**2) - pz
+
+        # Intersection with the cylindrical dome wall
+        a2 = dx**2 + dy**2
+        a1 = px*dx + py*dy
+        a0 = px**2 + py**2 - radius**2
+
+        t = (-a1 + np.sqrt(a1**2 - a0*a2))/a2
+
+        # Intersection with the hemispherical dome top
+        is_above = pz + t*dz >= extent
+
+        a0 = px**2 + py**2 + (pz - extent)**2 - radius**2
+        a1 = px*dx + py*dy + (pz - extent)*dz
+
+        t = np.where(is_above, -a1 + np.sqrt(a1**2 - a0), t)
+        t = np.where(is_parallel, t_parallel, t)
+
+    if STATS.enabled:
+        shape = np.broadcast_shapes(is_parallel.shape, t.shape)
+
+        STATS.count('rays', np.prod(shape))
+        STATS.count('branch.parallel', np.sum(np.broadcast_to(is_parallel, shape)))
+        STATS.count('branch.hemisphere', np.sum(is_above & ~is_parallel))
+        STATS.count('branch.cylinder', np.sum(~is_above & ~is_parallel))
+        STATS.count('errors.nan_intersection', np.sum(~np.isfinite(t)))
+
+    has_intersection = t != 0
+
+    return has_intersection, t
+
+
+def get_ray_intersections(points, directions, t):
+    """
+    Return the ray intersections, based on arrays of origins 
+    (points), directions, and distances t (of shape points.shape[:-1]).
+    """
+    return points + t[..., np.newaxis]*directions
+
+
+@STATS.timed('slit')
+def is_in_slit(points, dome_az, geometry=None):
+    """
+    Checks whether dome intersection points lie in the slit.
+
+    Parameters
+    ----------
+
+    points: intersection points in the dome frame, array of shape (..., 3)
+    dome_az: dome azimuth (clockwise convention), broadcastable to points.shape[:-1]
+    geometry: the Geometry of the dome | default: from the config
+    """
+    az_corrected = np.radians((dome_az - 180) % 360) # Correction assuming the azimuth is zero at the South
+    c, s = np.cos(az_corrected), np.sin(az_corrected)
+
+    x, y, z = np.moveaxis(points, -1, 0)
+
+    geometry = resolve_geometry(geometry)
+    radius, extent, slit_width = geometry.radius, geometry.extent, geometry.slit_width
+
+    with np.errstate(invalid='ignore'):
+        x_rot = c*x - s*y
+        y_rot = s*x + c*y
+
+        r = radius * np.sin(np.radians(15))
+
+        x_cond = (-slit_width/2 < x_rot) & (x_rot < slit_width/2)
+        y_cond = (-r < y_rot) & (y_rot < radius)
+
+        return (z > extent) & x_cond & y_cond
+
+
+@STATS.timed('trace')
+def trace_rays(poses, local, local_directions, geometry=None):
+    """
+    Trace rays, defined in the frame of a stack of poses, to their 
+    intersections with the dome.
+
+    Parameters
+    ----------
+
+    poses (float ndarray): stack of poses (see Aperture._transform), of shape (n, 4, 4)
+    local (float ndarray): homogeneous ray origins in the frame of the poses, of shape (m, 4)
+    local_directions (float ndarray): ray directions in the frame of the poses, of shape (3,) or (m, 3)
+    geometry (Geometry): the geometry of the dome | default: from the config
+
+    Returns
+    -------
+
+    has_intersection: boolean array of shape (n, m)
+    points: intersection points in the dome frame, of shape (n, m, 3)
+    """
+    origins = np.swapaxes(poses[:, :3, :] @ local.T, 1, 2)
+
+    if local_directions.ndim == 1:
+        directions = (poses[:, :3, :3] @ local_directions)[:, np.newaxis]
+    else:
+        directions = np.swapaxes(poses[:, :3, :3] @ local_directions.T, 1, 2)
+
+    has_intersection, t = find_intersections(origins, directions, geometry)
+
+    return has_intersection, get_ray_intersections(origins, directions, t)
+
+
+@STATS.timed('arcs')
+def slit_azimuth_arcs(points, has_intersection, geometry=None):
+    """
+    Compute, for dome intersection points, the arcs of dome azimuths for 
+    which the points lie in the slit (cf. is_in_slit). In the frame rotated 
+    with the dome, a point at distance rho from the dome axis lies in the slit 
+    if |sin(alpha)| < (slit_width/2)/rho and cos(alpha) > -r/rho, where alpha 
+    is its angle w.r.t. the slit center line; i.e. a central arc and (possibly) 
+    two arcs on the far side of the zenith.
+
+    Parameters
+    ----------
+
+    points: intersection points in the dome frame, array of shape (..., 3)
+    has_intersection: boolean array of shape points.shape[:-1]
+
+    Returns
+    -------
+
+    start: dome azimuths (clockwise convention) at which the arcs start, of shape (..., 3)
+    length: angular lengths of the arcs in degrees (zero for empty arcs), of shape (..., 3)
+    """
+    x, y, z = np.moveaxis(points, -1, 0)
+
+    geometry = resolve_geometry(geometry)
+    radius, extent, slit_width = geometry.radius, geometry.extent, geometry.slit_width
+
+    r = radius * np.sin(np.radians(15))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = np.hypot(x, y)
+        phi = np.arctan2(y, x)
+
+        a = np.arcsin(np.minimum(slit_width/2/rho, 1))
+        b = np.arccos(np.minimum(r/rho, 1))
+
+    # Arcs in alpha: (-a, a), (pi - a, pi - b) & (-pi + b, -pi + a)
+    alpha_start = np.stack([-a, np.pi - a, -np.pi + b], axis=-1)
+    length = np.stack([2*a, a - b, a - b], axis=-1)
+
+    # Rays that never pass through the slit
+    is_reachable = has_intersection & (z > extent)
+    length = np.where(is_reachable[..., np.newaxis] & (length > 0), np.degrees(length), 0)
+
+    # The rotation angle of the dome is alpha + 90 deg - phi; see is_in_slit for the az correction
+    start = (np.degrees(alpha_start + np.pi/2 - phi[..., np.newaxis]) + 180) % 360
+    start = np.where(length > 0, start, 0)
+
+    return start, length
+
+
+def _ball_exit(centers, directions, radius, ball_centers, geometry):
+    """
+    Lower bound of the distances between the origins of a bundle of
+    parallel rays and their exits from a ball of the dome radius (inside
+    the dome); zero if not all origins lie within the ball.
+    """
+    w = centers - ball_centers
+    w_parallel = np.sum(w*directions, axis=-1)
+    w_perpendicular = np.sqrt(np.maximum(np.sum(w**2, axis=-1) - w_parallel**2, 0))
+
+    margin = geometry.radius**2 - (w_perpendicular + radius)**2
+
+    with np.errstate(invalid='ignore'):
+        t_min = -w_parallel + np.sqrt(margin)
+
+    return np.where((margin - w_parallel**2 > 0) & (t_min > 0), t_min, 0)
+
+
+def bundle_extent(centers, directions, radius, geometry=None):
+    """
+    Bound the distances between the origins of a bundle of parallel
+    rays and their intersections with the dome, from its central ray only.
+    The origins lie in a disk (perpendicular to the rays) inside the dome.
+    The dome is convex, hence the supporting plane at the intersection of
+    the central ray bounds the distances from above. The dome contains any
+    ball of its radius centered on its axis (below the top), e.g. the one
+    tangent at that intersection, which bound the distances from below.
+
+    Parameters
+    ----------
+
+    centers (float ndarray): centers of the disks of ray origins, of shape (..., 3)
+    directions (float ndarray): ray unit direction vectors, of shape (..., 3)
+    radius (float): radius of the disks
+    geometry (Geometry): the geometry of the dome | default: from the config
+
+    Returns
+    -------
+
+    t_min: lower bounds of the distances; zero if there is no valid bound
+    t_max: upper bounds of the distances; infinite if there is no valid bound
+    """
+    geometry = resolve_geometry(geometry)
+
+    has_intersection, t = find_intersections(centers, directions, geometry)
+    q = get_ray_intersections(centers, directions, t)
+
+    # The center of the tangent ball, on the dome axis, & the outward normal at the intersection
+    tangent_center = np.zeros(q.shape)
+    tangent_center[..., 2] = np.minimum(q[..., 2], geometry.extent)
+
+    normal = (q - tangent_center)/geometry.radius
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_normal = np.sum(normal*directions, axis=-1)
+        sin_normal = np.sqrt(np.maximum(1 - cos_normal**2, 0))
+
+        t_max = t + radius*sin_normal/cos_normal
+
+    # The ball at the height of the origins
+    level_center = np.zeros(np.shape(centers))
+    level_center[..., 2] = np.minimum(centers[..., 2], geometry.extent)
+
+    t_min = np.maximum(
+        _ball_exit(centers, directions, radius, tangent_center, geometry),
+        _ball_exit(centers, directions, radius, level_center, geometry)
+    )
+
+    # Rays ~parallel to the dome z-axis are intersected w/ an approximation; see find_intersections
+    is_parallel = np.isclose(directions[..., 0], 0) & np.isclose(directions[..., 1], 0)
+
+    # W/o (valid) bounds, the rays still run forwards from origins inside the dome
+    t_min = np.where(is_parallel, 0, t_min)
+    t_max = np.where(has_intersection & ~is_parallel & (cos_normal > 0), t_max, np.inf)
+
+    return t_min, t_max
+
+
+# Classes of the fast-path pre-test of a pose; see classify_bundles
+AMBIGUOUS = 0
+CLEAR = 1
+BLOCKED = 2
+
+# Safety margin (in meters) of the fast-path pre-test w.r.t. the edges of the slit
+FAST_PATH_MARGIN = 1e-9
+
+
+@STATS.timed('classify')
+def classify_bundles(centers, directions, radius, dome_az, geometry=None):
+    """
+    Conservatively classify bundles of parallel rays as entirely passing
+    through the slit (CLEAR), entirely missing it (BLOCKED), or AMBIGUOUS,
+    w/o tracing the individual rays. The intersections of a bundle lie
+    within the disk of origins shifted over the bounds of bundle_extent;
+    each of the (linear) conditions of is_in_slit is evaluated over that cylinder.
+    Only the ambiguous bundles have to be traced.
+
+    Parameters
+    ----------
+
+    centers (float ndarray): centers of the disks of ray origins, of shape (..., 3)
+    directions (float ndarray): ray unit direction vectors, of shape (..., 3)
+    radius (float): radius of the disks
+    dome_az (float ndarray): dome azimuths (clockwise convention), broadcastable to centers.shape[:-1]
+    geometry (Geometry): the geometry of the dome | default: from the config
+
+    Returns
+    -------
+
+    classes (int8 ndarray): AMBIGUOUS, CLEAR, or BLOCKED, of the broadcast shape of centers.shape[:-1] & dome_az
+    """
+    geometry = resolve_geometry(geometry)
+
+    t_min, t_max = bundle_extent(centers, directions, radius, geometry)
+
+    az_corrected = np.radians((np.asarray(dome_az) - 180) % 360)
+    c, s = np.cos(az_corrected), np.sin(az_corrected)
+
+    zero = np.zeros(np.shape(c))
+    one = np.ones(np.shape(c))
+
+    r = geometry.radius * np.sin(np.radians(15))
+
+    # The conditions of is_in_slit as (normal, offset) s.t. normal . point + offset > 0
+    conditions = [
+        ((zero, zero, one), -geometry.extent),
+        ((-c, s, zero), geometry.slit_width/2),
+        ((c, -s, zero), geometry.slit_width/2),
+        ((s, c, zero), r),
+        ((-s, -c, zero), geometry.radius),
+    ]
+
+    x, y, z = np.moveaxis(centers, -1, 0)
+    dx, dy, dz = np.moveaxis(directions, -1, 0)
+
+    is_clear = True
+    is_blocked = False
+
+    for (nx, ny, nz), offset in conditions:
+        value = nx*x + ny*y + nz*z + offset
+        along = nx*dx + ny*dy + nz*dz
+
+        # Extent of the condition over the disk of origins & over the distances
+        across = radius*np.sqrt(np.maximum(nx**2 + ny**2 + nz**2 - along**2, 0))
+
+        with np.errstate(invalid='ignore'):
+            lower = value - across + np.where(along >= 0, t_min*along, t_max*along)
+            upper = value + across + np.where(along >= 0, t_max*along, t_min*along)
+
+        is_clear = is_clear & (lower > FAST_PATH_MARGIN)
+        is_blocked = is_blocked | (upper < -FAST_PATH_MARGIN)
+
+    return np.where(is_clear, CLEAR, np.where(is_blocked, BLOCKED, AMBIGUOUS)).astype(np.int8)
+
+
+def count_paths(classes):
+    """Return the no. poses per path of the fast-path pre-test, see classify_bundles."""
+    return {
+        'clear': int(np.count_nonzero(classes == CLEAR)),
+        'blocked': int(np.count_nonzero(classes == BLOCKED)),
+        'traced': int(np.count_nonzero(classes == AMBIGUOUS)),
+    }
+
+
+# Max. & min. resolution of the integer ray weights, i.e. the mean weight; see Aperture._weight_units
+RAY_WEIGHT_UNITS = 64
+MIN_RAY_WEIGHT_UNITS = 4
+
+
+def weight_scale(area, limit):
+    """
+    Return the largest scale (up to RAY_WEIGHT_UNITS) of the relative 
+    ray areas, s.t. the sum of the integer weights (at least one per 
+    ray) does not exceed limit; zero if there is none.
+
+    Parameters
+    ----------
+
+    area (float ndarray): the area of each ray over the mean area
+    limit (int): max. sum of the weights
+    """
+    def total(scale):
+        return np.maximum(np.rint(scale*area), 1).sum()
+
+    if total(RAY_WEIGHT_UNITS) <= limit:
+        return RAY_WEIGHT_UNITS
+
+    if total(0) > limit:
+        return 0.
+
+    # The sum is non-decreasing in the scale
+    low, high = 0., float(RAY_WEIGHT_UNITS)
+
+    for _ in range(50):
+        middle = (low + high)/2
+
+        if total(middle) <= limit:
+            low = middle
+        else:
+            high = middle
+
+    return low
+
+# Two-sided 95% quantiles of Student's t distribution, by the no. degrees of freedom
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131}
+
+
+def radical_inverse(index, base):
+    """
+    Return the radical inverse of (positive) integer indices in a base, 
+    i.e. a coordinate of the (low-discrepancy) Halton sequence.
+    """
+    index = np.array(index, dtype=np.int64)
+    inverse = np.zeros(index.shape)
+
+    factor = 1.
+
+    while np.any(index > 0):
+        factor /= base
+
+        inverse += factor*(index % base)
+        index //= base
+
+    return inverse
+
+
+class AzimuthProfile:
+    """
+    Piecewise-constant obstruction as a function of the dome azimuth 
+    for a stack of poses; the obstruction can be evaluated at any azimuth 
+    and the transition azimuths are exact.
+    """
+    def __init__(self, start, length, weights):
+        """"The AzimuthProfile class constructor.
+
+        Parameters
+        ----------
+
+        start (float ndarray): arc start azimuths, of shape (poses, arcs)
+        length (float ndarray): arc lengths in degrees, of shape (poses, arcs)
+        weights (float ndarray): the weight of each arc, i.e. the fraction of the aperture (of its ray), of shape (poses, arcs)
+        """
+        n_poses = start.shape[0]
+
+        weights = np.where(length > 0, weights, 0)
+
+        end = start + length
+        wraps = end >= 360
+
+        # Arcs wrapping around 360 deg contribute from azimuth 0 onwards
+        self._base = (weights*wraps).sum(axis=1)
+
+        angles = np.concatenate([start, end % 360], axis=1)
+        deltas = np.concatenate([weights, -weights], axis=1)
+
+        order = np.argsort(angles, axis=1, kind='stable')
+
+        self._angles = np.take_along_axis(angles, order, axis=1)
+        self._clear = np.cumsum(np.take_along_axis(deltas, order, axis=1), axis=1) + self._base[:, np.newaxis]
+
+        # Sorted keys to look up arbitrary (pose, azimuth) pairs at once
+        self._n_events = angles.shape[1]
+        self._keys = (self._angles + 360*np.arange(n_poses)[:, np.newaxis]).ravel()
+
+    def __len__(self):
+        return self._angles.shape[0]
+
+    def __call__(self, azimuths):
+        """
+        Evaluate the % obstruction at a vector of dome azimuths.
+
+        Parameters
+        ----------
+
+        azimuths (float ndarray): 1d array of dome azimuths (clockwise convention)
+
+        Returns
+        -------
+
+        ratio (float ndarray): the obstruction ratios, of shape (poses, azimuths.size)
+        """
+        azimuths = np.ravel(azimuths) % 360
+
+        offsets = 360*np.arange(len(self))[:, np.newaxis]
+        first = self._n_events*np.arange(len(self))[:, np.newaxis]
+
+        idx = np.searchsorted(self._keys, azimuths + offsets, side='right')
+
+        clear = np.where(idx > first, self._clear.ravel()[idx - 1], self._base[:, np.newaxis])
+
+        return np.clip(1 - clear, 0, 1)
+
+    def segments(self, index):
+        """
+        Return the transition azimuths and the % obstruction from 
+        each transition up to the next for a single pose.
+
+        Parameters
+        ----------
+
+        index (int): index of the pose
+        """
+        angles = self._angles[index]
+        clear = self._clear[index]
+
+        # Keep the last event at each unique transition azimuth; adjoining arcs meet up to rounding
+        is_last = np.append(~np.isclose(angles[1:], angles[:-1]), True)
+        angles, clear = angles[is_last], clear[is_last]
+
+        ratio = np.clip(1 - clear, 0, 1)
+
+        # Remove transitions that do not change the obstruction
+        is_change = ~np.isclose(ratio, np.roll(ratio, 1))
+
+        if not is_change.any():
+            return np.zeros(1), ratio[:1]
+
+        return angles[is_change], ratio[is_change]
+
+
+@STATS.timed('poses')
+def telescope_poses(ha, dec, geometry=None):
+    """"Get the (stack of) transformation matrices to the telescope aperture.
+
+    The poses of the other apertures are fixed offsets w.r.t. these, 
+    see Aperture._transform.
+
+    Parameters
+    ----------
+
+    ha (float ndarray): hour angles in degrees
+    dec (float ndarray): declinations in degrees
+    geometry (Geometry): the geometry of the mount | default: from the config
+
+    Returns
+    -------
+
+    H (float ndarray): the poses, of shape (*broadcast shape of ha & dec, 4, 4)
+    """
+    geometry = resolve_geometry(geometry)
+
+    H_01 = transform(0, 0, geometry.l_1) @ rot_x(90-geometry.latitude)
+    H_12 = rot_z(-np.asarray(ha)) @ transform(0, 0, geometry.l_2)
+    H_23 = rot_x(dec) @ transform(-geometry.l_3, 0, 0)
+
+    H = H_01 @ H_12 @ H_23
+
+    return H
+
+
+def pose_altitude(ha, dec, geometry=None):
+    """
+    Return the altitude of the optical axis (i.e. the y-axis of the
+    telescope pose) in degrees; the apertures are parallel, hence it
+    is the same for all apertures.
+
+    Parameters
+    ----------
+
+    ha (float ndarray): hour angles in degrees
+    dec (float ndarray): declinations in degrees
+    geometry (Geometry): the geometry of the mount | default: from the config
+    """
+    direction = telescope_poses(ha, dec, geometry)[..., :3, 1]
+
+    return np.degrees(np.arcsin(np.clip(direction[..., 2], -1, 1)))
+
+
+def within_limits(ha, dec, geometry=None):
+    """
+    Return whether poses are within the limits of the geometry, i.e.
+    above the min. altitude and within the max. |hour angle|; poses
+    outside of the limits are masked in the obstruction grid.
+
+    Parameters
+    ----------
+
+    ha (float ndarray): hour angles in degrees
+    dec (float ndarray): declinations in degrees
+    geometry (Geometry): the geometry (w/ the limits) | default: from the config
+    """
+    geometry = resolve_geometry(geometry)
+
+    ha_centered = (np.asarray(ha) + 180) % 360 - 180
+
+    return (pose_altitude(ha, dec, geometry) >= geometry.min_altitude) & (np.abs(ha_centered) <= geometry.max_hour_angle)
+
+
+def guider_offset(geometry=None):
+    """Return the transformation from the telescope aperture to the guider aperture."""
+    geometry = resolve_geometry(geometry)
+
+    angle = np.radians(geometry.guider_angle)
+
+    return transform(geometry.l_4*np.cos(angle), 0, geometry.l_4*np.sin(angle))
+
+
 class Aperture:
     """Class representing the telescope aperture.
     
@@ -142,9 +747,16 @@ class Aperture:
     --------------
 
     obstruction (float): return the % obstruction of the aperture by the dome
+    obstruction_batch (ndarray): return the % obstruction for arrays of poses
+    obstruction_estimate (tuple): return the % obstruction & its error for arrays of poses, w/ an adaptive no. rays
+    obstruction_profile (ndarray): return the % obstruction for arrays of poses & a vector of dome azimuths
+    azimuth_profile (AzimuthProfile): return the exact obstruction vs dome azimuth for arrays of poses
     get_name (str): return an aperture "name"/identifier
+    get_parameters (dict): return the parameters the obstruction of the aperture depends on
+    get_ray_count (int): return the no. rays traced per pose
+    get_weight_denominator (int): return the common denominator of the ray weights
     """
-    def __init__(self, radius, sec_radius=0, rate=3):
+    def __init__(self, radius, sec_radius=0, rate=3, geometry=None):
         """"The Aperture class constructor.
         
         Parameters
@@ -153,18 +765,32 @@ class Aperture:
         radius (float): aperture radius in meters
         sec_radius (float): radius of secondary obstruction in meters
         rate (int): aperture sample rate (in terms of no. radial circles around the center)
+        geometry (Geometry): the geometry of the mount & dome | default: from the config
         """
         self.radius = radius 
         self.sec_radius = sec_radius
         self.sample_rate = rate
+        self.geometry = resolve_geometry(geometry)
 
         self._name = None
 
+        # Constant transformation from the telescope aperture to this aperture
+        self._offset = transform(0, 0, 0)
+
+        # Memoized disk samples & ray templates, keyed by the sampling parameters
+        self._samples = {}
+
+        # No. poses (or pose-azimuth pairs) per path of the fast-path pre-test; see classify_bundles
+        self.path_counts = count_paths(np.empty(0))
+
         # Add a vectorized instance of the _is_ray_blocked function
-        self._is_blocked = np.vectorize(self._is_ray_blocked, signature='(d),(),(),()->()')
+        self._is_blocked = np.vectorize(self._is_ray_blocked, signature='(d),(d),()->()')
 
     def _transform(self, ha, dec):
         """"Get the transformation matrix to the aperture.
+
+        The hour angle & declination may be arrays, in which case a 
+        stack of matrices of shape (..., 4, 4) is returned.
         
         Parameters
         ----------
@@ -172,11 +798,7 @@ class Aperture:
         ha (float): hour angle in degrees
         dec (float): declination in degrees
         """
-        H_01 = transform(0, 0, L_1)
-        H_12 = rot_x(90-LAT) @ rot_z(-ha) @ transform(0, 0, L_2)
-        H_23 = rot_x(dec) @ transform(-L_3, 0, 0)
-
-        H = H_01 @ H_12 @ H_23
+        H = telescope_poses(ha, dec, self.geometry) @ self._offset
 
         return H
 
@@ -192,11 +814,40 @@ class Aperture:
         """
         if not 0 <= r_min < 1:
             raise ValueError('r_min should be between 0 and 1...')
-        
+
+        key = ('disk', self.sample_rate, self.radius, r_min)
+
+        if key not in self._samples:
+            xy, area = self._compute_disk_samples(r_min)
+
+            xy.flags.writeable = False
+            area.flags.writeable = False
+
+            self._samples[key] = xy
+            self._samples[('disk_area',) + key[1:]] = area
+
+        return self._samples[key]
+
+    def _sample_areas(self, r_min=0):
+        """
+        Return the (memoized) area of the aperture each of the disk 
+        samples represents, as a fraction of the unit disk; see _sample_disk.
+        """
+        self._sample_disk(r_min)
+
+        return self._samples[('disk_area', self.sample_rate, self.radius, r_min)]
+
+    def _compute_disk_samples(self, r_min):
+        """
+        Compute the equidistant disk samples & the area each of 
+        them represents, i.e. the annulus around its ring (halfway to 
+        the adjacent rings) divided over the points on the ring; see _sample_disk.
+        """
         dr = 1/self.sample_rate
         
         x = np.empty(0)
         y = np.empty(0)
+        area = np.empty(0)
         
         rs = np.linspace(r_min, 1, self.sample_rate) 
         k = np.ceil(r_min*(self.sample_rate+1))
@@ -204,28 +855,138 @@ class Aperture:
         if not r_min:
             x = np.concatenate([x, [0]])
             y = np.concatenate([y, [0]])
+            area = np.concatenate([area, [(dr/2)**2]])
             
             rs = np.linspace(dr, 1, self.sample_rate)
             k = 1
+
+        # Boundaries of the annuli of the rings; halfway between the rings
+        edges = np.concatenate([[r_min if r_min else dr/2], (rs[1:] + rs[:-1])/2, [1]])
         
-        for r in rs:
+        for r, r_in, r_out in zip(rs, edges[:-1], edges[1:]):
             n = int(np.round(np.pi/np.arcsin(1/(2*k))))
             
-            theta = np.linspace(0, 2*np.pi, n+1)
+            # n distinct points; the end point of [0, 2 pi] would duplicate the first one
+            theta = np.linspace(0, 2*np.pi, n, endpoint=False)
             
             x_r = r * np.cos(theta)
             y_r = r * np.sin(theta)
             
             x = np.concatenate([x, x_r])
             y = np.concatenate([y, y_r])
+            area = np.concatenate([area, np.full(n, (r_out**2 - r_in**2)/n)])
             
             k += 1
         
         xy = self.radius*np.column_stack([x,y])
         
-        return xy
+        return xy, area
     
-    def _sample_aperture(self, ha, dec, x, z):
+    def _ray_template(self):
+        """
+        Return the (memoized) homogeneous coordinates of the sample 
+        points in the aperture's frame, of shape (no. rays, 4).
+        """
+        key = ('template', self.sample_rate, self.radius, self.sec_radius)
+
+        if key not in self._samples:
+            ap_xz = self._sample_disk(r_min=self.sec_radius/self.radius)
+
+            ap_x, ap_z = ap_xz.T
+
+            local = np.column_stack((-ap_x, np.zeros(ap_x.size), ap_z, np.ones(ap_x.size)))
+            local.flags.writeable = False
+
+            self._samples[key] = local
+
+        return self._samples[key]
+
+    def _weight_units(self):
+        """
+        Return the (memoized) integer weight of each ray, i.e. its area 
+        (see _sample_areas) in units of 1/RAY_WEIGHT_UNITS to ~1/MIN_RAY_WEIGHT_UNITS 
+        of the mean area. Integer weights keep the obstruction ratio a 
+        multiple of one over their sum, s.t. it can be stored as a count; 
+        see get_weight_denominator. The units are as fine as the smallest 
+        count dtype (see obstruction.cube.count_dtype) that fits at least 
+        MIN_RAY_WEIGHT_UNITS per ray allows, e.g. uint8 at the default rate.
+        """
+        key = ('weight_units', self.sample_rate, self.radius, self.sec_radius)
+
+        if key not in self._samples:
+            area = self._sample_areas(r_min=self.sec_radius/self.radius)
+            area = area/area.mean()
+
+            for dtype in (np.uint8, np.uint16, np.uint32):
+                # The max. of the dtype is the sentinel of masked cells, see obstruction.cube.masked_count
+                scale = weight_scale(area, np.iinfo(dtype).max - 1)
+
+                if scale >= MIN_RAY_WEIGHT_UNITS:
+                    break
+
+            units = np.maximum(np.rint(scale*area), 1).astype(np.int64)
+            units.flags.writeable = False
+
+            self._samples[key] = units
+
+        return self._samples[key]
+
+    def _ray_weights(self):
+        """
+        Return the (memoized) weight of each ray, i.e. the 
+        fraction of the aperture (area) it represents.
+        """
+        key = ('weights', self.sample_rate, self.radius, self.sec_radius)
+
+        if key not in self._samples:
+            units = self._weight_units()
+
+            weights = units/units.sum()
+            weights.flags.writeable = False
+
+            self._samples[key] = weights
+
+        return self._samples[key]
+
+    def _blocked_ratio(self):
+        """
+        Return the obstruction ratio of a pose of which all rays are 
+        blocked, computed as in the traced path; i.e. (up to rounding) one.
+        """
+        return (np.ones((1, self.get_ray_count()), dtype=bool) @ self._ray_weights())[0]
+
+    def _classify(self, ha, dec, dome_az):
+        """
+        Classify poses (w/ the broadcast shape of ha, dec & dome_az) as 
+        CLEAR, BLOCKED or AMBIGUOUS w/o tracing their rays; see classify_bundles.
+        """
+        poses = self._transform(ha, dec)
+
+        # The sample points lie in a disk around the origin of the pose; the rays are parallel to its y-axis
+        return classify_bundles(poses[..., :3, 3], poses[..., :3, 1], self.radius, dome_az, self.geometry)
+
+    def _update_path_counts(self, classes):
+        """Add the paths taken by classified poses to the counters."""
+        for path, count in count_paths(classes).items():
+            self.path_counts[path] += count
+
+    def _annulus_template(self, u, v):
+        """
+        Return the homogeneous coordinates of points in the aperture's frame 
+        (cf. _ray_template) for points (u, v) in the unit square, mapped 
+        onto the annulus between sec_radius & radius s.t. uniformly 
+        distributed points are distributed uniformly over its area.
+        """
+        r_min = self.sec_radius/self.radius
+
+        r = self.radius*np.sqrt(r_min**2 + u*(1 - r_min**2))
+        theta = 2*np.pi*v
+
+        ap_x, ap_z = r*np.cos(theta), r*np.sin(theta)
+
+        return np.column_stack((-ap_x, np.zeros(ap_x.size), ap_z, np.ones(ap_x.size)))
+
+    def _sample_aperture(self, pose_matrix, x, z):
         """
         Compute the position of a vector in 
         the aperture's frame.
@@ -233,42 +994,35 @@ class Aperture:
         Parameters
         ----------
 
-        ha (float): hour angle in degrees
-        dec (float): declination in degrees
+        pose_matrix (4x4 ndarray): the aperture pose, see _transform
         x (float ndarray): x coordinate of a point in the aperture
         z (float ndarray): z coordinate of a point in the aperture
         """
         y = np.zeros(x.size)
         dummy = np.ones(x.size)
         points = np.column_stack((x, y, z, dummy))
-        
-        pose_matrix = self._transform(ha, dec)
+
+        from pytransform3d import transformations as pt
 
         product = pt.transform(pose_matrix, points)
 
         return product[:, :3]
     
-    def _aperture_direction(self, ha, dec):
+    def _aperture_direction(self, pose_matrix):
         """
         Return the pointing direction of the aperture
-        in the frame of the dome.
+        in the frame of the dome, i.e. the y-axis of its pose.
 
         Parameters
         ----------
 
-        ha (float): hour angle in degrees
-        dec (float): declination in degrees
+        pose_matrix (4x4 ndarray): the aperture pose, see _transform
         """
-        H_ap = self._transform(ha, dec)
-        H_unit = transform(0, 1, 0)
-
-        H_diff = H_ap @ H_unit - H_ap
-
-        direction = H_diff @ vec4(0, 0, 0)
+        direction = pose_matrix @ vec4(0, 1, 0) - pose_matrix @ vec4(0, 0, 0)
         
         return vec3(direction)
 
-    def _is_ray_blocked(self, point, ha, dec, dome_az):
+    def _is_ray_blocked(self, point, direction, dome_az):
         """
         Checks whether an individual ray is blocked.
 
@@ -276,16 +1030,17 @@ class Aperture:
         ----------
 
         point (3-vector): ray origin
-        ha (float): hour angle in degrees
-        dec (float): declination in degrees
+        direction (3-vector): ray unit direction vector, see _aperture_direction
         dome_az (float): dome azimuth (clockwise convention)
         """
         is_blocked = True
-        
-        direction = self._aperture_direction(ha, dec)
+
+        radius, extent, slit_width = self.geometry.radius, self.geometry.extent, self.geometry.slit_width
+
+        from pytransform3d import transformations as pt
 
         try:
-            has_intersection, t = find_intersection(point, direction)
+            has_intersection, t = find_intersection(point, direction, self.geometry)
 
             if has_intersection:
                 points = get_ray_intersection(point, direction, t)
@@ -298,18 +1053,21 @@ class Aperture:
 
                 product = pt.transform(rot, pp)
                 
-                r = RADIUS * np.sin(np.radians(15))
+                r = radius * np.sin(np.radians(15))
 
-                x_cond = -SLIT_WIDTH/2 < product[:, 0] < SLIT_WIDTH/2
-                y_cond = -r < product[:, 1] < RADIUS
+                x_cond = -slit_width/2 < product[:, 0] < slit_width/2
+                y_cond = -r < product[:, 1] < radius
 
-                is_ray_in_slit = points[2] > EXTENT and x_cond and y_cond
+                is_ray_in_slit = points[2] > extent and x_cond and y_cond
 
                 if is_ray_in_slit:
                     is_blocked = False
                 
         except Exception as ex:
-            print('ERROR OCCURRED DURING _is_blocked CALC...!\nERROR MSG:', str(ex))
+            # Counted rather than printed per ray; the ray is considered blocked
+            STATS.count('errors.' + type(ex).__name__)
+
+            warnings.warn('{} during _is_ray_blocked; the ray is considered blocked (errors are counted, see obstruction.stats)'.format(type(ex).__name__), RuntimeWarning)
             
         return is_blocked
 
@@ -332,66 +1090,383 @@ class Aperture:
         
         ap_x, ap_z = ap_xz.T
 
+        pose_matrix = self._transform(ha, dec)
+
         # Transfor those points to the aperture frame
-        ap_pos = self._sample_aperture(ha, dec, -ap_x, ap_z)
+        ap_pos = self._sample_aperture(pose_matrix, -ap_x, ap_z)
+
+        direction = self._aperture_direction(pose_matrix)
 
-        # Compute the no. rays, emanating from those points, blocked by the dome
-        blocked = self._is_blocked(ap_pos, ha, dec, dome_az)
+        # Compute the rays, emanating from those points, blocked by the dome; weighted by the area they represent
+        # The numpy warnings (e.g. NaN intersections, see find_intersection) are silenced once for all rays
+        with STATS.timer('ray by ray'), np.errstate(invalid='ignore'):
+            blocked = self._is_blocked(ap_pos, direction, dome_az)
     
-        ratio = blocked[blocked].size/blocked.size
+        ratio = float(blocked @ self._ray_weights())
 
         if plot_result:
-            plot_aperture(ap_x, ap_z, blocked, self.radius, dome_az)
+            plot_aperture(ap_x, ap_z, blocked, self.radius, dome_az, weights=self._ray_weights())
 
         return ratio
+
+    def _trace(self, ha, dec):
+        """
+        Trace the rays of the aperture sample points for a 
+        stack of poses to their intersections with the dome.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): 1d array of hour angles in degrees
+        dec (float ndarray): 1d array of declinations in degrees
+
+        Returns
+        -------
+
+        has_intersection: boolean array of shape (ha.size, no. rays)
+        points: intersection points in the dome frame, of shape (ha.size, no. rays, 3)
+        """
+        poses = self._transform(ha, dec)
+
+        # Sample points in the frame of the aperture; the rays are parallel to its y-axis
+        return trace_rays(poses, self._ray_template(), np.array([0., 1., 0.]), self.geometry)
+
+    def obstruction_batch(self, ha, dec, dome_az, chunk_size=4096, fast_path=True):
+        """
+        Compute the % obstruction of the aperture by the dome for 
+        arrays of poses; all rays of all poses are traced as stacked array 
+        operations rather than ray by ray.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        dome_az (float ndarray): dome azimuths (clockwise convention)
+        chunk_size (int): max. no. poses traced at once; bounds the memory usage
+        fast_path (bool): if True, only trace the poses that cannot be classified as fully clear/blocked beforehand, see classify_bundles
+
+        Returns
+        -------
+
+        ratio (float ndarray): the obstruction ratios, of the broadcast shape of ha, dec & dome_az
+        """
+        ha, dec, dome_az = np.broadcast_arrays(ha, dec, dome_az)
+
+        shape = ha.shape
+
+        ha = ha.ravel()
+        dec = dec.ravel()
+        dome_az = dome_az.ravel()
+
+        ratio = np.empty(ha.size)
+
+        for start in range(0, ha.size, chunk_size):
+            index = np.arange(start, min(start + chunk_size, ha.size))
+
+            if fast_path:
+                classes = self._classify(ha[index], dec[index], dome_az[index])
+                self._update_path_counts(classes)
+
+                ratio[index] = np.where(classes == BLOCKED, self._blocked_ratio(), 0.)
+
+                index = index[classes == AMBIGUOUS]
+
+                if not index.size:
+                    continue
+
+            has_intersection, points = self._trace(ha[index], dec[index])
+
+            is_clear = has_intersection & is_in_slit(points, dome_az[index, np.newaxis], self.geometry)
+
+            ratio[index] = ~is_clear @ self._ray_weights()
+
+        return ratio.reshape(shape)
+
+    def obstruction_estimate(self, ha, dec, dome_az, tolerance=0.01, batch_size=4, max_rays=4096, replicates=16, seed=0, chunk_size=1024, fast_path=True):
+        """
+        Estimate the % obstruction of the (continuous) annulus of the aperture 
+        w/ an adaptive no. rays per pose, rather than a fixed sample rate. 
+        Rays are added in batches of quasi-random (Halton) points, in a no. 
+        independently (randomly) shifted replicates, until the 95% confidence 
+        interval, estimated from the spread between the replicates, is smaller 
+        than the tolerance. Poses of which all rays agree (i.e. w/o spread) 
+        are bounded by the "rule of three" instead. Poses that are fully 
+        clear/blocked are not traced at all (w/ zero error), see classify_bundles.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        dome_az (float ndarray): dome azimuths (clockwise convention)
+        tolerance (float): requested half-width of the 95% confidence interval of the obstruction ratio
+        batch_size (int): no. rays added per replicate & batch
+        max_rays (int): max. no. rays per pose (over all replicates)
+        replicates (int): no. randomly shifted replicates, 2 to 16
+        seed (int): seed of the random shifts
+        chunk_size (int): max. no. poses traced at once; bounds the memory usage
+        fast_path (bool): if True, do not trace poses that are fully clear/blocked
+
+        Returns
+        -------
+
+        ratio (float ndarray): the obstruction ratios, of the broadcast shape of ha, dec & dome_az
+        error (float ndarray): the half-widths of the 95% confidence intervals
+        n_rays (int ndarray): the no. rays traced per pose
+        """
+        if replicates - 1 not in T_95:
+            raise ValueError('The no. replicates should be between 2 and 16...')
+
+        ha, dec, dome_az = np.broadcast_arrays(ha, dec, dome_az)
+
+        shape = ha.shape
+
+        ha = ha.ravel()
+        dec = dec.ravel()
+        dome_az = dome_az.ravel()
+
+        ratio = np.zeros(ha.size)
+        error = np.zeros(ha.size)
+        n_rays = np.zeros(ha.size, dtype=int)
+
+        # Cranley-Patterson rotations of the Halton sequence, one per replicate
+        shifts = np.random.default_rng(seed).random((replicates, 2))
+
+        for start in range(0, ha.size, chunk_size):
+            index = np.arange(start, min(start + chunk_size, ha.size))
+
+            if fast_path:
+                classes = self._classify(ha[index], dec[index], dome_az[index])
+                self._update_path_counts(classes)
+
+                ratio[index] = np.where(classes == BLOCKED, 1., 0.)
+
+                index = index[classes == AMBIGUOUS]
+
+            # Poses that are not traced (i.e. if max_rays is less than a single batch) are unknown
+            ratio[index] = np.nan
+            error[index] = np.inf
+
+            poses = self._transform(ha[index], dec[index])
+
+            # The no. blocked rays per replicate & pose
+            blocked = np.zeros((replicates, index.size))
+            last_width = np.full(index.size, np.inf)
+            is_active = np.ones(index.size, dtype=bool)
+
+            n_samples = 0
+
+            while is_active.any() and replicates*(n_samples + batch_size) <= max_rays:
+                sequence = np.arange(n_samples + 1, n_samples + batch_size + 1)
+                u, v = radical_inverse(sequence, 2), radical_inverse(sequence, 3)
+
+                local = np.concatenate([self._annulus_template((u + du) % 1, (v + dv) % 1) for du, dv in shifts])
+
+                has_intersection, points = trace_rays(poses[is_active], local, np.array([0., 1., 0.]), self.geometry)
+
+                is_clear = has_intersection & is_in_slit(points, dome_az[index[is_active], np.newaxis], self.geometry)
+
+                blocked[:, is_active] += (~is_clear).reshape(-1, replicates, batch_size).sum(axis=-1).T
+
+                n_samples += batch_size
+
+                estimates = blocked[:, is_active]/n_samples
+
+                estimate = estimates.mean(axis=0)
+                half_width = T_95[replicates - 1]*estimates.std(axis=0, ddof=1)/np.sqrt(replicates)
+
+                # W/o spread between the replicates, all rays agree; bound the missed fraction by the rule of three
+                is_uniform = np.all(estimates == estimates[:1], axis=0) & ((estimate == 0) | (estimate == 1))
+                half_width = np.where(is_uniform, 3/(replicates*n_samples), half_width)
+
+                active_index = index[is_active]
+
+                # The spread is a noisy estimate itself; stopping at its first dip would understate the error
+                previous = np.where(np.isfinite(last_width[is_active]), last_width[is_active], half_width)
+                last_width[is_active] = half_width
+
+                has_converged = (half_width <= tolerance) & (previous <= tolerance)
+
+                ratio[active_index] = estimate
+                error[active_index] = np.maximum(half_width, previous)
+                n_rays[active_index] = replicates*n_samples
+
+                is_active[is_active] = ~has_converged
+
+        return ratio.reshape(shape), error.reshape(shape), n_rays.reshape(shape)
+
+    def azimuth_profile(self, ha, dec):
+        """
+        Compute the exact, piecewise-constant, % obstruction of the aperture 
+        as a function of the dome azimuth, from the arcs of azimuths for 
+        which each ray passes through the slit.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+
+        Returns
+        -------
+
+        profile (AzimuthProfile): obstruction vs dome azimuth of the (flattened) poses
+        """
+        ha, dec = np.broadcast_arrays(np.ravel(ha), np.ravel(dec))
+
+        has_intersection, points = self._trace(ha, dec)
+
+        start, length = slit_azimuth_arcs(points, has_intersection, self.geometry)
+
+        n_poses = has_intersection.shape[0]
+        weights = np.broadcast_to(np.repeat(self._ray_weights(), 3), start.reshape(n_poses, -1).shape)
+
+        return AzimuthProfile(start.reshape(n_poses, -1), length.reshape(n_poses, -1), weights)
+
+    def obstruction_profile(self, ha, dec, azimuths, chunk_size=256, exact=False, fast_path=True):
+        """
+        Compute the % obstruction of the aperture by the dome for arrays 
+        of poses and a whole vector of dome azimuths. The dome intersections 
+        do not depend on the dome azimuth, hence the rays of each pose 
+        are traced only once.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        azimuths (float ndarray): 1d array of dome azimuths (clockwise convention)
+        chunk_size (int): max. no. poses traced at once; bounds the memory usage
+        exact (bool): if True, evaluate the exact azimuth profile (see azimuth_profile) rather than testing each azimuth
+        fast_path (bool): if True, only test the (pose, azimuth) pairs that cannot be classified as fully clear/blocked beforehand, see classify_bundles
+
+        Returns
+        -------
+
+        ratio (float ndarray): the obstruction ratios, of shape (*broadcast shape of ha & dec, azimuths.size)
+        """
+        ha, dec = np.broadcast_arrays(ha, dec)
+        azimuths = np.ravel(azimuths)
+
+        shape = ha.shape
+
+        ha = ha.ravel()
+        dec = dec.ravel()
+
+        ratio = np.empty((ha.size, azimuths.size))
+
+        for start in range(0, ha.size, chunk_size):
+            sel = slice(start, start + chunk_size)
+
+            if exact:
+                ratio[sel] = self.azimuth_profile(ha[sel], dec[sel])(azimuths)
+                continue
+
+            if fast_path:
+                classes = self._classify(ha[sel, np.newaxis], dec[sel, np.newaxis], azimuths)
+                self._update_path_counts(classes)
+
+                ratio[sel] = np.where(classes == BLOCKED, self._blocked_ratio(), 0.)
+
+                # Only trace the poses w/ ambiguous azimuths, & test only those azimuths
+                pose_index, az_index = np.nonzero(classes == AMBIGUOUS)
+                traced, inverse = np.unique(pose_index, return_inverse=True)
+
+                has_intersection, points = self._trace(ha[sel][traced], dec[sel][traced])
+
+                is_clear = has_intersection[inverse] & is_in_slit(points[inverse], azimuths[az_index, np.newaxis], self.geometry)
+
+                ratio[start + pose_index, az_index] = ~is_clear @ self._ray_weights()
+                continue
+
+            has_intersection, points = self._trace(ha[sel], dec[sel])
+
+            # Evaluate the slit for every azimuth; of shape (poses, azimuths, rays)
+            is_clear = has_intersection[:, np.newaxis] & is_in_slit(points[:, np.newaxis], azimuths[:, np.newaxis], self.geometry)
+
+            ratio[sel] = ~is_clear @ self._ray_weights()
+
+        return ratio.reshape(shape + azimuths.shape)
     
     def get_name(self):
         """Return aperture identifier."""
         return self._name
 
+    def get_ray_count(self):
+        """Return the no. rays traced per pose."""
+        return len(self._ray_template())
+
+    def get_weight_denominator(self):
+        """
+        Return the common denominator of the (area) weights of the rays; 
+        the obstruction ratio is always a multiple of one over this number.
+        """
+        return int(self._weight_units().sum())
+
+    def get_parameters(self):
+        """
+        Return the (geometry) parameters the obstruction of the aperture 
+        depends on, e.g. to check whether stored results are up to date.
+        """
+        geometry = self.geometry
+
+        return {
+            'mount': [geometry.l_1, geometry.l_2, geometry.l_3],
+            'latitude': geometry.latitude,
+            'dome': [geometry.radius, geometry.extent, geometry.slit_width],
+            'radius': self.radius,
+            'sec_radius': self.sec_radius,
+            'rate': self.sample_rate,
+            'n_rays': self.get_ray_count(),
+            'weight_denominator': self.get_weight_denominator(),
+            'offset': np.round(self._offset, 12).tolist(),
+        }
+
 
 class TelescopeAperture(Aperture):
     """Primary aperture."""
-    def __init__(self, rate=4):
-        super().__init__(APERTURE_RADIUS, sec_radius=APERTURE_SEC_RADIUS, rate=rate)
+    def __init__(self, rate=4, geometry=None):
+        geometry = resolve_geometry(geometry)
+
+        super().__init__(geometry.aperture_radius, sec_radius=geometry.aperture_sec_radius, rate=rate, geometry=geometry)
         
         self._name = 'telescope'
 
 
 class GuiderAperture(Aperture):
     """Autoguider aperture."""
-    def __init__(self, rate=3):
-        super().__init__(GUIDER_RADIUS, sec_radius=GUIDER_SEC_RADIUS, rate=rate)
+    def __init__(self, rate=3, geometry=None):
+        geometry = resolve_geometry(geometry)
+
+        super().__init__(geometry.guider_radius, sec_radius=geometry.guider_sec_radius, rate=rate, geometry=geometry)
 
         self._name = 'guider'
 
-    def _transform(self, ha, dec):
         # Transform telescope aperture to guider aperture
-        H_34 = transform(L_4*np.cos(GUIDER_ANGLE), 0, L_4*np.sin(GUIDER_ANGLE))
-
-        # Get the telescope aperture pose
-        H_telescope = super()._transform(ha, dec)
-
-        H = H_telescope @ H_34
-
-        return H
+        self._offset = guider_offset(geometry)
 
 
 class FinderAperture(Aperture):
     """Finderscope aperture."""
-    def __init__(self, rate=3):
-        super().__init__(FINDER_RADIUS, rate=rate)
+    def __init__(self, rate=3, geometry=None):
+        geometry = resolve_geometry(geometry)
+
+        super().__init__(geometry.finder_radius, rate=rate, geometry=geometry)
 
         self._name = 'finder'
 
-    def _transform(self, ha, dec):
         # Transform telescope aperture to guider aperture & guider to finder
-        H_34 = transform(L_4*np.cos(GUIDER_ANGLE), 0, L_4*np.sin(GUIDER_ANGLE))
-        H_45 = transform(-L_5*np.cos(FINDER_ANGLE), 0, L_5*np.sin(FINDER_ANGLE))
+        angle = np.radians(geometry.finder_angle)
+
+        H_45 = transform(-geometry.l_5*np.cos(angle), 0, geometry.l_5*np.sin(angle))
 
-        # Get the telescope aperture pose
-        H_telescope = super()._transform(ha, dec)
+        self._offset = guider_offset(geometry) @ H_45
 
-        H = H_telescope @ H_34 @ H_45
 
-        return H
\ No newline at end of file
+# The apertures of the Gratama telescope, by name
+APERTURE_TYPES = {
+    'telescope': TelescopeAperture,
+    'guider': GuiderAperture,
+    'finder': FinderAperture,
+}
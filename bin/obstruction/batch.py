@@ -0,0 +1,234 @@
+import csv, itertools, json
+import numpy as np
+
+# The fields of a query record: hour angle (h), declination (deg) & dome azimuth (deg)
+QUERY_FIELDS = ('ha', 'dec', 'az')
+
+
+def detect_format(path):
+    """Return the record format of a file from its extension: ndjson (.ndjson, .jsonl, .json) or csv."""
+    return 'ndjson' if path.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+class RecordReader:
+    """
+    Iterates over the query records of a stream (lazily, one line at a
+    time) as dicts; csv records are keyed by the header, i.e. the first
+    line if it names the ha, dec & az fields, or else by ha, dec & az
+    (& field_<k> for extra columns). Empty lines and lines starting w/
+    # are skipped; lines that cannot be parsed yield a record w/ an
+    'error' (and the fields that could be read).
+    """
+    def __init__(self, stream, format='csv'):
+        """"The RecordReader class constructor.
+
+        Parameters
+        ----------
+
+        stream (file): text stream, e.g. sys.stdin
+        format (str): csv or ndjson
+        """
+        self.stream = stream
+        self.format = format
+
+        # The csv fields; known once the first line has been read
+        self.fields = None
+
+    def __iter__(self):
+        return self._read_ndjson() if self.format == 'ndjson' else self._read_csv()
+
+    def _read_ndjson(self):
+        for line in self.stream:
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                record = {'error': 'invalid json: {}'.format(error)}
+
+            if not isinstance(record, dict):
+                record = {'error': 'invalid record: expected an object'}
+
+            yield record
+
+    def _read_csv(self):
+        for row in csv.reader(self.stream):
+            if not row or row[0].startswith('#'):
+                continue
+
+            if self.fields is None:
+                names = [name.strip() for name in row]
+
+                if set(QUERY_FIELDS) <= set(names):
+                    self.fields = names
+                    continue
+
+                # No header: the first line is a record (valid or not)
+                self.fields = list(QUERY_FIELDS) + ['field_{}'.format(k) for k in range(len(QUERY_FIELDS), len(row))]
+
+            record = dict(zip(self.fields, row))
+
+            if len(row) != len(self.fields):
+                record['error'] = 'expected {} fields, got {}'.format(len(self.fields), len(row))
+
+            yield record
+
+
+def parse_query(record):
+    """Return the (ha, dec, az) of a record, w/ the hour angle in hours; raises a ValueError if invalid."""
+    if 'error' in record:
+        raise ValueError(record['error'])
+
+    try:
+        ha, dec, az = (float(record[name]) for name in QUERY_FIELDS)
+    except KeyError as error:
+        raise ValueError('missing field {}'.format(error))
+    except (TypeError, ValueError):
+        raise ValueError('non-numeric ha, dec, or az')
+
+    if not (np.isfinite(ha) and np.isfinite(az) and -90 <= dec <= 90):
+        raise ValueError('ha, dec, or az out of range')
+
+    return ha, dec, az
+
+
+def evaluate_records(apertures, records, fast_path=True):
+    """
+    Compute the % obstruction of every aperture for a list of query
+    records at once, see Aperture.obstruction_batch.
+
+    Parameters
+    ----------
+
+    apertures (list of Aperture): the apertures
+    records (list of dict): the query records, see RecordReader
+    fast_path (bool): see Aperture.obstruction_batch
+
+    Returns
+    -------
+
+    ratios (dict): the obstruction ratios (NaN for invalid records), per aperture name
+    errors (list): the error message of every record; None if valid
+    """
+    queries = np.full((len(records), 3), np.nan)
+    errors = [None]*len(records)
+
+    for k, record in enumerate(records):
+        try:
+            queries[k] = parse_query(record)
+        except ValueError as error:
+            errors[k] = str(error)
+
+    valid = np.array([error is None for error in errors], dtype=bool)
+
+    ha, dec, az = queries[valid].T
+
+    ratios = {}
+
+    for aperture in apertures:
+        ratio = np.full(len(records), np.nan)
+
+        if valid.any():
+            ratio[valid] = aperture.obstruction_batch(ha*15, dec, az, fast_path=fast_path)
+
+        ratios[aperture.get_name()] = ratio
+
+    return ratios, errors
+
+
+class RecordWriter:
+    """
+    Writes the query records w/ their obstruction ratios (a column/key
+    per aperture, and an 'error') as csv or ndjson; the csv header is
+    that of the input, i.e. the fields of the RecordReader, followed
+    by the aperture names & error.
+    """
+    def __init__(self, stream, names, format='csv', fields=None):
+        """"The RecordWriter class constructor.
+
+        Parameters
+        ----------
+
+        stream (file): text stream, e.g. sys.stdout
+        names (list of str): the aperture names
+        format (str): csv or ndjson
+        fields (list of str): the fields of the input records (csv) | default: ha, dec & az
+        """
+        self.stream = stream
+        self.names = list(names)
+        self.format = format
+        self.fields = [field for field in (fields or QUERY_FIELDS) if field not in self.names and field != 'error']
+
+        if format == 'csv':
+            self._writer = csv.writer(stream, lineterminator='\n')
+            self._writer.writerow(self.fields + self.names + ['error'])
+
+    def write(self, records, ratios, errors):
+        """Write a chunk of records, see evaluate_records."""
+        for k, record in enumerate(records):
+            if self.format == 'ndjson':
+                record = {key: value for key, value in record.items() if key != 'error'}
+
+                for name in self.names:
+                    record[name] = None if np.isnan(ratios[name][k]) else float(ratios[name][k])
+
+                record['error'] = errors[k]
+
+                self.stream.write(json.dumps(record) + '\n')
+                continue
+
+            row = [record.get(field, '') for field in self.fields]
+            row += ['' if np.isnan(ratios[name][k]) else '{:.6f}'.format(ratios[name][k]) for name in self.names]
+
+            self._writer.writerow(row + [errors[k] or ''])
+
+        self.stream.flush()
+
+
+def stream_obstruction(apertures, source, sink, format='csv', chunk_size=1024, fast_path=True):
+    """
+    Compute the % obstruction of every aperture for a stream of query
+    records; the records are read, evaluated & written in chunks, s.t.
+    the memory usage does not depend on the length of the stream.
+
+    Parameters
+    ----------
+
+    apertures (list of Aperture): the apertures
+    source (file): input text stream of csv/ndjson records, see RecordReader
+    sink (file): output text stream, see RecordWriter
+    format (str): csv or ndjson (both input & output)
+    chunk_size (int): no. records evaluated at once
+    fast_path (bool): see Aperture.obstruction_batch
+
+    Returns
+    -------
+
+    n_records (int): no. records
+    n_errors (int): no. invalid records
+    """
+    reader = RecordReader(source, format)
+    records = iter(reader)
+    writer = None
+
+    n_records = 0
+    n_errors = 0
+
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+
+        # The csv header of the input has been read along w/ the first chunk
+        if writer is None:
+            writer = RecordWriter(sink, [aperture.get_name() for aperture in apertures], format, fields=reader.fields)
+
+        if not chunk:
+            break
+
+        ratios, errors = evaluate_records(apertures, chunk, fast_path=fast_path)
+        writer.write(chunk, ratios, errors)
+
+        n_records += len(chunk)
+        n_errors += sum(error is not None for error in errors)
+
+    return n_records, n_errors
@@ -0,0 +1,92 @@
+import configparser, functools
+
+from dataclasses import dataclass
+from pathlib import Path
+
+# Default location of the geometry parameters of the telescope/dome
+DEFAULT_CONFIG = Path(__file__).resolve().parent.parent / 'resources' / 'config.ini'
+
+
+@dataclass(frozen=True)
+class Geometry:
+    """
+    Geometry parameters of the telescope/dome; lengths in meters, angles in degrees.
+    Geometries are immutable & hashable, s.t. they can key caches; derive
+    variants w/ dataclasses.replace, e.g. replace(geometry, slit_width=2.0).
+    """
+    # Telescope:
+    l_1: float # distance floor-HA axis
+    l_2: float # distance HA axis-Dec axis
+    l_3: float # distance Dec axis-tube center
+    l_4: float # distance primary tube center-guider center
+    l_5: float # distance guider center-finder center
+
+    guider_angle: float
+    finder_angle: float
+
+    aperture_radius: float
+    aperture_sec_radius: float
+
+    guider_radius: float
+    guider_sec_radius: float
+
+    finder_radius: float
+
+    # Dome:
+    radius: float # radius
+    extent: float # extent of cylindrical dome wall
+    slit_width: float # Slit width
+
+    # Observatory:
+    longitude: float
+    latitude: float
+
+    # Limits of the poses:
+    min_altitude: float = 0. # min. altitude of the optical axis
+    max_hour_angle: float = 180. # max. |hour angle|
+
+
+@functools.lru_cache(maxsize=None)
+def load_geometry(path=None):
+    """
+    Load (and cache) the geometry parameters of the telescope/dome.
+
+    Parameters
+    ----------
+
+    path (str or Path): path to the config file | default: resources/config.ini next to the package
+    """
+    path = Path(path) if path is not None else DEFAULT_CONFIG
+
+    if not path.is_file():
+        raise FileNotFoundError('Config file "{}" does not exist...'.format(path))
+
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    return Geometry(
+        l_1=config['mount'].getfloat('length_1'),
+        l_2=config['mount'].getfloat('length_2'),
+        l_3=config['mount'].getfloat('length_3'),
+        l_4=config['guider'].getfloat('offset'),
+        l_5=config['finder'].getfloat('offset'),
+        guider_angle=config['guider'].getfloat('angle'),
+        finder_angle=config['finder'].getfloat('angle'),
+        aperture_radius=config['telescope'].getfloat('diameter')/2,
+        aperture_sec_radius=config['telescope'].getfloat('sec_diameter')/2,
+        guider_radius=config['guider'].getfloat('diameter')/2,
+        guider_sec_radius=config['guider'].getfloat('sec_diameter')/2,
+        finder_radius=config['finder'].getfloat('diameter')/2,
+        radius=config['dome'].getfloat('diameter')/2,
+        extent=config['dome'].getfloat('extent'),
+        slit_width=config['dome'].getfloat('slit_width'),
+        longitude=config['observatory'].getfloat('longitude'),
+        latitude=config['observatory'].getfloat('latitude'),
+        min_altitude=config.getfloat('limits', 'min_altitude', fallback=0.),
+        max_hour_angle=config.getfloat('limits', 'max_hour_angle', fallback=180.),
+    )
+
+
+def resolve_geometry(geometry=None):
+    """Return the geometry, or the (cached) geometry of the config file if it is None."""
+    return geometry if geometry is not None else load_geometry()
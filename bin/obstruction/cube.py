@@ -0,0 +1,254 @@
+import functools, json
+import numpy as np
+
+from pathlib import Path
+
+# Name of the file with the metadata of a compact cube (directory)
+META_FILE = 'meta.json'
+
+
+def count_dtype(n_rays):
+    """Return the smallest unsigned integer type that holds counts up to n_rays (& the sentinel of masked cells)."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_rays < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    raise ValueError('Too many rays to store as counts...')
+
+
+def masked_count(dtype):
+    """
+    Return the sentinel count of masked cells, i.e. poses outside of the 
+    limits (see obstruction.aperture.within_limits), which are not traced: 
+    the max. of the dtype. Masked cells are NaN as ratios.
+    """
+    return np.iinfo(dtype).max
+
+
+def quantize(ratio, n_rays):
+    """
+    Convert obstruction ratios, i.e. k/n_rays, to blocked-ray counts k; 
+    for rays of unequal (integer) weights, k is the total weight of the 
+    blocked rays. NaN ratios (masked cells) become the sentinel count, 
+    see masked_count.
+
+    Parameters
+    ----------
+
+    ratio (float ndarray): obstruction ratios
+    n_rays (int): the denominator of the ratios, see Aperture.get_weight_denominator
+    """
+    ratio = np.asarray(ratio)
+    dtype = count_dtype(n_rays)
+
+    is_masked = np.isnan(ratio)
+
+    return np.where(is_masked, masked_count(dtype), np.rint(np.where(is_masked, 0, ratio)*n_rays)).astype(dtype)
+
+
+class QuantizedCube:
+    """
+    Obstruction cube stored as blocked-ray counts, in chunks along 
+    the first (azimuth) axis. Indexing the cube returns the (lazily 
+    dequantized) obstruction ratios of the selection only.
+
+    Public attributes/methods
+    -------------------------
+
+    shape (tuple): shape of the cube
+    n_rays (int): the denominator of the ratios, see Aperture.get_weight_denominator
+    counts (indexable): the raw blocked-ray counts; masked cells hold the sentinel, see masked_count
+    """
+    def __init__(self, path):
+        """"The QuantizedCube class constructor.
+
+        Parameters
+        ----------
+
+        path (str or Path): the cube directory, see save_cube
+        """
+        self.path = Path(path)
+
+        with (self.path / META_FILE).open('r') as meta_file:
+            meta = json.load(meta_file)
+
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.n_rays = meta['n_rays']
+        self.chunk_size = meta['chunk_size']
+        self.compressed = meta['compressed']
+
+        self.counts = _CountsView(self)
+
+        # Keep a few decompressed chunks around; uncompressed chunks are memory-mapped
+        self._chunk = functools.lru_cache(maxsize=8)(self._load_chunk)
+
+    @classmethod
+    def from_counts(cls, counts, n_rays):
+        """
+        Wrap blocked-ray counts that are not stored as a compact cube, 
+        e.g. the memory-mapped npy file of obstruction_grid.py -q, as a 
+        single chunk.
+        """
+        cube = cls.__new__(cls)
+
+        cube.path = None
+        cube.shape = tuple(counts.shape)
+        cube.dtype = np.dtype(counts.dtype)
+        cube.n_rays = int(n_rays)
+        cube.chunk_size = max(cube.shape[0], 1)
+        cube.compressed = False
+
+        cube.counts = _CountsView(cube)
+        cube._chunk = lambda index: counts
+
+        return cube
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _load_chunk(self, index):
+        if self.compressed:
+            with np.load(self.path / 'chunk_{}.npz'.format(index)) as chunk_file:
+                return chunk_file['counts']
+
+        return np.load(self.path / 'chunk_{}.npy'.format(index), mmap_mode='r')
+
+    def _read(self, key):
+        """Return the counts of a selection; the chunks are only read where needed."""
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if not key or key[0] is Ellipsis:
+            head, rest = slice(None), key
+        else:
+            head, rest = key[0], key[1:]
+
+        index = np.arange(self.shape[0])[head]
+
+        if np.ndim(index) == 0:
+            chunk, local = divmod(int(index), self.chunk_size)
+
+            return self._chunk(chunk)[(local,) + rest]
+
+        # Read consecutive runs of indices that lie in the same chunk at once
+        chunks = index // self.chunk_size
+        runs = np.flatnonzero(np.diff(chunks)) + 1
+
+        parts = [
+            self._chunk(int(run[0]) // self.chunk_size)[(run % self.chunk_size,) + rest]
+            for run in np.split(index, runs) if run.size
+        ]
+
+        if not parts:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+
+        return np.concatenate(parts, axis=0)
+
+    def __getitem__(self, key):
+        counts = self._read(key)
+
+        return np.where(counts == masked_count(self.dtype), np.nan, counts/self.n_rays)[()]
+
+    def __array__(self, dtype=None, copy=None):
+        ratio = self[...]
+
+        return ratio if dtype is None else ratio.astype(dtype)
+
+
+class _CountsView:
+    """Indexable view of the raw counts of a QuantizedCube."""
+    def __init__(self, cube):
+        self._cube = cube
+
+    @property
+    def shape(self):
+        return self._cube.shape
+
+    def __getitem__(self, key):
+        return self._cube._read(key)
+
+    def __array__(self, dtype=None, copy=None):
+        counts = self[...]
+
+        return counts if dtype is None else counts.astype(dtype)
+
+
+def save_cube(path, counts, n_rays, chunk_size=16, compress=False):
+    """
+    Store blocked-ray counts as a compact cube (directory), chunked 
+    along the first (azimuth) axis.
+
+    Parameters
+    ----------
+
+    path (str or Path): the cube directory
+    counts (int ndarray): blocked-ray counts, e.g. a memory-mapped npy file; see quantize
+    n_rays (int): the denominator of the ratios, see Aperture.get_weight_denominator
+    chunk_size (int): no. azimuths per chunk
+    compress (bool): if True, compress the chunks (which can then no longer be memory-mapped)
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    dtype = count_dtype(n_rays)
+
+    for index, start in enumerate(range(0, counts.shape[0], chunk_size)):
+        chunk = np.asarray(counts[start:start + chunk_size], dtype=dtype)
+
+        if compress:
+            np.savez_compressed(path / 'chunk_{}.npz'.format(index), counts=chunk)
+        else:
+            np.save(path / 'chunk_{}.npy'.format(index), chunk)
+
+    meta = {
+        'shape': list(counts.shape),
+        'dtype': dtype.name,
+        'n_rays': int(n_rays),
+        'chunk_size': chunk_size,
+        'compressed': compress,
+    }
+
+    with (path / META_FILE).open('w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+
+def load_cube(path):
+    """
+    Load an obstruction cube, without reading all data into memory.
+
+    Parameters
+    ----------
+
+    path (str or Path): a compact cube directory (see save_cube), a npy file with obstruction ratios,
+        or a npy file with blocked-ray counts (obstruction_grid.py -q) next to its manifest
+
+    Returns
+    -------
+
+    cube: a QuantizedCube or a memory-mapped array; both are indexed as (az, ha, dec) and yield ratios
+    """
+    path = Path(path)
+
+    if path.is_dir():
+        return QuantizedCube(path)
+
+    cube = np.load(path, mmap_mode='r')
+
+    # Counts are only ratios w/ the denominator of the aperture, which is recorded in the manifest of the run
+    if np.issubdtype(cube.dtype, np.integer):
+        manifest_path = path.with_suffix('.json')
+
+        if not manifest_path.is_file():
+            raise ValueError('The cube "{}" holds blocked-ray counts, but has no manifest w/ their denominator; load the compact (.cube) cube instead...'.format(path.name))
+
+        with manifest_path.open('r') as manifest_file:
+            n_rays = json.load(manifest_file)['parameters']['aperture']['weight_denominator']
+
+        return QuantizedCube.from_counts(cube, n_rays)
+
+    return cube
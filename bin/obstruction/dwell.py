@@ -0,0 +1,89 @@
+import numpy as np
+
+# Value of the dwell cube at obstructed cells
+OBSTRUCTED = -1
+
+
+def clear_run_length(clear, axis=1):
+    """
+    Compute, for every cell, the no. consecutive clear cells starting 
+    at that cell along a periodic axis (e.g. the HA axis, which wraps 
+    around at 360 deg); zero for obstructed cells.
+
+    Parameters
+    ----------
+
+    clear (bool ndarray): the clear cells
+    axis (int): the periodic axis
+    """
+    c = np.moveaxis(clear, axis, -1)
+    n = c.shape[-1]
+
+    index = np.arange(n, dtype=np.int32)
+
+    # Index of the first obstructed cell at or after each cell (n if there is none)
+    next_blocked = np.where(c, n, index)
+    next_blocked = np.minimum.accumulate(next_blocked[..., ::-1], axis=-1)[..., ::-1]
+
+    run = next_blocked - index
+
+    # Runs that reach the end of the axis continue from its start
+    run = np.where(next_blocked == n, run + run[..., :1], run)
+    run = np.where(c, np.minimum(run, n), 0)
+
+    return np.moveaxis(run, -1, axis)
+
+
+def dwell_cube(clear, chunk_size=16):
+    """
+    Compute the dwell time of every cell of a clear cube, i.e. the 
+    no. (1 degree) steps in HA the telescope can advance from that cell 
+    while staying clear at the same dome azimuth; 1 degree in HA 
+    corresponds to ~4 minutes.
+
+    Parameters
+    ----------
+
+    clear (bool ndarray): the clear cells, indexed as (az, ha, dec)
+    chunk_size (int): no. azimuths processed at once
+
+    Returns
+    -------
+
+    dwell (int16 ndarray): the dwell time in degrees of HA, indexed as (az, ha, dec); 
+        the no. HA steps (i.e. 360) for cells that are clear at all HAs, and 
+        OBSTRUCTED for obstructed cells
+    """
+    n_ha = clear.shape[1]
+
+    dwell = np.empty(clear.shape, dtype=np.int16)
+
+    for start in range(0, len(clear), chunk_size):
+        sel = slice(start, start + chunk_size)
+
+        run = clear_run_length(clear[sel], axis=1)
+
+        dwell[sel] = np.where(run == n_ha, n_ha, run - 1)
+
+    return dwell
+
+
+def dwell_at(dwell, az, ha, dec):
+    """
+    Look up the dwell time (see dwell_cube) for arbitrary coordinates; 
+    the coordinates are rounded to the (1 degree) grid and the azimuth 
+    and HA wrap around at 360 deg.
+
+    Parameters
+    ----------
+
+    dwell (int ndarray): dwell cube, e.g. memory-mapped, indexed as (az, ha, dec)
+    az (float ndarray): dome azimuths in degrees
+    ha (float ndarray): hour angles in degrees
+    dec (float ndarray): declinations in degrees (-90 to 90)
+    """
+    az_index = np.rint(az).astype(int) % dwell.shape[0]
+    ha_index = np.rint(ha).astype(int) % dwell.shape[1]
+    dec_index = np.clip(np.rint(dec).astype(int) + 90, 0, dwell.shape[2] - 1)
+
+    return dwell[az_index, ha_index, dec_index]
@@ -0,0 +1,197 @@
+import numpy as np
+
+from obstruction.aperture import AMBIGUOUS, BLOCKED, AzimuthProfile, is_in_slit, slit_azimuth_arcs, telescope_poses, trace_rays
+
+
+class ApertureSet:
+    """
+    Set of apertures that are traced in a single pass: the poses 
+    of all apertures are constant offsets w.r.t. the telescope pose 
+    (see Aperture._transform), hence the telescope pose stack is built 
+    once and the rays of all apertures are traced as one bundle.
+
+    Public methods
+    --------------
+
+    obstruction_profile (dict): return the % obstruction of each aperture for arrays of poses & a vector of dome azimuths
+    azimuth_profiles (dict): return the exact obstruction vs dome azimuth of each aperture
+    get_names (list): return the aperture "names"/identifiers
+    """
+    def __init__(self, apertures):
+        """"The ApertureSet class constructor.
+
+        Parameters
+        ----------
+
+        apertures (list of Aperture): the apertures; their names should be unique
+        """
+        self.apertures = list(apertures)
+
+        names = self.get_names()
+
+        if len(set(names)) != len(names):
+            raise ValueError('The names of the apertures should be unique...')
+
+        # The poses of all apertures are derived from a single telescope pose
+        if len({aperture.geometry for aperture in self.apertures}) > 1:
+            raise ValueError('The apertures should share their geometry...')
+
+        self.geometry = self.apertures[0].geometry
+
+        local = []
+        directions = []
+
+        for aperture in self.apertures:
+            template = aperture._ray_template()
+
+            # Ray origins & directions in the frame of the telescope aperture
+            local.append(template @ aperture._offset.T)
+            directions.append(np.tile(aperture._offset[:3, 1], (len(template), 1)))
+
+        self._local = np.concatenate(local)
+        self._directions = np.concatenate(directions)
+
+        # The rays of aperture i are bundle[bounds[i]:bounds[i+1]]
+        self._bounds = np.cumsum([0] + [len(template) for template in local])
+
+    def get_names(self):
+        """Return the aperture identifiers."""
+        return [aperture.get_name() for aperture in self.apertures]
+
+    def _trace(self, ha, dec):
+        """
+        Trace the rays of all apertures for a stack of poses; 
+        see Aperture._trace.
+        """
+        poses = telescope_poses(ha, dec, self.geometry)
+
+        return trace_rays(poses, self._local, self._directions, self.geometry)
+
+    def _split(self, rays):
+        """Split an array along its last (ray) axis per aperture."""
+        return np.split(rays, self._bounds[1:-1], axis=-1)
+
+    def azimuth_profiles(self, ha, dec):
+        """
+        Compute the exact obstruction vs dome azimuth of each aperture; 
+        see Aperture.azimuth_profile.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+
+        Returns
+        -------
+
+        profiles (dict): the AzimuthProfile of the (flattened) poses, per aperture name
+        """
+        ha, dec = np.broadcast_arrays(np.ravel(ha), np.ravel(dec))
+
+        has_intersection, points = self._trace(ha, dec)
+
+        start, length = slit_azimuth_arcs(points, has_intersection, self.geometry)
+
+        # Arcs along the last axis, i.e. of shape (poses, 3, rays)
+        start = np.swapaxes(start, 1, 2)
+        length = np.swapaxes(length, 1, 2)
+
+        profiles = {}
+
+        for aperture, s, l in zip(self.apertures, self._split(start), self._split(length)):
+            weights = np.broadcast_to(aperture._ray_weights(), s.shape)
+
+            n_poses = s.shape[0]
+
+            profiles[aperture.get_name()] = AzimuthProfile(s.reshape(n_poses, -1), l.reshape(n_poses, -1), weights.reshape(n_poses, -1))
+
+        return profiles
+
+    def _fast_profile(self, ha, dec, azimuths, ratios):
+        """
+        Fill in the obstruction ratios (views of shape (ha.size, azimuths.size), 
+        per aperture name) w/ the fast-path pre-test; only the (pose, azimuth) 
+        pairs that are ambiguous for any of the apertures are traced.
+        """
+        classes = {}
+
+        for aperture in self.apertures:
+            name = aperture.get_name()
+
+            classes[name] = aperture._classify(ha[:, np.newaxis], dec[:, np.newaxis], azimuths)
+            aperture._update_path_counts(classes[name])
+
+            ratios[name][:] = np.where(classes[name] == BLOCKED, aperture._blocked_ratio(), 0.)
+
+        is_ambiguous = np.any([c == AMBIGUOUS for c in classes.values()], axis=0)
+
+        pose_index, az_index = np.nonzero(is_ambiguous)
+        traced, inverse = np.unique(pose_index, return_inverse=True)
+
+        has_intersection, points = self._trace(ha[traced], dec[traced])
+
+        # Evaluate the slit for the ambiguous pairs only; of shape (pairs, rays)
+        is_clear = has_intersection[inverse] & is_in_slit(points[inverse], azimuths[az_index, np.newaxis], self.geometry)
+
+        for aperture, clear in zip(self.apertures, self._split(is_clear)):
+            name = aperture.get_name()
+
+            # Pairs that are ambiguous for this aperture
+            sel = classes[name][pose_index, az_index] == AMBIGUOUS
+
+            ratios[name][pose_index[sel], az_index[sel]] = ~clear[sel] @ aperture._ray_weights()
+
+    def obstruction_profile(self, ha, dec, azimuths, chunk_size=128, exact=False, fast_path=True):
+        """
+        Compute the % obstruction of each aperture for arrays of poses 
+        and a whole vector of dome azimuths; see Aperture.obstruction_profile.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        azimuths (float ndarray): 1d array of dome azimuths (clockwise convention)
+        chunk_size (int): max. no. poses traced at once; bounds the memory usage
+        exact (bool): if True, evaluate the exact azimuth profiles rather than testing each azimuth
+        fast_path (bool): if True, only test the (pose, azimuth) pairs that cannot be classified as fully clear/blocked 
+            (for every aperture) beforehand, see obstruction.aperture.classify_bundles; the paths are counted per aperture
+
+        Returns
+        -------
+
+        ratios (dict): the obstruction ratios, of shape (*broadcast shape of ha & dec, azimuths.size), per aperture name
+        """
+        ha, dec = np.broadcast_arrays(ha, dec)
+        azimuths = np.ravel(azimuths)
+
+        shape = ha.shape
+
+        ha = ha.ravel()
+        dec = dec.ravel()
+
+        ratios = {name: np.empty((ha.size, azimuths.size)) for name in self.get_names()}
+
+        for start in range(0, ha.size, chunk_size):
+            sel = slice(start, start + chunk_size)
+
+            if exact:
+                for name, profile in self.azimuth_profiles(ha[sel], dec[sel]).items():
+                    ratios[name][sel] = profile(azimuths)
+
+                continue
+
+            if fast_path:
+                self._fast_profile(ha[sel], dec[sel], azimuths, {name: ratio[sel] for name, ratio in ratios.items()})
+                continue
+
+            has_intersection, points = self._trace(ha[sel], dec[sel])
+
+            # Evaluate the slit for every azimuth; of shape (poses, azimuths, rays)
+            is_clear = has_intersection[:, np.newaxis] & is_in_slit(points[:, np.newaxis], azimuths[:, np.newaxis], self.geometry)
+
+            for aperture, clear in zip(self.apertures, self._split(is_clear)):
+                ratios[aperture.get_name()][sel] = ~clear @ aperture._ray_weights()
+
+        return {name: ratio.reshape(shape + azimuths.shape) for name, ratio in ratios.items()}
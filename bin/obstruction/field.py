@@ -0,0 +1,302 @@
+import json
+import numpy as np
+
+from pathlib import Path
+
+from obstruction.adaptive import CORNERS
+from obstruction.aperture import within_limits
+from obstruction.cube import QuantizedCube, load_cube, masked_count
+
+# Grid of the obstruction cube (see obstruction_grid.py); 1 degree steps, indexed as (az, ha, dec)
+N_AZ = 360
+N_HA = 360
+N_DEC = 181
+DEC_MIN = -90
+
+
+class ObstructionField:
+    """
+    Continuous % obstruction over (dome Az, HA, Dec), interpolated from
+    a precomputed cube; trilinear within a cell, and periodic in Az & HA.
+    The interpolation never leaves the range of the corners of a cell
+    (i.e. it is monotone), but it smears the sharp edges of the slit:
+    cells whose corners disagree, i.e. that straddle a transition, are
+    evaluated exactly by the ray tracer of the aperture instead. Cells
+    w/ equal corners are assumed to be uniform, like in AdaptiveGrid.
+
+    Public methods
+    --------------
+
+    __call__ (ndarray): return the obstruction at arbitrary coordinates
+    interpolate (tuple): return the interpolated obstruction only, and whether the cells straddle a transition
+    validate (dict): return the error w.r.t. the ray tracer on a random validation set
+    get_statistics (dict): return the no. queries & exact evaluations
+    """
+    def __init__(self, cube, aperture=None, tolerance=1e-9):
+        """"The ObstructionField class constructor.
+
+        Parameters
+        ----------
+
+        cube: the obstruction cube of the aperture, see obstruction.cube.load_cube
+        aperture (Aperture): the aperture of the cube; evaluates the cells that straddle a transition | default: interpolate only
+        tolerance (float): max. difference between the corners of a cell for it to be uniform
+        """
+        if tuple(cube.shape) != (N_AZ, N_HA, N_DEC):
+            raise ValueError('The cube should be indexed as (az, ha, dec) on the 1 degree grid of obstruction_grid.py...')
+
+        # Compact cubes are kept as counts (a fraction of the size of the ratios)
+        if isinstance(cube, QuantizedCube):
+            self._values = np.asarray(cube.counts).ravel()
+            self._scale = 1/cube.n_rays
+            self._masked = masked_count(cube.dtype)
+        elif np.issubdtype(cube.dtype, np.floating):
+            self._values = cube.reshape(-1)
+            self._scale = 1.
+            self._masked = None
+        else:
+            raise ValueError('The cube holds raw counts; load the compact (.cube) cube instead...')
+
+        self.aperture = aperture
+        self.tolerance = tolerance
+
+        self._n_queries = 0
+        self._n_exact = 0
+
+    @classmethod
+    def load(cls, path, aperture=None, tolerance=1e-9):
+        """
+        Load the field from a cube (npy or compact) generated w/
+        obstruction_grid.py; if its manifest is found, verify that the
+        cube was computed for (the parameters of) the aperture.
+        """
+        path = Path(path)
+        manifest_path = path.with_suffix('.json')
+
+        if aperture is not None and manifest_path.is_file():
+            with manifest_path.open('r') as manifest_file:
+                manifest = json.load(manifest_file)
+
+            if manifest['parameters']['aperture'] != json.loads(json.dumps(aperture.get_parameters())):
+                raise ValueError('The cube "{}" was computed for other parameters (e.g. sample rate) than the aperture...'.format(path.name))
+
+        return cls(load_cube(path), aperture=aperture, tolerance=tolerance)
+
+    def _interpolate(self, ha, dec, dome_az):
+        """
+        Interpolate between the 8 corners of the cell of each point; the
+        corners are along the first axis, see CORNERS.
+        """
+        az = np.ravel(dome_az) % N_AZ
+        ha = np.ravel(ha) % N_HA
+        dec = np.clip(np.ravel(dec) - DEC_MIN, 0, N_DEC - 1)
+
+        az_0 = np.floor(az)
+        ha_0 = np.floor(ha)
+        dec_0 = np.minimum(np.floor(dec), N_DEC - 2)
+
+        i_az, i_ha, i_dec = CORNERS.T[..., np.newaxis]
+
+        # Flat indices of the corners; the Az & HA wrap around at 360 deg
+        index = ((az_0 + i_az) % N_AZ*N_HA + (ha_0 + i_ha) % N_HA)*N_DEC + dec_0 + i_dec
+
+        values = self._values[index.astype(np.int64)]
+
+        if self._masked is not None:
+            values = np.where(values == self._masked, np.nan, values*self._scale)
+
+        weights = np.where(i_az, az - az_0, 1 - az + az_0)*np.where(i_ha, ha - ha_0, 1 - ha + ha_0)*np.where(i_dec, dec - dec_0, 1 - dec + dec_0)
+
+        # NaN if any corner (w/ a non-zero weight) is masked, i.e. outside of the limits
+        ratio = np.sum(np.where(weights > 0, weights*values, 0), axis=0)
+
+        is_masked = np.isnan(values)
+
+        spread = np.max(np.where(is_masked, -np.inf, values), axis=0) - np.min(np.where(is_masked, np.inf, values), axis=0)
+        is_partial = is_masked.any(axis=0) & ~is_masked.all(axis=0)
+
+        return ratio, spread > self.tolerance, is_partial
+
+    def interpolate(self, ha, dec, dome_az):
+        """
+        Interpolate the obstruction (trilinear) w/o evaluating any pose
+        exactly.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        dome_az (float ndarray): dome azimuths (clockwise convention)
+
+        Returns
+        -------
+
+        ratio (float ndarray): the interpolated obstruction ratios; NaN in cells w/ masked corners
+        is_transition (bool ndarray): whether the cell straddles a transition (or the limits)
+        """
+        ha, dec, dome_az = np.broadcast_arrays(ha, dec, dome_az)
+
+        ratio, is_transition, is_partial = self._interpolate(ha, dec, dome_az)
+
+        return ratio.reshape(ha.shape), (is_transition | is_partial).reshape(ha.shape)
+
+    def __call__(self, ha, dec, dome_az):
+        """
+        Compute the obstruction at arbitrary coordinates: interpolated,
+        or traced exactly (if there is an aperture) in the cells that
+        straddle a transition, see Aperture.obstruction_batch.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        dome_az (float ndarray): dome azimuths (clockwise convention)
+
+        Returns
+        -------
+
+        ratio (float ndarray): the obstruction ratios, of the broadcast shape of ha, dec & dome_az; NaN outside of the limits
+        """
+        ha, dec, dome_az = np.broadcast_arrays(ha, dec, dome_az)
+
+        ratio, is_transition, is_partial = self._interpolate(ha, dec, dome_az)
+
+        self._n_queries += ratio.size
+
+        if self.aperture is not None:
+            index = np.flatnonzero(is_transition | is_partial)
+
+            # Cells at the limits: only the poses within the limits are traced
+            is_reachable = ~is_partial[index] | within_limits(ha.ravel()[index], dec.ravel()[index], self.aperture.geometry)
+
+            index = index[is_reachable]
+
+            if index.size:
+                ratio[index] = self.aperture.obstruction_batch(ha.ravel()[index], dec.ravel()[index], dome_az.ravel()[index])
+
+            self._n_exact += index.size
+
+        return ratio.reshape(ha.shape)
+
+    def validate(self, n=10000, seed=0):
+        """
+        Measure the error of the field (and of the interpolation alone)
+        w.r.t. the ray tracer, on random poses spread uniformly over the
+        sky & dome azimuths; poses outside of the limits are left out.
+
+        Parameters
+        ----------
+
+        n (int): no. random poses
+        seed (int): seed of the random poses
+
+        Returns
+        -------
+
+        report (dict): the no. poses, the fraction in cells that straddle a transition, and the max./mean
+            error of the field & of the interpolation, and the pose of the max. interpolation error
+        """
+        if self.aperture is None:
+            raise ValueError('The validation requires the aperture of the cube...')
+
+        rng = np.random.default_rng(seed)
+
+        ha = rng.uniform(0, 360, n)
+        dec = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+        dome_az = rng.uniform(0, 360, n)
+
+        interpolated, is_transition = self.interpolate(ha, dec, dome_az)
+        field = self(ha, dec, dome_az)
+
+        exact = self.aperture.obstruction_batch(ha, dec, dome_az)
+
+        is_valid = ~np.isnan(field)
+        is_interpolated = is_valid & ~np.isnan(interpolated)
+
+        error = np.abs(field - exact)[is_valid]
+        interpolation_error = np.abs(interpolated - exact)[is_interpolated]
+
+        worst = np.flatnonzero(is_interpolated)[np.argmax(interpolation_error)] if interpolation_error.size else None
+
+        return {
+            'n': int(np.count_nonzero(is_valid)),
+            'transition_fraction': float(np.mean(is_transition[is_valid])) if error.size else None,
+            'max_error': float(error.max()) if error.size else None,
+            'mean_error': float(error.mean()) if error.size else None,
+            'max_interpolation_error': float(interpolation_error.max()) if interpolation_error.size else None,
+            'mean_interpolation_error': float(interpolation_error.mean()) if interpolation_error.size else None,
+            'worst_pose': None if worst is None else {'ha': float(ha[worst]), 'dec': float(dec[worst]), 'az': float(dome_az[worst])},
+        }
+
+    def get_statistics(self):
+        """Return the no. queried poses & the no. poses evaluated exactly."""
+        return {'queries': self._n_queries, 'exact': self._n_exact}
+
+
+def bulk_query(field, lines, out, chunk_size=10000):
+    """
+    Compute "ha,dec,az" query lines (HA in hours) in chunks, s.t. the
+    memory usage stays constant, and write the results as csv. Empty
+    lines, lines starting w/ # and a header (naming ha, dec & az) are
+    skipped, as are the lines that cannot be parsed; the latter are
+    counted.
+
+    Parameters
+    ----------
+
+    field (ObstructionField): the obstruction field
+    lines (iterable of str): the query lines, e.g. a file or sys.stdin
+    out (file): output text stream, e.g. sys.stdout
+    chunk_size (int): no. queries computed at once
+
+    Returns
+    -------
+
+    n_queries (int): no. computed queries
+    n_skipped (int): no. lines that could not be parsed
+    """
+    out.write('ha,dec,az,obstruction\n')
+
+    chunk = []
+
+    n_queries = 0
+    n_skipped = 0
+
+    def flush():
+        data = np.array(chunk, dtype=float).reshape(-1, 3)
+
+        np.savetxt(out, np.column_stack([data, field(data[:, 0]*15, data[:, 1], data[:, 2])]), delimiter=',', fmt='%.6g')
+
+        chunk.clear()
+
+    for line in lines:
+        if not line.strip() or line.startswith('#'):
+            continue
+
+        fields = [value.strip() for value in line.split(',')]
+
+        try:
+            ha, dec, az = (float(value) for value in fields[:3])
+        except ValueError:
+            # A header (before the first query) is skipped silently
+            if n_queries or n_skipped or not {'ha', 'dec', 'az'} <= set(fields):
+                n_skipped += 1
+
+            continue
+
+        if not (np.isfinite(ha) and np.isfinite(az) and -90 <= dec <= 90):
+            n_skipped += 1
+            continue
+
+        chunk.append((ha, dec, az))
+        n_queries += 1
+
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+
+    return n_queries, n_skipped
@@ -0,0 +1,270 @@
+import numpy as np
+
+from obstruction.dwell import OBSTRUCTED, clear_run_length
+
+# Grid of the optimal azimuth table (see optimal_azimuth.py); 1 degree steps
+N_HA = 360
+N_DEC = 181
+DEC_MIN = -90
+
+
+class AzimuthTable:
+    """
+    Dense (HA, Dec) lookup table of the optimal dome azimuth, loaded
+    once from the output of optimal_azimuth.py; all queries are O(1)
+    array lookups and accept scalars as well as arrays.
+
+    Public methods
+    --------------
+
+    best_azimuth (ndarray): return the optimal dome azimuth
+    dwell (ndarray): return the no. HA degrees the dome can remain at the optimal azimuth
+    clear_azimuth_window (tuple): return the range of clear azimuths around the optimal azimuth
+    query (dict): return all of the above at once
+    """
+    def __init__(self, table, dwell=None):
+        """"The AzimuthTable class constructor.
+
+        Parameters
+        ----------
+
+        table (float ndarray): rows of (HA, Dec, Az, dwell), see optimal_azimuth.py
+        dwell (int ndarray): the dwell cube, indexed as (az, ha, dec), see obstruction.dwell.dwell_cube;
+            required for clear_azimuth_window
+        """
+        table = np.atleast_2d(table)
+
+        ha_index = np.rint(table[:, 0]).astype(int) % N_HA
+        dec_index = np.rint(table[:, 1]).astype(int) - DEC_MIN
+
+        # NaN/OBSTRUCTED where there is no clear azimuth
+        self._azimuth = np.full((N_HA, N_DEC), np.nan)
+        self._azimuth[ha_index, dec_index] = table[:, 2]
+
+        self._dwell = np.full((N_HA, N_DEC), OBSTRUCTED, dtype=np.int16)
+        self._dwell[ha_index, dec_index] = table[:, 3]
+
+        self._window = None
+
+        if dwell is not None:
+            self._window = self._compute_windows(np.asarray(dwell) != OBSTRUCTED)
+
+    @classmethod
+    def load(cls, table_path, dwell_path=None):
+        """
+        Load the table from the csv file written by optimal_azimuth.py
+        and, optionally, the dwell cube (-d) from a npy file.
+        """
+        table = np.loadtxt(table_path, delimiter=',', ndmin=2)
+        dwell = np.load(dwell_path, mmap_mode='r') if dwell_path is not None else None
+
+        return cls(table, dwell=dwell)
+
+    def _compute_windows(self, clear):
+        """
+        Precompute, for every (HA, Dec), the arc of clear azimuths
+        that contains the optimal azimuth, as (start, end) azimuths.
+        """
+        n_az = clear.shape[0]
+
+        has_option = ~np.isnan(self._azimuth)
+        az_index = np.where(has_option, np.rint(np.nan_to_num(self._azimuth)), 0).astype(int) % n_az
+
+        # The no. clear azimuths after (forward) & before (backward) the optimal azimuth, including itself
+        forward = np.take_along_axis(clear_run_length(clear, axis=0), az_index[np.newaxis], axis=0)[0]
+        backward = np.take_along_axis(clear_run_length(clear[::-1], axis=0), (n_az - 1 - az_index)[np.newaxis], axis=0)[0]
+
+        start = (az_index - backward + 1) % n_az
+        end = (az_index + forward - 1) % n_az
+
+        # Azimuths that are clear all around
+        is_full = forward == n_az
+        start = np.where(is_full, 0, start)
+        end = np.where(is_full, n_az - 1, end)
+
+        window = np.stack([start, end]).astype(float)
+        window[:, ~has_option | (forward == 0)] = np.nan
+
+        return window
+
+    def _check_finite(self, ha, dec):
+        """Raise a ValueError if any hour angle or declination is not finite, e.g. NaN; these have no grid cell."""
+        if not (np.all(np.isfinite(ha)) and np.all(np.isfinite(dec))):
+            raise ValueError('non-finite ha or dec')
+
+    def _indices(self, ha, dec):
+        """Return the (nearest) grid indices; the HA wraps around at 360 deg."""
+        self._check_finite(ha, dec)
+
+        ha_index = np.rint(ha).astype(int) % N_HA
+        dec_index = np.clip(np.rint(dec).astype(int) - DEC_MIN, 0, N_DEC - 1)
+
+        return ha_index, dec_index
+
+    def _interpolate_azimuth(self, ha, dec):
+        """
+        Bilinear interpolation of the optimal azimuth, as a unit vector
+        s.t. the azimuth wraps around at 360 deg; neighbours without a
+        clear azimuth are left out.
+        """
+        self._check_finite(ha, dec)
+
+        ha = np.asarray(ha, dtype=float) % N_HA
+        dec = np.clip(np.asarray(dec, dtype=float) - DEC_MIN, 0, N_DEC - 1)
+
+        ha_0 = np.floor(ha).astype(int)
+        dec_0 = np.minimum(np.floor(dec).astype(int), N_DEC - 2)
+
+        w_ha = ha - ha_0
+        w_dec = dec - dec_0
+
+        x = np.zeros(np.shape(ha))
+        y = np.zeros(np.shape(ha))
+
+        for d_ha, d_dec, weight in [(0, 0, (1 - w_ha)*(1 - w_dec)), (1, 0, w_ha*(1 - w_dec)), (0, 1, (1 - w_ha)*w_dec), (1, 1, w_ha*w_dec)]:
+            azimuth = np.radians(self._azimuth[(ha_0 + d_ha) % N_HA, dec_0 + d_dec])
+            weight = np.where(np.isnan(azimuth), 0, weight)
+
+            x = x + weight*np.cos(np.nan_to_num(azimuth))
+            y = y + weight*np.sin(np.nan_to_num(azimuth))
+
+        azimuth = np.degrees(np.arctan2(y, x)) % 360
+
+        return np.where((x == 0) & (y == 0), np.nan, azimuth)
+
+    def best_azimuth(self, ha, dec, interpolate=False):
+        """
+        Return the optimal dome azimuth; NaN if there is none.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        interpolate (bool): if True, interpolate between the grid points rather than take the nearest
+        """
+        if interpolate:
+            return self._interpolate_azimuth(ha, dec)
+
+        return self._azimuth[self._indices(ha, dec)]
+
+    def dwell(self, ha, dec):
+        """
+        Return the no. HA degrees (~4 minutes each) the dome can remain
+        at the optimal azimuth; OBSTRUCTED if there is no clear azimuth.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        """
+        return self._dwell[self._indices(ha, dec)]
+
+    def clear_azimuth_window(self, ha, dec):
+        """
+        Return the arc of clear dome azimuths that contains the
+        optimal azimuth, as (start, end) azimuths running clockwise;
+        NaN if there is none.
+
+        Parameters
+        ----------
+
+        ha (float ndarray): hour angles in degrees
+        dec (float ndarray): declinations in degrees
+        """
+        if self._window is None:
+            raise ValueError('The clear azimuth windows require the dwell cube...')
+
+        ha_index, dec_index = self._indices(ha, dec)
+
+        return self._window[0, ha_index, dec_index], self._window[1, ha_index, dec_index]
+
+    def query(self, ha, dec, interpolate=False):
+        """
+        Bulk query: return the optimal azimuth, dwell, and (if available)
+        the clear azimuth window for arrays of hour angles/declinations.
+        """
+        result = {
+            'azimuth': self.best_azimuth(ha, dec, interpolate=interpolate),
+            'dwell': self.dwell(ha, dec),
+        }
+
+        if self._window is not None:
+            result['window_start'], result['window_end'] = self.clear_azimuth_window(ha, dec)
+
+        return result
+
+
+def bulk_query(table, lines, out, interpolate=False, chunk_size=10000):
+    """
+    Answer "ha,dec" query lines (HA in hours) in chunks, s.t. the memory
+    usage stays constant, and write the results as csv. Empty lines,
+    lines starting w/ # and a header (naming ha & dec) are skipped, as
+    are the lines that cannot be parsed; the latter are counted.
+
+    Parameters
+    ----------
+
+    table (AzimuthTable): the optimal azimuth table
+    lines (iterable of str): the query lines, e.g. a file or sys.stdin
+    out (file): output text stream, e.g. sys.stdout
+    interpolate (bool): see AzimuthTable.best_azimuth
+    chunk_size (int): no. queries answered at once
+
+    Returns
+    -------
+
+    n_queries (int): no. answered queries
+    n_skipped (int): no. lines that could not be parsed
+    """
+    header = None
+    chunk = []
+
+    n_queries = 0
+    n_skipped = 0
+
+    def flush():
+        nonlocal header
+
+        data = np.array(chunk, dtype=float).reshape(-1, 2)
+        result = table.query(data[:, 0]*15, data[:, 1], interpolate=interpolate)
+
+        if header is None:
+            header = ['ha', 'dec'] + list(result)
+            out.write(','.join(header) + '\n')
+
+        columns = np.column_stack([data] + list(result.values()))
+        np.savetxt(out, columns, delimiter=',', fmt='%.6g')
+
+        chunk.clear()
+
+    for line in lines:
+        if not line.strip() or line.startswith('#'):
+            continue
+
+        fields = [field.strip() for field in line.split(',')]
+
+        try:
+            ha, dec = (float(field) for field in fields[:2])
+        except ValueError:
+            # A header (before the first query) is skipped silently
+            if n_queries or n_skipped or not {'ha', 'dec'} <= set(fields):
+                n_skipped += 1
+
+            continue
+
+        if not (np.isfinite(ha) and -90 <= dec <= 90):
+            n_skipped += 1
+            continue
+
+        chunk.append((ha, dec))
+        n_queries += 1
+
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+
+    return n_queries, n_skipped
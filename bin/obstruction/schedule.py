@@ -0,0 +1,217 @@
+import numpy as np
+
+from obstruction.dwell import OBSTRUCTED
+from obstruction.timeline import hour_angle, to_datetime64, to_seconds, track_times
+
+
+def circular_distance(a, b, n):
+    """Return the (shortest) distance between indices on a circle of n indices."""
+    d = np.abs(np.asarray(a) - np.asarray(b)) % n
+
+    return np.minimum(d, n - d)
+
+
+def distance_transform(cost, weight):
+    """
+    Compute min_b (cost[b] + weight*circular_distance(a, b)) for every
+    index a of a circular cost vector, in O(n) w/ running minima.
+
+    Parameters
+    ----------
+
+    cost (float ndarray): 1d cost vector
+    weight (float): cost per unit of distance
+    """
+    n = cost.size
+
+    # Three periods, s.t. the shortest path around the circle is always covered
+    c = np.tile(cost, 3)
+    index = weight*np.arange(3*n)
+
+    forward = np.minimum.accumulate(c - index) + index
+    backward = (np.minimum.accumulate((c + index)[::-1]))[::-1] - index
+
+    return np.minimum(forward, backward)[n:2*n]
+
+
+def erode(clear, margin):
+    """Keep only the clear azimuths (last, periodic, axis) w/ margin clear azimuths on either side."""
+    eroded = clear.copy()
+
+    for shift in range(1, margin + 1):
+        eroded &= np.roll(clear, shift, axis=-1) & np.roll(clear, -shift, axis=-1)
+
+    return eroded
+
+
+def schedule_azimuths(clear, move_cost=360, slew_cost=1, obstructed_cost=1e6, initial_az=None):
+    """
+    Dynamic programming over a sequence of clear azimuth sets: find the
+    dome azimuth (index) per step that minimizes the total cost, i.e.
+    obstructed_cost per obstructed step, plus move_cost per move, plus
+    slew_cost per index slewed. With the defaults, the no. obstructed
+    steps is minimized first, then the no. moves, then the total slew.
+
+    Parameters
+    ----------
+
+    clear (bool ndarray): clear (step, azimuth) cells; the azimuths are periodic
+    move_cost (float): cost of a move
+    slew_cost (float): cost per azimuth index slewed
+    obstructed_cost (float): cost of an obstructed step
+    initial_az (int): the azimuth index of the dome before the first step | default: free
+
+    Returns
+    -------
+
+    path (int ndarray): the azimuth index per step
+    """
+    n_steps, n_az = clear.shape
+
+    penalty = np.where(clear, 0., obstructed_cost)
+
+    # Cost of the best schedule ending at each azimuth, per step
+    cost = np.empty((n_steps, n_az))
+
+    if initial_az is None:
+        cost[0] = penalty[0]
+    else:
+        cost[0] = penalty[0] + np.where(np.arange(n_az) == initial_az, 0, move_cost + slew_cost*circular_distance(np.arange(n_az), initial_az, n_az))
+
+    for k in range(1, n_steps):
+        cost[k] = penalty[k] + np.minimum(cost[k - 1], move_cost + distance_transform(cost[k - 1], slew_cost))
+
+    # Backtrack; stay if it is (one of) the best options
+    path = np.empty(n_steps, dtype=int)
+    path[-1] = np.argmin(cost[-1])
+
+    azimuths = np.arange(n_az)
+
+    for k in range(n_steps - 1, 0, -1):
+        a = path[k]
+        moves = cost[k - 1] + move_cost + slew_cost*circular_distance(azimuths, a, n_az)
+
+        path[k - 1] = a if cost[k - 1, a] <= moves.min() else np.argmin(moves)
+
+    return path
+
+
+class DomeScheduler:
+    """
+    Plans the dome azimuth for an ordered list of targets (e.g. a night),
+    s.t. the aperture(s) stay clear w/ as few (and as short) dome moves
+    as possible. The clear cube is loaded once, s.t. a plan can be
+    recomputed on the fly.
+
+    Public methods
+    --------------
+
+    plan (dict): return the dome azimuth schedule of a list of targets
+    """
+    def __init__(self, clear, longitude=None):
+        """"The DomeScheduler class constructor.
+
+        Parameters
+        ----------
+
+        clear (bool ndarray): the clear cells, indexed as (az, ha, dec) on a 1 degree grid
+        longitude (float): longitude of the observatory in degrees, east positive | default: from the config
+        """
+        # Indexed as (ha, dec, az), s.t. the azimuths of a pose are contiguous
+        self._clear = np.ascontiguousarray(np.moveaxis(np.asarray(clear, dtype=bool), 0, -1))
+        self.longitude = longitude
+
+    @classmethod
+    def load(cls, dwell_path, longitude=None):
+        """Load the clear cells from a dwell cube, see optimal_azimuth.py -d."""
+        return cls(np.load(dwell_path, mmap_mode='r') != OBSTRUCTED, longitude=longitude)
+
+    def _steps(self, targets, start, step):
+        """
+        Return the UTC times, target index, HA, and Dec of every step of
+        the targets; the steps of a target are [start, end), except for
+        the last target, s.t. the instant a target ends (and the next
+        one starts) is a single step of the next target.
+        """
+        times, index = [], []
+
+        time = to_datetime64(start)
+
+        for i, (_, _, duration) in enumerate(targets):
+            end = time + np.timedelta64(int(round(to_seconds(duration)*1e6)), 'us')
+
+            t = track_times(time, duration, step)
+
+            if i < len(targets) - 1:
+                t = t[t < end]
+
+            times.append(t)
+            index.append(np.full(t.size, i))
+
+            time = end
+
+        times = np.concatenate(times)
+        index = np.concatenate(index)
+
+        ra = np.array([target[0] for target in targets], dtype=float)[index]
+        dec = np.array([target[1] for target in targets], dtype=float)[index]
+
+        return times, index, hour_angle(ra, times, self.longitude), dec
+
+    def plan(self, targets, start, step=120, margin=0, move_cost=360, slew_cost=1, initial_az=None):
+        """
+        Compute the dome azimuth schedule of a list of targets, observed
+        one after the other; the dome is required to be clear at every
+        step (on the 1 degree grid of the cube).
+
+        Parameters
+        ----------
+
+        targets (list): (RA in degrees, Dec in degrees, duration) per target, in order of observation;
+            the duration is in seconds (or a timedelta)
+        start (str, datetime, or datetime64): UTC start time of the first target
+        step (float): time step in seconds; preferably below the time of 1 degree in HA (~240 s)
+        margin (int): no. azimuths on either side of the dome azimuth that should be clear too
+        move_cost (float): cost of a move, in degrees of slew
+        slew_cost (float): cost per degree slewed
+        initial_az (float): azimuth of the dome before the first target | default: free
+
+        Returns
+        -------
+
+        plan (dict): per step, 'time' (UTC datetime64), 'target' (index), 'ha', 'dec', 'az' (dome
+            azimuth), and 'clear'; as well as 'moves', a list of (step, from az, to az), and the totals
+            'n_moves', 'slew' (degrees), and 'n_obstructed' (steps)
+        """
+        times, index, ha, dec = self._steps(targets, start, step)
+
+        ha_index = np.rint(ha).astype(int) % self._clear.shape[0]
+        dec_index = np.clip(np.rint(dec).astype(int) + 90, 0, self._clear.shape[1] - 1)
+
+        clear = erode(self._clear[ha_index, dec_index], margin)
+
+        n_az = clear.shape[1]
+        az_step = 360/n_az
+
+        if initial_az is not None:
+            initial_az = int(np.rint(initial_az/az_step)) % n_az
+
+        path = schedule_azimuths(clear, move_cost=move_cost, slew_cost=slew_cost*az_step, initial_az=initial_az)
+
+        is_clear = clear[np.arange(path.size), path]
+
+        previous = np.concatenate([[path[0] if initial_az is None else initial_az], path[:-1]])
+        moved = np.flatnonzero(previous != path)
+
+        return {
+            'time': times,
+            'target': index,
+            'ha': ha,
+            'dec': dec,
+            'az': path*az_step,
+            'clear': is_clear,
+            'moves': [(int(k), previous[k]*az_step, path[k]*az_step) for k in moved],
+            'n_moves': int(moved.size),
+            'slew': float(circular_distance(previous, path, n_az).sum()*az_step),
+            'n_obstructed': int(np.sum(~is_clear)),
+        }
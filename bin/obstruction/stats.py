@@ -0,0 +1,216 @@
+import contextlib, functools, time
+
+
+class Stats:
+    """
+    Counters & per-stage timings of the obstruction engine, e.g. the
+    no. rays traced, the branches taken by the ray-dome intersection,
+    and the errors. Collection is disabled by default, s.t. the hot
+    paths only pay for a flag check; enable it w/ enable(). Every
+    process (e.g. joblib worker) has its own collector, see STATS; use
+    summary() & merge() to combine them.
+
+    Public methods
+    --------------
+
+    count (None): add to a counter
+    timer (context manager): time a stage
+    timed (decorator): time every call of a function as a stage
+    summary (dict): return the counters & timings (json-serializable)
+    merge (None): add the counters & timings of a summary
+    """
+    def __init__(self, enabled=False):
+        """"The Stats class constructor.
+
+        Parameters
+        ----------
+
+        enabled (bool): whether to collect
+        """
+        self.enabled = enabled
+        self.reset()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        """Clear all counters & timings."""
+        self.counters = {}
+        self.timings = {}
+
+    def count(self, name, n=1):
+        """Add n to a counter, if enabled."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Add the wall time of the block to a stage, if enabled."""
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator that times every call of a function as a stage."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                with self.timer(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add_time(self, name, seconds, calls=1):
+        """Add a duration to a stage."""
+        seconds_total, calls_total = self.timings.get(name, (0., 0))
+        self.timings[name] = (seconds_total + seconds, calls_total + calls)
+
+    def summary(self):
+        """Return the counters & timings (seconds & no. calls per stage)."""
+        return {
+            'counters': dict(self.counters),
+            'timings': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in self.timings.items()},
+        }
+
+    def merge(self, summary):
+        """Add the counters & timings of a summary, e.g. of another process."""
+        for name, n in summary['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+        for name, timing in summary['timings'].items():
+            self.add_time(name, timing['seconds'], calls=timing['calls'])
+
+    def format(self):
+        """Return the counters & timings as readable lines."""
+        lines = ['{:<32} {:>16,}'.format(name, n) for name, n in sorted(self.counters.items())]
+
+        total = sum(seconds for seconds, _ in self.timings.values())
+
+        for name, (seconds, calls) in sorted(self.timings.items(), key=lambda item: -item[1][0]):
+            lines.append('{:<32} {:>12.2f} s {:>6.1%} ({} calls)'.format(name, seconds, seconds/total if total else 0, calls))
+
+        return '\n'.join(lines)
+
+
+class Progress:
+    """
+    Live progress of a run: the fraction done, the throughput, and
+    the estimated time of arrival (ETA).
+    """
+    def __init__(self, total, unit='cells'):
+        """"The Progress class constructor.
+
+        Parameters
+        ----------
+
+        total (int): the total amount of work, e.g. no. cells
+        unit (str): the unit of the work
+        """
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.start = time.perf_counter()
+
+    def update(self, n):
+        """Add n units of work; return a status line."""
+        self.done += n
+
+        elapsed = self.get_elapsed()
+        rate = self.get_rate()
+        eta = (self.total - self.done)/rate if rate > 0 else float('nan')
+
+        return '{:>6.1%} done; {:.3g} {}/s; elapsed {}, ETA {}'.format(self.done/self.total if self.total else 1, rate, self.unit, format_seconds(elapsed), format_seconds(eta))
+
+    def get_elapsed(self):
+        """Return the no. seconds since the start."""
+        return time.perf_counter() - self.start
+
+    def get_rate(self):
+        """Return the throughput, in units per second."""
+        elapsed = self.get_elapsed()
+
+        return self.done/elapsed if elapsed > 0 else float('nan')
+
+
+class Utilization:
+    """
+    Busy time & no. tasks per worker (process) of a parallel run; the
+    utilization of a worker is its busy time over the wall time of the run.
+    """
+    def __init__(self, n_workers):
+        """"The Utilization class constructor.
+
+        Parameters
+        ----------
+
+        n_workers (int): no. workers of the pool; workers that get no tasks count as idle
+        """
+        self.n_workers = n_workers
+        self.workers = {}
+        self.start = time.perf_counter()
+
+    def add(self, worker, seconds, cells=0):
+        """Add a finished task of a worker (e.g. its pid)."""
+        busy, tasks, total = self.workers.get(worker, (0., 0, 0))
+        self.workers[worker] = (busy + seconds, tasks + 1, total + cells)
+
+    def summary(self, wall=None):
+        """Return the busy time, no. tasks & cells, and utilization per worker, and the efficiency of the pool."""
+        wall = time.perf_counter() - self.start if wall is None else wall
+
+        workers = {
+            str(worker): {'seconds': busy, 'tasks': tasks, 'cells': cells, 'utilization': busy/wall if wall > 0 else None}
+            for worker, (busy, tasks, cells) in self.workers.items()
+        }
+
+        busy = sum(seconds for seconds, _, _ in self.workers.values())
+
+        return {
+            'wall_seconds': wall,
+            'n_workers': self.n_workers,
+            'efficiency': busy/(wall*self.n_workers) if wall > 0 else None,
+            'workers': workers,
+        }
+
+    def format(self, wall=None, per_worker=False):
+        """Return the efficiency of the pool (& the utilization per worker) as readable lines."""
+        summary = self.summary(wall)
+        utilization = [worker['utilization'] or 0 for worker in summary['workers'].values()] or [0]
+
+        lines = ['{} workers busy {:.1%} of the time (per worker: min {:.1%}, max {:.1%}); {} tasks'.format(
+            summary['n_workers'], summary['efficiency'] or 0, min(utilization), max(utilization),
+            sum(worker['tasks'] for worker in summary['workers'].values())
+        )]
+
+        if per_worker:
+            for name, worker in sorted(summary['workers'].items()):
+                lines.append('worker {:<10} {:>6.1%} busy, {:>5} tasks, {:>12,} cells'.format(name, worker['utilization'] or 0, worker['tasks'], worker['cells']))
+
+        return '\n'.join(lines)
+
+
+def format_seconds(seconds):
+    """Format a duration as h:mm:ss."""
+    if seconds != seconds:
+        return '?'
+
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+# The collector of this process
+STATS = Stats()
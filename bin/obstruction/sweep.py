@@ -0,0 +1,113 @@
+import dataclasses, functools, itertools
+import numpy as np
+
+from joblib import Parallel, delayed
+
+from obstruction.aperture import APERTURE_TYPES
+from obstruction.config import resolve_geometry
+
+
+def geometry_grid(base=None, **axes):
+    """
+    Return the geometries of all combinations of parameter values,
+    e.g. geometry_grid(slit_width=[1.6, 1.8], l_3=[0.43, 0.45]).
+
+    Parameters
+    ----------
+
+    base (Geometry): the geometry of the parameters that are not varied | default: from the config
+    axes (lists): values per Geometry field
+    """
+    base = resolve_geometry(base)
+
+    names = list(axes)
+
+    return [dataclasses.replace(base, **dict(zip(names, values))) for values in itertools.product(*axes.values())]
+
+
+def sky_poses(n, latitude, min_altitude=0):
+    """
+    Return n (HA, Dec) pointings spread uniformly (per unit of solid
+    angle) over the sky above an altitude, on a Fibonacci lattice.
+
+    Parameters
+    ----------
+
+    n (int): no. pointings
+    latitude (float): latitude of the observatory in degrees
+    min_altitude (float): min. altitude in degrees
+    """
+    index = np.arange(n)
+
+    # Uniform in sin(altitude) is uniform in solid angle
+    sin_min = np.sin(np.radians(min_altitude))
+    alt = np.arcsin(sin_min + (1 - sin_min)*(index + 0.5)/n)
+    az = np.radians(index*180*(3 - np.sqrt(5)))
+
+    lat = np.radians(latitude)
+
+    dec = np.arcsin(np.sin(lat)*np.sin(alt) + np.cos(lat)*np.cos(alt)*np.cos(az))
+    ha = np.arctan2(-np.sin(az)*np.cos(alt), np.cos(lat)*np.sin(alt) - np.sin(lat)*np.cos(alt)*np.cos(az))
+
+    return np.degrees(ha) % 360, np.degrees(dec)
+
+
+@functools.lru_cache(maxsize=64)
+def get_aperture(geometry, name, rate):
+    """Return the (memoized) aperture of a geometry, s.t. its samples are shared between evaluations."""
+    return APERTURE_TYPES[name](rate=rate, geometry=geometry)
+
+
+@functools.lru_cache(maxsize=1024)
+def clear_sky_fraction(geometry, aperture='guider', rate=3, n_poses=2000, min_altitude=20, requirement=0., az_step=1):
+    """
+    Compute the fraction of the sky (above an altitude) for which the
+    aperture can be kept clear, i.e. for which there is a dome azimuth
+    at which the obstruction is at most the requirement; memoized per
+    (hashable) geometry.
+
+    Parameters
+    ----------
+
+    geometry (Geometry): the geometry of the mount & dome
+    aperture (str): telescope, guider, or finder
+    rate (int): sample rate of the aperture
+    n_poses (int): no. pointings, see sky_poses
+    min_altitude (float): min. altitude in degrees
+    requirement (float): max. obstruction ratio of a clear aperture
+    az_step (float): step of the dome azimuths in degrees
+    """
+    ha, dec = sky_poses(n_poses, geometry.latitude, min_altitude)
+
+    ratio = get_aperture(geometry, aperture, rate).obstruction_profile(ha, dec, np.arange(0, 360, az_step))
+
+    return float(np.mean(ratio.min(axis=1) <= requirement))
+
+
+def sweep(geometries, function=clear_sky_fraction, n_jobs=-1, **kwargs):
+    """
+    Evaluate a function of the geometry for many geometries concurrently,
+    on a pool of processes (joblib); duplicate geometries are evaluated
+    only once, and the (persistent) workers keep their per-geometry caches
+    between sweeps.
+
+    Parameters
+    ----------
+
+    geometries (list of Geometry): the geometries
+    function (callable): function(geometry, **kwargs); picklable, e.g. clear_sky_fraction
+    n_jobs (int): no. processes, see joblib.Parallel
+    kwargs: the other arguments of the function
+
+    Returns
+    -------
+
+    results (list): the results, in the order of the geometries
+    """
+    unique = list(dict.fromkeys(geometries))
+
+    results = Parallel(n_jobs=n_jobs)(delayed(function)(geometry, **kwargs) for geometry in unique)
+
+    lookup = dict(zip(unique, results))
+
+    return [lookup[geometry] for geometry in geometries]
@@ -0,0 +1,142 @@
+import functools, itertools, os, time
+import numpy as np
+
+from obstruction.aperture import APERTURE_TYPES, count_paths, within_limits
+from obstruction.cube import quantize
+from obstruction.engine import ApertureSet
+from obstruction.stats import STATS
+
+
+def make_tiles(shape, tile_shape):
+    """
+    Split a cube into tiles of (at most) tile_shape; the tiles at the
+    end of an axis are smaller if the axis is not a multiple of the tile.
+
+    Parameters
+    ----------
+
+    shape (tuple of int): shape of the cube, i.e. (az, ha, dec)
+    tile_shape (tuple of int): shape of a tile
+
+    Returns
+    -------
+
+    tiles (list): the tiles as tuples of slices (indexing the cube), the largest first
+    """
+    starts = [range(0, n, size) for n, size in zip(shape, tile_shape)]
+
+    tiles = [
+        tuple(slice(start, min(start + size, n)) for start, size, n in zip(corner, tile_shape, shape))
+        for corner in itertools.product(*starts)
+    ]
+
+    # Largest first, s.t. the small tiles fill the gaps at the end of the run
+    return sorted(tiles, key=lambda tile: -get_tile_size(tile))
+
+
+def get_tile_size(tile):
+    """Return the no. cells of a tile."""
+    return int(np.prod([s.stop - s.start for s in tile]))
+
+
+def auto_tile_shape(shape, n_workers, tiles_per_worker=16):
+    """
+    Return a tile shape that gives every worker (at least)
+    tiles_per_worker tiles to balance the load w/. A tile spans all
+    azimuths, since the rays of a pose are traced once for all dome
+    azimuths (see ApertureSet.obstruction_profile), and a single hour
+    angle; the declinations are split only if there are too few hour
+    angles for the no. workers.
+
+    Parameters
+    ----------
+
+    shape (tuple of int): shape of the cube, i.e. (az, ha, dec)
+    n_workers (int): no. workers
+    tiles_per_worker (int): min. no. tiles per worker
+    """
+    n_az, n_ha, n_dec = shape
+
+    n_splits = min(n_dec, max(1, -(-tiles_per_worker*n_workers // n_ha)))
+
+    return n_az, 1, -(-n_dec // n_splits)
+
+
+@functools.lru_cache(maxsize=8)
+def get_aperture_set(names, rate):
+    """Return the aperture set of the names; built once per process rather than sent w/ every tile."""
+    return ApertureSet([APERTURE_TYPES[name](rate=rate) for name in names])
+
+
+def compute_tile(tile, names, paths, axes, rate=3, quantized=False, exact=False, fast_path=True, limits=True, stats=False):
+    """
+    Compute the % obstruction of the apertures for a tile of the
+    (az, ha, dec) grid and write it into the cubes; the cubes are
+    memory-mapped npy files (shared between the processes), hence
+    only a small summary is returned to the main process.
+
+    Parameters
+    ----------
+
+    tile (tuple of slices): the (az, ha, dec) tile, see make_tiles
+    names (tuple of str): names of the apertures
+    paths (dict): path of the (preallocated) cube per aperture name
+    axes (tuple of ndarray): the azimuth, hour angle & declination axes of the grid in degrees
+    rate (int): sample rate of the apertures
+    quantized (bool): whether the cubes store blocked-ray counts rather than ratios, see obstruction.cube.quantize
+    exact (bool): see ApertureSet.obstruction_profile
+    fast_path (bool): see ApertureSet.obstruction_profile
+    limits (bool): if True, the poses outside of the limits (see obstruction.aperture.within_limits) are not traced, but masked (NaN)
+    stats (bool): whether to collect the instrumentation, see obstruction.stats
+
+    Returns
+    -------
+
+    result (dict): the tile, the fast-path path counts & the no. masked cells per aperture,
+        the stats summary, the worker (pid), and its busy time in seconds
+    """
+    start = time.perf_counter()
+
+    # Workers run in separate processes, each w/ its own collector
+    STATS.enable(stats)
+    STATS.reset()
+
+    apertures = get_aperture_set(tuple(names), rate)
+
+    for aperture in apertures.apertures:
+        aperture.path_counts = count_paths(np.empty(0))
+
+    az, ha, dec = (axis[s] for axis, s in zip(axes, tile))
+
+    ha, dec = np.meshgrid(ha, dec, indexing='ij')
+
+    reachable = within_limits(ha, dec, apertures.geometry) if limits else np.ones(ha.shape, dtype=bool)
+
+    # % obstruction; shape (ha, dec, az)
+    ratios = {name: np.full(ha.shape + az.shape, np.nan) for name in apertures.get_names()}
+
+    if reachable.any():
+        for name, ratio in apertures.obstruction_profile(ha[reachable], dec[reachable], az, exact=exact, fast_path=fast_path).items():
+            ratios[name][reachable] = ratio
+
+    with STATS.timer('write'):
+        for aperture in apertures.apertures:
+            p = np.moveaxis(ratios[aperture.get_name()], -1, 0)
+
+            if quantized:
+                p = quantize(p, aperture.get_weight_denominator())
+
+            # The pages are shared w/ the other processes; the main process flushes them to disk
+            cube = np.load(paths[aperture.get_name()], mmap_mode='r+')
+            cube[tile] = p
+
+            del cube
+
+    return {
+        'tile': tile,
+        'path_counts': {aperture.get_name(): aperture.path_counts for aperture in apertures.apertures},
+        'masked': {aperture.get_name(): int(np.count_nonzero(~reachable))*az.size for aperture in apertures.apertures},
+        'stats': STATS.summary(),
+        'worker': os.getpid(),
+        'seconds': time.perf_counter() - start,
+    }
@@ -0,0 +1,215 @@
+import datetime
+import numpy as np
+
+from obstruction.config import load_geometry
+from obstruction.dwell import clear_run_length
+
+# Julian date of the J2000 epoch (2000-01-01 12:00 UTC)
+J2000 = 2451545.0
+J2000_EPOCH = np.datetime64('2000-01-01T12:00:00', 'us')
+
+
+def to_datetime64(time):
+    """
+    Convert a UTC time (ISO string, datetime, or datetime64) to a
+    datetime64; aware datetimes are converted to UTC first.
+    """
+    if isinstance(time, datetime.datetime) and time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return np.datetime64(time, 'us')
+
+
+def to_seconds(duration):
+    """Convert a duration (seconds, timedelta, or timedelta64) to seconds."""
+    if isinstance(duration, datetime.timedelta):
+        return duration.total_seconds()
+
+    if isinstance(duration, np.timedelta64):
+        return duration / np.timedelta64(1, 's')
+
+    return float(duration)
+
+
+def julian_date(times):
+    """
+    Compute the Julian dates of UTC times.
+
+    Parameters
+    ----------
+
+    times (datetime64 ndarray): UTC times
+    """
+    return J2000 + (np.asarray(times, dtype='datetime64[us]') - J2000_EPOCH) / np.timedelta64(1, 'D')
+
+
+def sidereal_time(times, longitude=None):
+    """
+    Compute the local mean sidereal time (IAU 1982 expression of GMST;
+    the difference between UT1 & UTC, <1 s, is neglected).
+
+    Parameters
+    ----------
+
+    times (datetime64 ndarray): UTC times
+    longitude (float): longitude of the observatory in degrees, east positive | default: from the config
+
+    Returns
+    -------
+
+    lst (float ndarray): local sidereal time in degrees (0 to 360)
+    """
+    if longitude is None:
+        longitude = load_geometry().longitude
+
+    d = julian_date(times) - J2000
+    t = d/36525
+
+    gmst = 280.46061837 + 360.98564736629*d + 0.000387933*t**2 - t**3/38710000
+
+    return (gmst + longitude) % 360
+
+
+def hour_angle(ra, times, longitude=None):
+    """
+    Compute the hour angle of a target at UTC times.
+
+    Parameters
+    ----------
+
+    ra (float ndarray): right ascension in degrees
+    times (datetime64 ndarray): UTC times
+    longitude (float): longitude of the observatory in degrees, east positive | default: from the config
+
+    Returns
+    -------
+
+    ha (float ndarray): hour angles in degrees (0 to 360)
+    """
+    return (sidereal_time(times, longitude) - ra) % 360
+
+
+def track_times(start, duration, step):
+    """
+    Return the UTC times of a track, from start up to and including
+    start + duration.
+
+    Parameters
+    ----------
+
+    start (str, datetime, or datetime64): UTC start time, e.g. '2024-03-01T21:00:00'
+    duration (float, timedelta, or timedelta64): duration of the track (seconds if a float)
+    step (float, timedelta, or timedelta64): time step (seconds if a float)
+    """
+    duration = to_seconds(duration)
+    step = to_seconds(step)
+
+    if step <= 0 or duration < 0:
+        raise ValueError('The time step should be positive & the duration non-negative...')
+
+    offsets = np.arange(0, duration + step/2, step)
+
+    return to_datetime64(start) + np.rint(offsets*1e6).astype('timedelta64[us]')
+
+
+def clear_windows(clear, azimuths, dome_az):
+    """
+    Find, for every step of a track, the arc of clear dome azimuths
+    that contains the dome azimuth (i.e. the azimuths the dome can
+    move over w/o obstructing the aperture).
+
+    Parameters
+    ----------
+
+    clear (bool ndarray): clear (step, azimuth) cells
+    azimuths (float ndarray): the equally spaced dome azimuths covering 360 deg, i.e. the columns of clear
+    dome_az (float ndarray): dome azimuth per step
+
+    Returns
+    -------
+
+    start, end (float ndarray): the (clockwise) edges of the arcs; NaN if the dome azimuth is
+        obstructed on the grid, and (azimuths[0], azimuths[-1]) if all azimuths are clear
+    """
+    n_steps, n_az = clear.shape
+    az_step = 360/n_az
+
+    steps = np.arange(n_steps)
+    az_index = np.rint((dome_az - azimuths[0])/az_step).astype(int) % n_az
+
+    # The no. clear azimuths after (forward) & before (backward) the dome azimuth, including itself
+    forward = clear_run_length(clear, axis=1)[steps, az_index]
+    backward = clear_run_length(clear[:, ::-1], axis=1)[steps, n_az - 1 - az_index]
+
+    start = azimuths[(az_index - backward + 1) % n_az]
+    end = azimuths[(az_index + forward - 1) % n_az]
+
+    is_full = forward == n_az
+    start = np.where(is_full, azimuths[0], start)
+    end = np.where(is_full, azimuths[-1], end)
+
+    is_obstructed = forward == 0
+
+    return np.where(is_obstructed, np.nan, start), np.where(is_obstructed, np.nan, end)
+
+
+def obstruction_timeline(aperture, ra, dec, start, duration, step, dome_az, azimuths=None, longitude=None, chunk_size=256, fast_path=True):
+    """
+    Evaluate the obstruction of an aperture while it tracks a target;
+    the hour angles of all steps are computed at once and traced as
+    one batch.
+
+    Parameters
+    ----------
+
+    aperture (Aperture): the aperture
+    ra (float): right ascension of the target in degrees
+    dec (float): declination of the target in degrees
+    start (str, datetime, or datetime64): UTC start time
+    duration (float, timedelta, or timedelta64): duration of the track (seconds if a float)
+    step (float, timedelta, or timedelta64): time step (seconds if a float)
+    dome_az (float or float ndarray): dome azimuth (clockwise convention), fixed or per step
+    azimuths (float ndarray): equally spaced dome azimuths covering 360 deg, used for the
+        clear azimuth windows | default: 1 degree steps
+    longitude (float): longitude of the observatory in degrees, east positive | default: from the config
+    chunk_size (int): max. no. poses traced at once, see Aperture.obstruction_profile
+    fast_path (bool): if True, skip tracing poses that are fully clear/blocked, see Aperture.obstruction_profile
+
+    Returns
+    -------
+
+    timeline (dict): per step, 'time' (UTC datetime64), 'ha' (degrees), 'dec', 'dome_az',
+        'obstruction' (ratio at the dome azimuth), 'window_start' & 'window_end' (the arc of clear
+        azimuths containing the dome azimuth, see clear_windows), and 'dwell' (the no. seconds
+        the aperture stays clear at the dome azimuth, up to the end of the track; 0 if obstructed)
+    """
+    if azimuths is None:
+        azimuths = np.arange(360, dtype=float)
+
+    times = track_times(start, duration, step)
+    step = to_seconds(step)
+
+    ha = hour_angle(ra, times, longitude)
+    dec = np.full(times.shape, float(dec))
+    dome_az = np.broadcast_to(np.asarray(dome_az, dtype=float) % 360, times.shape)
+
+    # Evaluate the dome azimuth(s) along w/ the azimuth grid, in one pass over the poses
+    profile = aperture.obstruction_profile(ha, dec, np.concatenate([azimuths, np.unique(dome_az)]), chunk_size=chunk_size, fast_path=fast_path)
+
+    ratio = profile[np.arange(times.size), azimuths.size + np.searchsorted(np.unique(dome_az), dome_az)]
+
+    window_start, window_end = clear_windows(profile[:, :azimuths.size] == 0, azimuths, dome_az)
+
+    # Clear steps remaining from each step; the blocked step appended ends the runs at the end of the track
+    run = clear_run_length(np.append(ratio == 0, False), axis=0)[:-1]
+
+    return {
+        'time': times,
+        'ha': ha,
+        'dec': dec,
+        'dome_az': np.array(dome_az),
+        'obstruction': ratio,
+        'window_start': window_start,
+        'window_end': window_end,
+        'dwell': np.maximum(run - 1, 0)*step,
+    }
@@ -15,53 +15,103 @@ def vec3(v4):
 
     return v3
 
+# Sine & cosine tables for angles on the 1 degree grid
+_SIN_TABLE = np.sin(np.radians(np.arange(360)))
+_COS_TABLE = np.cos(np.radians(np.arange(360)))
+
+def _sincos(angle):
+    """
+    Return the sine & cosine of an angle (array) in degrees; 
+    angles on the 1 degree grid are looked up in tables.
+    """
+    angle = np.asarray(angle)
+    index = np.round(angle)
+
+    if np.array_equal(index, angle):
+        index = index.astype(int) % 360
+
+        return _SIN_TABLE[index], _COS_TABLE[index]
+
+    angle = np.radians(angle)
+
+    return np.sin(angle), np.cos(angle)
+
+def _identity(shape):
+    """
+    Return a stack of 4x4 identity matrices; shape 
+    is the shape of the stack, i.e. () for a single matrix.
+    """
+    H = np.zeros(shape + (4, 4))
+    H[..., [0, 1, 2, 3], [0, 1, 2, 3]] = 1
+
+    return H
+
 def transform(x, y, z):
-    """Transform a vector (x', y', z', 1)."""
-    return np.array([
-        [1, 0, 0, x],
-        [0, 1, 0, y],
-        [0, 0, 1, z],
-        [0, 0, 0, 1],
-    ])
+    """
+    Transform a vector (x', y', z', 1).
+
+    The coordinates may be arrays, in which case a 
+    stack of matrices of shape (..., 4, 4) is returned.
+    """
+    x, y, z = np.broadcast_arrays(x, y, z)
+
+    H = _identity(x.shape)
+    H[..., 0, 3] = x
+    H[..., 1, 3] = y
+    H[..., 2, 3] = z
+
+    return H
 
 def rot_x(angle):
     """
     Rotate a vector (x, y, z, 1) about the x-axis 
     in a right-handed coordinate system.
+
+    The angle may be an array, in which case a 
+    stack of matrices of shape (..., 4, 4) is returned.
     """
-    angle = np.radians(angle)
+    s, c = _sincos(angle)
+
+    H = _identity(np.shape(angle))
+    H[..., 1, 1] = c
+    H[..., 1, 2] = -s
+    H[..., 2, 1] = s
+    H[..., 2, 2] = c
 
-    return np.array([
-        [1,             0,              0, 0],
-        [0, np.cos(angle), -np.sin(angle), 0],
-        [0, np.sin(angle),  np.cos(angle), 0],
-        [0,             0,              0, 1],
-    ])
+    return H
 
 def rot_y(angle):
     """
     Rotate a vector (x, y, z, 1) about the y-axis 
     in a right-handed coordinate system.
+
+    The angle may be an array, in which case a 
+    stack of matrices of shape (..., 4, 4) is returned.
     """
-    angle = np.radians(angle)
+    s, c = _sincos(angle)
+
+    H = _identity(np.shape(angle))
+    H[..., 0, 0] = c
+    H[..., 0, 2] = -s
+    H[..., 2, 0] = -s
+    H[..., 2, 2] = c
 
-    return np.array([
-        [np.cos(angle),  0,  -np.sin(angle), 0],
-        [0,              1,               0, 0],
-        [-np.sin(angle), 0,   np.cos(angle), 0],
-        [0,              0,               0, 1],
-    ])
+    return H
 
 def rot_z(angle):
     """
     Rotate a vector (x, y, z, 1) about the z-axis 
     in a right-handed coordinate system.
+
+    The angle may be an array, in which case a 
+    stack of matrices of shape (..., 4, 4) is returned.
     """
-    angle = np.radians(angle)
+    s, c = _sincos(angle)
+
+    H = _identity(np.shape(angle))
+    H[..., 0, 0] = c
+    H[..., 0, 1] = -s
+    H[..., 1, 0] = s
+    H[..., 1, 1] = c
 
-    return np.array([
-        [np.cos(angle),  -np.sin(angle), 0, 0],
-        [np.sin(angle),  np.cos(angle),  0, 0],
-        [0,                          0,  1, 0],
-        [0,                          0,  0, 1],
-    ])
\ No newline at end of file
+    return H
@@ -0,0 +1,83 @@
+import argparse, contextlib, json, sys, time
+import numpy as np
+
+from obstruction.aperture import APERTURE_TYPES
+from obstruction.field import ObstructionField, bulk_query
+
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Compute the % obstruction at arbitrary (continuous) coordinates from an obstruction cube generated w/ obstruction_grid.py; cells that straddle the edges of the slit are ray traced exactly'
+        )
+
+parser.add_argument('cube', action='store', type=str, help='obstruction cube (npy or compact .cube) generated w/ obstruction_grid.py')
+parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='aperture of the cube: telescope, finder, guider | default: telescope')
+parser.add_argument('-r', '--rate', action='store', type=int, default=3, help='sample rate the cube was generated w/ | default: 3')
+parser.add_argument('-i', '--interpolate_only', default=False, action='store_true', help='only interpolate, i.e. do not trace the cells that straddle a transition')
+
+subparsers = parser.add_subparsers(dest='mode', required=True)
+
+query_parser = subparsers.add_parser('query', help='compute a single pose')
+query_parser.add_argument('--ha', action='store', type=float, default=0.0, help='telescope hour angle: 0 to 24 h | default: 0 h')
+query_parser.add_argument('--dec', action='store', type=float, default=0.0, help='telescope declination -90 to 90 deg | default: 0 deg')
+query_parser.add_argument('--az', action='store', type=float, default=0.0, help='dome azimuth: 0 to 360 deg | default: 0 deg')
+
+bulk_parser = subparsers.add_parser('bulk', help='compute "ha,dec,az" lines (HA in hours) from a file or stdin; writes csv to stdout')
+bulk_parser.add_argument('file', action='store', type=str, nargs='?', default='-', help='input file | default: stdin')
+
+validate_parser = subparsers.add_parser('validate', help='report the max. error w.r.t. the ray tracer on random poses, and the speed of the field')
+validate_parser.add_argument('-n', action='store', type=int, default=20000, help='no. random poses | default: 20000')
+validate_parser.add_argument('--seed', action='store', type=int, default=0, help='seed of the random poses | default: 0')
+
+args = parser.parse_args()
+
+
+def bulk(field, lines, out):
+    """Compute "ha,dec,az" queries in chunks, see obstruction.field.bulk_query; report the lines that could not be parsed."""
+    n_queries, n_skipped = bulk_query(field, lines, out)
+
+    if n_skipped:
+        print('WARNING: {} of {} lines could not be parsed (skipped)'.format(n_skipped, n_queries + n_skipped), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    if args.aperture not in APERTURE_TYPES:
+        parser.error('unknown aperture "{}"'.format(args.aperture))
+
+    aperture = APERTURE_TYPES[args.aperture](rate=args.rate)
+
+    field = ObstructionField.load(args.cube, aperture=None if args.interpolate_only else aperture)
+
+    if args.mode == 'query':
+        ratio = float(field(args.ha*15, args.dec, args.az))
+
+        print('Obstruction = {:.2%}'.format(ratio) if not np.isnan(ratio) else 'The pose is outside of the limits')
+
+    elif args.mode == 'bulk':
+        with contextlib.nullcontext(sys.stdin) if args.file == '-' else open(args.file) as lines:
+            bulk(field, lines, sys.stdout)
+
+    elif args.mode == 'validate':
+        field.aperture = aperture
+
+        start = time.perf_counter()
+        report = field.validate(n=args.n, seed=args.seed)
+        duration = time.perf_counter() - start
+
+        print(json.dumps(report, indent=2))
+
+        # The speed of the field vs the ray tracer, on the same poses
+        rng = np.random.default_rng(args.seed + 1)
+        ha, dec, az = rng.uniform(0, 360, args.n), np.degrees(np.arcsin(rng.uniform(-1, 1, args.n))), rng.uniform(0, 360, args.n)
+
+        timings = {}
+
+        for name, function in [('interpolated', lambda: field.interpolate(ha, dec, az)), ('field', lambda: field(ha, dec, az)), ('ray traced', lambda: aperture.obstruction_batch(ha, dec, az))]:
+            start = time.perf_counter()
+            function()
+            timings[name] = time.perf_counter() - start
+
+        for name, seconds in timings.items():
+            print('{:<14} {:>8.2f} us/pose ({:.3g} poses/s)'.format(name, seconds/args.n*1e6, args.n/seconds))
+
+        print('Validated {} poses in {:.1f} s'.format(report['n'], duration))
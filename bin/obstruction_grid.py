@@ -1,103 +1,397 @@
 import numpy as np
-import argparse
+import argparse, hashlib, json, os, time
 
 from pathlib import Path
-from joblib import Parallel, delayed, dump, load
+from joblib import Parallel, delayed, effective_n_jobs
 from datetime import datetime
 
-from obstruction.aperture import TelescopeAperture, GuiderAperture, FinderAperture
+from obstruction.adaptive import AdaptiveGrid
+from obstruction.aperture import APERTURE_TYPES, count_paths, within_limits
+from obstruction.cube import count_dtype, quantize, save_cube
+from obstruction.engine import ApertureSet
+from obstruction.stats import STATS, Progress, Stats, Utilization
+from obstruction.tiles import auto_tile_shape, compute_tile, get_tile_size, make_tiles
 
 
 parser = argparse.ArgumentParser(
             allow_abbrev=True, 
-            description='Produce a grid of the obstruction % of the telescope/finder/guider by the dome for all possible HAs, Decs, and dome azimuth angles'
+            description='Produce a grid of the obstruction % of the telescope/finder/guider by the dome for all possible HAs, Decs, and dome azimuth angles; multiple apertures are computed in a single pass'
         )
 
-parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture: telescope, finder, guider | default: telescope')
+parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture(s): telescope, finder, guider, or a combination, e.g. telescope_guider or telescope,guider,finder | default: telescope')
 parser.add_argument('-r', '--rate', action='store', type=int, default=3, help='no. rays (for decent results >3; preferably 4-10) | default: 3')
+parser.add_argument('-e', '--exact', default=False, action='store_true', help='evaluate the exact obstruction vs azimuth profile rather than testing each azimuth')
+parser.add_argument('--adaptive', default=False, action='store_true', help='refine a coarse (4 deg) lattice only where the obstruction changes, rather than tracing every cell')
+parser.add_argument('-t', '--trace_all', default=False, action='store_true', help='trace all rays of all poses, i.e. disable the fast-path pre-test of fully clear/blocked poses')
+parser.add_argument('-l', '--no_limits', default=False, action='store_true', help='trace all poses, i.e. do not mask the poses below the min. altitude or beyond the max. |HA| of the [limits] in config.ini')
+parser.add_argument('-q', '--quantize', default=False, action='store_true', help='store blocked-ray counts in a compact, chunked, cube rather than float ratios')
+parser.add_argument('-c', '--compress', default=False, action='store_true', help='compress the chunks of the compact cube (implies -q)')
+parser.add_argument('-f', '--force', default=False, action='store_true', help='recompute all slices, even if the existing cube is up to date')
+parser.add_argument('-j', '--jobs', action='store', type=int, default=-1, help='no. worker processes | default: all cores')
+parser.add_argument('--tile', action='store', type=str, default=None, help='shape of the tiles of the (az, ha, dec) grid that are dispatched to the workers, e.g. 360,1,181 | default: all azimuths, 1 HA & enough Dec splits for >= 16 tiles per worker')
+parser.add_argument('-s', '--stats', '--profile', default=False, action='store_true', help='collect the no. rays traced, intersection branches, errors & per-stage timings; printed & stored as json at the end of the run')
 
 args = parser.parse_args()
 
+args.quantize = args.quantize or args.compress
+
+if args.tile is not None:
+    try:
+        args.tile = tuple(int(size) for size in args.tile.split(','))
+    except ValueError:
+        args.tile = ()
+
+    if len(args.tile) != 3 or min(args.tile) < 1:
+        parser.error('the tile should be 3 positive integers (az,ha,dec), e.g. 360,1,181')
+
 
 # sample HA from 0 h to 24 h & Dec from -90 to 90 deg
 ha = np.linspace(0, 359, 360)
 dec = np.linspace(-90, 90, 181)
 
-# Create a temporary joblib data file for each azimuth
 az_range = np.arange(0, 360, 1)
 
-# Select the appropriate aperture
-if args.aperture == 'guider':
-    APERTURE = GuiderAperture(rate=args.rate)
-elif args.aperture == 'finder':
-    APERTURE = FinderAperture(rate=args.rate)
-else:
-    APERTURE = TelescopeAperture(rate=args.rate)
+# Coarse lattice of the adaptive grid (in degrees); refined down to the 1 degree grid
+ADAPTIVE_STEP = 4
+ADAPTIVE_LEVELS = 2
+
+# Min. no. seconds between flushing the cubes & recording the completed slices
+CHECKPOINT_INTERVAL = 10
+
+# Select the appropriate aperture(s)
+names = args.aperture.replace(',', '_').split('_')
+
+if not set(names) <= set(APERTURE_TYPES):
+    parser.error('unknown aperture in "{}"'.format(args.aperture))
+
+APERTURES = {name: APERTURE_TYPES[name](rate=args.rate) for name in dict.fromkeys(names)}
+
+# Data type of the cubes; blocked-ray weights, in units of the weight denominator (if quantized), or obstruction ratios
+DENOMINATORS = {name: aperture.get_weight_denominator() for name, aperture in APERTURES.items()}
+DTYPES = {name: count_dtype(n) if args.quantize else np.dtype(np.float64) for name, n in DENOMINATORS.items()}
 
 # Verify whether the appropriate file structure exists/otherwise create required folders
-req_path = Path.cwd() / 'data' / APERTURE.get_name() / 'obstructed'
+req_path = Path.cwd() / 'data'
 
 try:
     req_path.mkdir(parents=True, exist_ok=False)
 except FileExistsError:
     pass
 else:
-    print('Created the data/.../obstructed folder(s)...')
+    print('Created the data folder...')
 
 
-def get_azimuth_path(az):
-    fn = 'az_{}.joblib'.format(int(az))
+def get_cube_path(name):
+    suffix = '_counts' if args.quantize else ''
+    fn = 'obstruction_cube_{}{}.npy'.format(name, suffix)
 
     return req_path / fn
 
-def generate_obstruction_grid(az):
-    """Store the % obstruction for a single azimuth.
-    
-    Parameters
-    ----------
-    az: the azimuth in degrees
+def get_compact_path(file_path):
+    return file_path.with_suffix('.cube')
+
+def get_manifest_path(file_path):
+    return file_path.with_suffix('.json')
+
+def get_key(parameters):
+    """Hash the parameters (a json-serializable dict) the cube depends on."""
+    serialized = json.dumps(parameters, sort_keys=True)
+
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+def load_manifest(manifest_path):
+    """Load the manifest of a (partially) generated cube; None if there is none."""
+    try:
+        with manifest_path.open('r') as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_manifest(manifest_path, manifest):
+    """Write the manifest atomically, s.t. an interrupted run never leaves a corrupt manifest."""
+    tmp_path = manifest_path.with_suffix('.tmp')
+
+    with tmp_path.open('w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    os.replace(tmp_path, manifest_path)
+
+def create_cube(file_path, dtype):
+    """
+    Preallocate the obstruction cube, indexed as (az, ha, dec), 
+    as a memory-mapped npy file.
     """
-    p = np.zeros((ha.size, dec.size)) # % obstruction grid
+    cube = np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=(az_range.size, ha.size, dec.size))
+    cube.flush()
 
-    for i in range(ha.size):
-        for j in range(dec.size):
-            percentage = APERTURE.obstruction(ha[i], dec[j], az)
+    del cube
+
+def generate_adaptive_grid(name):
+    """
+    Store the % obstruction of an aperture for all hour angles at once, 
+    resampled from an adaptive grid; only the cells near the edges of 
+    the slit are refined, see obstruction.adaptive.AdaptiveGrid.
+    """
+    grid = AdaptiveGrid(APERTURES[name], coarse_step=ADAPTIVE_STEP, levels=ADAPTIVE_LEVELS, fast_path=not args.trace_all, limits=not args.no_limits)
+
+    statistics = grid.get_statistics()
+
+    print('Refined [{}] grid w/ {} evaluations ({:.1%} of the full grid) at {}'.format(name, statistics['evaluations'], statistics['evaluations']/(az_range.size*ha.size*dec.size), datetime.now().strftime('%H:%M')))
+
+    cube = np.load(get_cube_path(name), mmap_mode='r+')
 
-            p[i, j] = percentage
+    reachable = within_limits(ha[:, np.newaxis], dec, APERTURES[name].geometry) if not args.no_limits else True
 
-    print('Finished az = {:>3.0f} degrees at {}'.format(az, datetime.now().strftime('%H:%M')))
+    for j, az in enumerate(az_range):
+        p = np.where(reachable, grid.resample([az], ha, dec)[0], np.nan)
 
-    with get_azimuth_path(az).open(mode='wb') as azimuth_file:
-        dump(p, azimuth_file)
+        cube[j] = quantize(p, DENOMINATORS[name]) if args.quantize else p
 
-def combine():
+    cube.flush()
+
+    del cube
+
+
+def prepare_cube(name):
     """
-    Load the obstruction grids (1 per azimuth angle) and stitch 
-    them together and store them as npy files.
+    Load the manifest of the cube of an aperture, or (re)create 
+    the cube if it is missing or outdated.
     """
-    obstr_cube = []
+    file_path = get_cube_path(name)
+    manifest_path = get_manifest_path(file_path)
+
+    # The cube depends only on the parameters of the aperture & the grid axes
+    parameters = {
+        'aperture': APERTURES[name].get_parameters(),
+        'dtype': DTYPES[name].name,
+        'grid': {axis_name: [float(axis[0]), float(axis[-1]), axis.size] for axis_name, axis in [('az', az_range), ('ha', ha), ('dec', dec)]},
+    }
+
+    if not args.no_limits:
+        geometry = APERTURES[name].geometry
+
+        parameters['limits'] = {'min_altitude': geometry.min_altitude, 'max_hour_angle': geometry.max_hour_angle}
 
-    for az in az_range:
-        with get_azimuth_path(az).open(mode='rb') as azimuth_file:
-            data = load(azimuth_file)
-            obstr_cube.append(data)
+    # Tiles w/ & w/o the exact profile are computed differently (see ApertureSet.obstruction_profile); do not mix them
+    if args.exact:
+        parameters['exact'] = True
 
-    obstr_cube = np.array(obstr_cube)
+    if args.adaptive:
+        parameters['adaptive'] = {'coarse_step': ADAPTIVE_STEP, 'levels': ADAPTIVE_LEVELS}
 
-    date_signature = datetime.now().strftime('%d_%h_%Y')
-    fn = 'obstruction_cube_{}_{}.npy'.format(args.aperture, date_signature)
-    file_path = Path.cwd() / 'data' / fn
+    key = get_key(parameters)
 
-    with file_path.open(mode='wb') as obstr_file:
-        np.save(obstr_file, obstr_cube)
-    
-    print('Obstruction cube is stored in "{}"'.format(file_path))
+    manifest = load_manifest(manifest_path)
+
+    if args.force or manifest is None or manifest['key'] != key or not file_path.exists():
+        if manifest is not None:
+            print('The existing [{}] cube is outdated (or recomputation is forced); starting from scratch...'.format(name))
+
+        create_cube(file_path, DTYPES[name])
+
+        manifest = {'key': key, 'parameters': parameters, 'complete': [False]*ha.size}
+        save_manifest(manifest_path, manifest)
+
+    return manifest
 
 
 if __name__ == '__main__':
-    print('Start [{}] run at {:}'.format(APERTURE.get_name(), datetime.now().strftime('%H:%M')))
-    results = Parallel(n_jobs=-1)(delayed(generate_obstruction_grid)(i) for i in az_range)
+    manifests = {name: prepare_cube(name) for name in APERTURES}
+
+    # The apertures that still have to be computed, per hour angle
+    todo = []
+
+    for i in range(ha.size):
+        missing = [name for name, manifest in manifests.items() if not manifest['complete'][i]]
+
+        if missing:
+            todo.append((i, missing))
+
+    run_name = ', '.join(APERTURES)
+
+    print('Start [{}] run at {:}; {} of {} slices to compute'.format(run_name, datetime.now().strftime('%H:%M'), len(todo), ha.size))
+
+    # The no. cells per path of the fast-path pre-test, per aperture
+    path_counts = {name: count_paths(np.empty(0)) for name in APERTURES}
+
+    # The no. cells outside of the limits (not traced), per aperture
+    masked = {name: 0 for name in APERTURES}
+
+    # The instrumentation of all workers
+    totals = Stats(enabled=args.stats)
+
+    run_start = time.perf_counter()
+
+    # The tiles of the hour angles that are (partially) missing, w/ the missing apertures
+    shape = (az_range.size, ha.size, dec.size)
+
+    n_jobs = effective_n_jobs(args.jobs)
+    tile_shape = args.tile or auto_tile_shape(shape, n_jobs)
+
+    missing_at = dict(todo)
+
+    tiles = []
+
+    for tile in make_tiles(shape, tile_shape):
+        missing = {name for i in range(tile[1].start, tile[1].stop) for name in missing_at.get(i, [])}
+
+        if missing:
+            tiles.append((tile, tuple(name for name in APERTURES if name in missing)))
+
+    # No. (az, ha, dec) cells to compute, summed over the apertures
+    n_cells = sum(get_tile_size(tile)*len(missing) for tile, missing in tiles)
+
+    progress = Progress(n_cells)
+
+    if args.adaptive:
+        STATS.enable(args.stats)
+
+        # The adaptive grid spans all hour angles; hence all slices are (re)computed at once
+        for name in dict.fromkeys(name for _, missing in todo for name in missing):
+            APERTURES[name].path_counts = count_paths(np.empty(0))
+
+            STATS.reset()
+
+            generate_adaptive_grid(name)
+
+            totals.merge(STATS.summary())
+
+            path_counts[name] = APERTURES[name].path_counts
+
+            manifests[name]['complete'] = [True]*ha.size
+            save_manifest(get_manifest_path(get_cube_path(name)), manifests[name])
+
+        tiles = []
+
+    # The no. unfinished tiles per hour angle; a slice is complete once all its tiles are
+    pending = {i: 0 for i in missing_at}
+
+    for tile, _ in tiles:
+        for i in range(tile[1].start, tile[1].stop):
+            if i in pending:
+                pending[i] += 1
+
+    # The workers write into the memory-mapped cubes; the main process flushes them before recording the completed slices
+    cubes = {name: np.load(get_cube_path(name), mmap_mode='r+') for name in APERTURES}
+
+    def checkpoint(finished):
+        """Flush the cubes & record the finished slices, s.t. an interrupted run can be resumed."""
+        with totals.timer('flush'):
+            for cube in cubes.values():
+                cube.flush()
+
+        for i in finished:
+            for name in missing_at[i]:
+                manifests[name]['complete'][i] = True
+
+        for name in {name for i in finished for name in missing_at[i]}:
+            save_manifest(get_manifest_path(get_cube_path(name)), manifests[name])
+
+    if tiles:
+        print('Dispatching {} tiles of {} (az, ha, dec) cells to {} workers'.format(len(tiles), 'x'.join(str(size) for size in tile_shape), n_jobs))
+
+    utilization = Utilization(n_jobs)
+
+    # Every worker takes the next tile as soon as it is done (i.e. dynamic load balancing), in order of completion
+    parallel = Parallel(n_jobs=args.jobs, batch_size=1, pre_dispatch='2*n_jobs', return_as='generator_unordered')
+
+    results = parallel(
+        delayed(compute_tile)(
+            tile, missing, {name: str(get_cube_path(name)) for name in missing}, (az_range, ha, dec), 
+            rate=args.rate, quantized=args.quantize, exact=args.exact, fast_path=not args.trace_all, limits=not args.no_limits, stats=args.stats
+        )
+        for tile, missing in tiles
+    )
+
+    report_every = max(1, len(tiles)//100)
+    last_checkpoint = time.perf_counter()
+    finished = []
+
+    try:
+        for k, result in enumerate(results, 1):
+            cells = get_tile_size(result['tile'])*len(result['path_counts'])
+
+            for name, count in result['path_counts'].items():
+                for path in count:
+                    path_counts[name][path] += count[path]
+
+            totals.merge(result['stats'])
+
+            for name, count in result['masked'].items():
+                masked[name] += count
+
+            utilization.add(result['worker'], result['seconds'], cells)
+
+            for i in range(result['tile'][1].start, result['tile'][1].stop):
+                if i in pending:
+                    pending[i] -= 1
+
+                    if not pending[i]:
+                        finished.append(i)
+
+            status = progress.update(cells)
+
+            if time.perf_counter() - last_checkpoint > CHECKPOINT_INTERVAL or k == len(tiles):
+                checkpoint(finished)
+
+                finished = []
+                last_checkpoint = time.perf_counter()
+
+            if k % report_every == 0 or k == len(tiles):
+                print('Finished {} of {} tiles; {}'.format(k, len(tiles), status))
+    except KeyboardInterrupt:
+        # Keep the finished slices of an interrupted run
+        checkpoint(finished)
+        raise
+
+    del cubes
+
+    run_time = time.perf_counter() - run_start
+
+    print('Finished [{}] run at {:}'.format(run_name, datetime.now().strftime('%H:%M')))
+
+    if utilization.workers:
+        print(utilization.format(run_time, per_worker=args.stats))
+
+    for name, counts in path_counts.items():
+        total = sum(counts.values())
+
+        if total:
+            print('[{}] fast path: {:.1%} clear, {:.1%} blocked, {:.1%} traced of {} cells'.format(name, counts['clear']/total, counts['blocked']/total, counts['traced']/total, total))
+
+        if masked[name]:
+            print('[{}] {} cells outside of the limits are masked, i.e. not traced'.format(name, masked[name]))
+
+    for name in APERTURES:
+        file_path = get_cube_path(name)
+
+        if args.quantize:
+            compact_path = get_compact_path(file_path)
+
+            with totals.timer('compact'):
+                save_cube(compact_path, np.load(file_path, mmap_mode='r'), DENOMINATORS[name], compress=args.compress)
+
+            print('Compact [{}] obstruction cube is stored in "{}"'.format(name, compact_path))
+        else:
+            print('[{}] obstruction cube is stored in "{}"'.format(name, file_path))
+
+    if args.stats:
+        summary = totals.summary()
+        summary.update({
+            'apertures': list(APERTURES),
+            'wall_seconds': run_time,
+            'cells': n_cells,
+            'cells_per_second': n_cells/run_time if run_time > 0 else None,
+            'path_counts': path_counts,
+            'masked': masked,
+            'tile_shape': list(tile_shape),
+            'utilization': utilization.summary(run_time),
+        })
+
+        stats_path = req_path / 'run_stats_{}.json'.format('_'.join(APERTURES))
 
-    print('Finished [{}] run at {:}; now stitching together the files...'.format(APERTURE.get_name(), datetime.now().strftime('%H:%M')))
+        with stats_path.open('w') as stats_file:
+            json.dump(summary, stats_file, indent=2)
 
-    combine()
\ No newline at end of file
+        print('Stats (stage timings summed over the workers):\n{}'.format(totals.format()))
+        print('Run stats are stored in "{}"'.format(stats_path))
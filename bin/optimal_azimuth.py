@@ -1,17 +1,22 @@
-import argparse
+import argparse, json, time
 import numpy as np
 
 from pathlib import Path
 from datetime import datetime
-from joblib import Parallel, delayed, dump, load
+
+from obstruction.cube import load_cube
+from obstruction.dwell import dwell_cube
+from obstruction.stats import Stats
 
 
 parser = argparse.ArgumentParser(
-            allow_abbrev=True, 
+            allow_abbrev=True,
             description='Produce a grid with optimal azimuth angles for the dome, given the appropriate (combination of) aperture(s).'
         )
 
 parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture: telescope, finder, guider, telescope_guider | default: telescope')
+parser.add_argument('-d', '--dwell', default=False, action='store_true', help='also store the dwell time (no. HA degrees the dome can remain at an azimuth) of every (az, ha, dec) cell')
+parser.add_argument('-s', '--stats', '--profile', default=False, action='store_true', help='time the stages of the run; printed & stored as json at the end of the run')
 parser.add_argument('-g', '--guider_requirement', action='store', type=float, default=0.5, help='ratio of how much of the guider should be unobstructed | default: 0.5')
 
 args = parser.parse_args()
@@ -20,213 +25,171 @@ args = parser.parse_args()
 # LOAD_DATE_SIGNATURE = args.date
 SRC = Path.cwd() / 'data'
 OPT_TARGET = Path.cwd() / 'data' / 'optimal_azimuth_{}_{}.csv'.format(args.aperture, datetime.now().strftime('%d_%h_%Y'))
+DWELL_TARGET = Path.cwd() / 'data' / 'dwell_cube_{}_{}.npy'.format(args.aperture, datetime.now().strftime('%d_%h_%Y'))
+STATS_TARGET = Path.cwd() / 'data' / 'run_stats_optimal_azimuth_{}.json'.format(args.aperture)
 
+# Per-stage timings (if --stats)
+stats = Stats(enabled=args.stats)
 
-# Verify whether the appropriate file structure exists/otherwise create required folders
-req_path = SRC / args.aperture / 'azimuth'
-
-try:
-    req_path.mkdir(parents=True, exist_ok=False)
-except FileExistsError:
-    pass
-else:
-    print('Created the data/.../azimuth folder(s)...')
-
-
-# Define a grid for the HA, Dec, and dome Az
+# The grid axes of the HA, Dec, and dome Az; the cube is indexed as (az, ha, dec)
 _az = np.linspace(0, 359, 360)
 _ha = np.linspace(0, 359, 360)
 _dec = np.linspace(-90, 90, 181)
 
-az, ha, dec = np.meshgrid(_az, _ha, _dec, indexing='ij')
-
-ha_zero = None
-dec_zero = None
-az_zero = None
-
-# Load the appropriate obstruction data set; generated w/ obstruction_grid.py
-if args.aperture == 'telescope_guider':
-    obstruction_data_tele = None
-    obstruction_data_guider = None
-    
-    fn = input('Insert obstruction cube file name (i.e. obstruction_cube_telescope_*.npy): ')
-    path = SRC / fn
-    
-    with path.open('rb') as obstr_file:
-        obstruction_data_tele = np.load(obstr_file)
-    
-    fn = input('Insert obstruction cube file name (i.e. obstruction_cube_guider_*.npy): ')
-    path = SRC / fn
-
-    with path.open('rb') as obstr_file:
-        obstruction_data_guider = np.load(obstr_file)
-
-    # Extract the (HA, Dec) coordinates w/ 0% obstruction for the telescope + guider
-    cond = (obstruction_data_tele == obstruction_data_tele.min())&(obstruction_data_guider < args.guider_requirement)
-
-    ha_zero = ha[cond]
-    dec_zero = dec[cond]
-    az_zero = az[cond]
-
-else:
-    fn = input('Insert obstruction cube file name (i.e. obstruction_cube_*_*.npy): ')
-    path = SRC / fn
-
-    with path.open('rb') as obstr_file:
-        obstruction_data = np.load(obstr_file)
-    
-    # Extract the (HA, Dec) coordinates w/ 0% obstruction for a single aperture
-    cond = obstruction_data == obstruction_data.min()
-
-    ha_zero = ha[cond]
-    dec_zero = dec[cond]
-    az_zero = az[cond]
-
-# Define the ranges of HA and Dec values corresponding to 0% obstruction
-ha_range = np.arange(ha_zero.min(), ha_zero.max() + 1, 1)
-dec_range = np.arange(dec_zero.min(), dec_zero.max() + 1, 1)
-
-
-def argmid(array):
-    if array.size % 2 == 0:
-        return int(array.size/2) - 1
-    
-    return int(array.size/2)
-
-
-def ha_dist(ha_array, ha_0):
-    """Compute the time the dome could remain at a certain position.
-    
-    Parameters
-    ----------
-    ha_array: 1d array w/ all possible hour angles
-    ha_0: initial hour angle
+# No. azimuths read from the cube(s) at once
+CHUNK_SIZE = 16
+
+
+def cube_min(cube):
+    """Return the minimum of a (memory-mapped/compact) cube, read in chunks; masked (NaN) cells are ignored."""
+    return min(masked_min(cube[start:start + CHUNK_SIZE]) for start in range(0, len(cube), CHUNK_SIZE))
+
+
+def masked_min(chunk):
+    return np.min(chunk, initial=np.inf, where=~np.isnan(chunk))
+
+
+def reachable_poses(cubes):
+    """
+    Return the (HA, Dec) poses that are not masked in any of the cubes, i.e. 
+    within the limits of the mount; masked poses are NaN for all azimuths, 
+    see obstruction.aperture.within_limits.
+    """
+    return np.logical_and.reduce([~np.isnan(np.asarray(cube[0])) for cube in cubes])
+
+
+def clear_cube(cubes, condition):
     """
-    try:
-        # Verify that the initial HA is indeed an option in ha_array
-        start = np.argwhere(np.isclose(ha_array, ha_0)).ravel()[0]
-    except IndexError:
-        return -1
-
-    # Shift the HA options s.t. ha_0 corresponds to 0 h
-    ha_shifted = (ha_array - ha_0) % 360
-    ha_shifted.sort()
-    
-    idx = np.argwhere(~np.isclose(np.diff(ha_shifted), 1)).ravel()
-
-    if idx.size > 0:
-        return ha_shifted[:idx[0]].size
-    
-    return ha_shifted.size
-
-
-def optimal_az(az_options, ha, dec):
-    """Compute the optimal dome azimuth angle.
-    
+    Evaluate the condition for a cell to be "clear" on the
+    obstruction cube(s), reading them in chunks of azimuths.
+
     Parameters
     ----------
-    az_options: all possible azimuth angles w/ 0% obstruction
-    ha: the initial hour angle
-    dec: the initial declination
+    cubes: list of obstruction cubes, indexed as (az, ha, dec)
+    condition: function of the chunks of the cubes, returning a boolean array
     """
-    dec_sel = np.argwhere(np.isclose(dec_zero, dec)).ravel()
-    
-    azimuths = []
-    delta_hs = []
-    
-    for az in az_options:
-        az_sel = np.argwhere(np.isclose(az_zero, az)).ravel()
-        
-        indices = np.intersect1d(az_sel, dec_sel)
-    
-        # Extract the range of possible HAs
-        hs = ha_zero[indices]
-        
-        if hs.size:
-            dh = ha_dist(hs, ha)
-            
-            azimuths.append(az)
-            delta_hs.append(dh)
-    
-    azimuths = np.array(azimuths)
-    delta_hs = np.array(delta_hs)
+    clear = np.empty(cubes[0].shape, dtype=bool)
 
-    if args.aperture == 'finder':
-        az_tmp = (azimuths + 180) % 360
-        sort_idx = az_tmp.argsort()
-        
-        middle = argmid(azimuths)
-        return azimuths[sort_idx][middle], delta_hs[sort_idx][middle]
-    
-    return azimuths[delta_hs.argmax()], delta_hs.max()
+    for start in range(0, len(clear), CHUNK_SIZE):
+        sel = slice(start, start + CHUNK_SIZE)
+
+        clear[sel] = condition(*[cube[sel] for cube in cubes])
 
+    return clear
 
-def get_ha_path(h):
-    fn = 'ha_{}.joblib'.format(int(h))
 
-    return req_path / fn
+def argmid(counts):
+    """Vectorized: the middle index of each of a set of arrays, given their sizes."""
+    return np.where(counts % 2 == 0, counts//2 - 1, counts//2)
 
 
-def generate_azimuth_grid(h):
-    """Store the optimal azimuth angle for a single hour angle.
-    
+def optimal_azimuths(clear, dwell):
+    """Compute the optimal dome azimuth angle for every (HA, Dec) pair.
+
     Parameters
     ----------
-    h: the hour angle in degrees
+    clear: boolean array w/ the clear cells, indexed as (az, ...), e.g. (az, ha, dec) or (az, pose)
+    dwell: the no. steps in HA the dome can remain at a position, see obstruction.dwell.dwell_cube
+
+    Returns
+    -------
+    has_option: boolean array, indexed as (...), e.g. (ha, dec), signifying whether there is a clear azimuth
+    az_index: the index of the optimal azimuth
+    az_dist: the no. steps in HA the dome can remain at the optimal azimuth
     """
-    optimal_decs = []
-    optimal_azimuths = []
-    optimal_ha_dist = []
+    has_option = clear.any(axis=0)
+
+    if args.aperture == 'finder':
+        # The middle of the clear azimuths, ordered from 180 deg onwards
+        shift = clear.shape[0]//2
+        rolled = np.roll(clear, -shift, axis=0)
 
-    for d in dec_range:
-        # Select indices according to the given ha/dec
-        dec_sel = np.argwhere(np.isclose(dec_zero, d)).ravel()
-        ha_sel = np.argwhere(np.isclose(ha_zero, h)).ravel()
+        counts = rolled.sum(axis=0)
+        middle = argmid(counts)
 
-        indices = np.intersect1d(ha_sel, dec_sel)
+        position = np.argmax(np.cumsum(rolled, axis=0) > middle, axis=0)
+        az_index = (position + shift) % clear.shape[0]
+    else:
+        # The (first) azimuth at which the dome can remain the longest
+        az_index = np.argmax(dwell, axis=0)
 
-        # Find the range of azimuth values
-        az = az_zero[indices]
+    az_dist = np.take_along_axis(dwell, az_index[np.newaxis], axis=0)[0]
 
-        # Display the results
-        if az.size > 0:
-            az_opt, ha_dist = optimal_az(az, h, d)
+    return has_option, az_index, az_dist
 
-            optimal_decs.append(d)
-            optimal_azimuths.append(az_opt)
-            optimal_ha_dist.append(ha_dist)
 
-    opt_data = np.column_stack([optimal_decs, optimal_azimuths, optimal_ha_dist])
-    
-    with get_ha_path(h).open('wb') as ha_file:
-        dump(opt_data, ha_file)
+if __name__ == '__main__':
+    print('start [{}] run at {:}'.format(args.aperture, datetime.now().strftime('%H:%M')))
 
-    print('Finished ha = {:>3.0f} degrees at {}'.format(h, datetime.now().strftime('%H:%M')))
+    # Load the appropriate obstruction data set; generated w/ obstruction_grid.py
+    if args.aperture == 'telescope_guider':
+        fn = input('Insert obstruction cube file name (i.e. obstruction_cube_telescope*.npy/.cube): ')
+        obstruction_data_tele = load_cube(SRC / fn)
 
-def combine():
-    """
-    Load the optimal azimuth grids (1 per hour angle) and stitch 
-    them together and store them as -- easy-to-read -- csv files.
-    """
-    opt_data = np.empty((1, 4))
+        fn = input('Insert obstruction cube file name (i.e. obstruction_cube_guider*.npy/.cube): ')
+        obstruction_data_guider = load_cube(SRC / fn)
 
-    for ha in ha_range:
-        with get_ha_path(ha).open('rb') as ha_file:
-            data = load(ha_file)
+        cubes = [obstruction_data_tele, obstruction_data_guider]
 
-            h_col = ha * np.ones((data.shape[0], 1))
-            res = np.hstack([h_col, data])
-            opt_data = np.vstack([opt_data, res])
-    
-    np.savetxt(str(OPT_TARGET), opt_data[1:], delimiter=',')
+        with stats.timer('clear'):
+            tele_min = cube_min(obstruction_data_tele)
 
-    print('finished generating optimal azimuth grid; data stored at {}...'.format(str(OPT_TARGET.name)))
+            # The cells w/ 0% obstruction for the telescope + guider
+            clear = clear_cube(
+                [obstruction_data_tele, obstruction_data_guider],
+                lambda tele, guider: (tele == tele_min)&(guider < args.guider_requirement)
+            )
 
-if __name__ == '__main__':
-    print('start [{}] run at {:}'.format(args.aperture, datetime.now().strftime('%H:%M')))
+    else:
+        fn = input('Insert obstruction cube file name (i.e. obstruction_cube_*.npy/.cube): ')
+        obstruction_data = load_cube(SRC / fn)
+
+        cubes = [obstruction_data]
+
+        with stats.timer('clear'):
+            data_min = cube_min(obstruction_data)
+
+            # The cells w/ 0% obstruction for a single aperture
+            clear = clear_cube([obstruction_data], lambda data: data == data_min)
 
-    results = Parallel(n_jobs=-1)(delayed(generate_azimuth_grid)(h) for h in ha_range)
+    # Masked cells (outside of the limits) are never clear, hence they end the dwell time
+    with stats.timer('dwell'):
+        dwell = dwell_cube(clear)
+
+    # Only the poses within the limits are candidates
+    ha_index, dec_index = np.nonzero(reachable_poses(cubes))
+
+    print('{} of {} (HA, Dec) poses are within the limits'.format(ha_index.size, clear[0].size))
+
+    with stats.timer('optimal'):
+        has_option, az_index, az_dist = optimal_azimuths(clear[:, ha_index, dec_index], dwell[:, ha_index, dec_index])
+
+    # Store the (HA, Dec, Az, dwell) table, ordered by HA & Dec
+    opt_data = np.column_stack([
+        _ha[ha_index[has_option]],
+        _dec[dec_index[has_option]],
+        _az[az_index[has_option]],
+        az_dist[has_option],
+    ])
+
+    with stats.timer('save'):
+        np.savetxt(str(OPT_TARGET), opt_data, delimiter=',')
+
+        if args.dwell:
+            np.save(DWELL_TARGET, dwell)
+
+    if args.dwell:
+        print('dwell cube is stored at {}...'.format(str(DWELL_TARGET.name)))
 
     print('finish [{}] run at {:}'.format(args.aperture, datetime.now().strftime('%H:%M')))
+    print('finished generating optimal azimuth grid; data stored at {}...'.format(str(OPT_TARGET.name)))
+
+    if args.stats:
+        summary = stats.summary()
+        summary.update({'aperture': args.aperture, 'cells': int(clear.size), 'clear_cells': int(np.count_nonzero(clear)), 'reachable_poses': int(ha_index.size)})
+
+        with STATS_TARGET.open('w') as stats_file:
+            json.dump(summary, stats_file, indent=2)
 
-    combine()
\ No newline at end of file
+        print('Stats:\n{}'.format(stats.format()))
+        print('Run stats are stored in {}...'.format(str(STATS_TARGET.name)))
@@ -0,0 +1,109 @@
+import argparse
+import numpy as np
+
+from obstruction.aperture import AMBIGUOUS, APERTURE_TYPES, is_in_slit, radical_inverse, trace_rays
+
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Compare the accuracy of the (area-weighted) aperture sampling vs the sample rate, w.r.t. a dense quasi-random reference, for poses at the edges of the slit'
+        )
+
+parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture: telescope, finder, guider | default: telescope')
+parser.add_argument('-n', action='store', type=int, default=500, help='no. (partially obstructed) poses | default: 500')
+parser.add_argument('--rates', action='store', type=str, default='2,3,4,5,6,8,10', help='comma separated sample rates | default: 2,3,4,5,6,8,10')
+parser.add_argument('--seed', action='store', type=int, default=0, help='seed of the random poses | default: 0')
+
+args = parser.parse_args()
+
+
+# No. rays of the reference
+N_REFERENCE = 2**15
+
+# The rays are parallel to the y-axis of the aperture
+DIRECTION = np.array([0., 1., 0.])
+
+
+def random_poses(aperture, n):
+    """Draw random (HA, Dec, Az) poses that cannot be classified as fully clear/blocked."""
+    rng = np.random.default_rng(args.seed)
+
+    poses = []
+
+    while sum(len(p[0]) for p in poses) < n:
+        ha, dec, az = rng.uniform(0, 360, 10*n), rng.uniform(-90, 90, 10*n), rng.uniform(0, 360, 10*n)
+
+        is_ambiguous = aperture._classify(ha, dec, az) == AMBIGUOUS
+
+        poses.append((ha[is_ambiguous], dec[is_ambiguous], az[is_ambiguous]))
+
+    return [np.concatenate(p)[:n] for p in zip(*poses)]
+
+
+def obstruction(aperture, local, weights, ha, dec, az):
+    """Return the weighted obstruction of rays (in the frame of the aperture) for arrays of poses."""
+    ratio = np.empty(ha.size)
+
+    for start in range(0, ha.size, 64):
+        sel = slice(start, start + 64)
+
+        has_intersection, points = trace_rays(aperture._transform(ha[sel], dec[sel]), local, DIRECTION)
+
+        ratio[sel] = ~(has_intersection & is_in_slit(points, az[sel, np.newaxis])) @ weights
+
+    return ratio
+
+
+def legacy_template(aperture):
+    """
+    The previous sampling: every ring includes its end point (a duplicate
+    of its first point) and all rays have equal weights.
+    """
+    xy = []
+
+    r_min = aperture.sec_radius/aperture.radius
+    k = 1 if not r_min else np.ceil(r_min*(aperture.sample_rate + 1))
+
+    if not r_min:
+        xy.append([[0, 0]])
+
+    for r in np.linspace(1/aperture.sample_rate if not r_min else r_min, 1, aperture.sample_rate):
+        n = int(np.round(np.pi/np.arcsin(1/(2*k))))
+        theta = np.linspace(0, 2*np.pi, n + 1)
+
+        xy.append(np.column_stack([r*np.cos(theta), r*np.sin(theta)]))
+
+        k += 1
+
+    ap_x, ap_z = aperture.radius*np.concatenate(xy).T
+
+    local = np.column_stack((-ap_x, np.zeros(ap_x.size), ap_z, np.ones(ap_x.size)))
+
+    return local, np.full(ap_x.size, 1/ap_x.size)
+
+
+if __name__ == '__main__':
+    aperture = APERTURE_TYPES[args.aperture]()
+
+    ha, dec, az = random_poses(aperture, args.n)
+
+    # Dense, area-uniform, quasi-random reference
+    sequence = np.arange(1, N_REFERENCE + 1)
+    local = aperture._annulus_template(radical_inverse(sequence, 2), radical_inverse(sequence, 3))
+
+    reference = obstruction(aperture, local, np.full(N_REFERENCE, 1/N_REFERENCE), ha, dec, az)
+
+    print('[{}] {} partially obstructed poses; mean |error| (max |error|) w.r.t. {} reference rays'.format(args.aperture, ha.size, N_REFERENCE))
+    print('{:>4} | {:>22} | {:>22}'.format('rate', 'legacy (rays)', 'area-weighted (rays)'))
+
+    for rate in [int(rate) for rate in args.rates.split(',')]:
+        sampled = APERTURE_TYPES[args.aperture](rate=rate)
+
+        legacy_local, legacy_weights = legacy_template(sampled)
+
+        errors = [
+            (np.abs(obstruction(sampled, legacy_local, legacy_weights, ha, dec, az) - reference), len(legacy_weights)),
+            (np.abs(obstruction(sampled, sampled._ray_template(), sampled._ray_weights(), ha, dec, az) - reference), sampled.get_ray_count()),
+        ]
+
+        print('{:>4} | '.format(rate) + ' | '.join('{:.4f} ({:.3f}) {:>4}'.format(error.mean(), error.max(), n_rays) for error, n_rays in errors))
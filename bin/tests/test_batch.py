@@ -0,0 +1,29 @@
+import csv, io
+
+from obstruction.aperture import TelescopeAperture
+from obstruction.batch import stream_obstruction
+
+
+def run(text, format='csv'):
+    sink = io.StringIO()
+    n_records, n_errors = stream_obstruction([TelescopeAperture(rate=1)], io.StringIO(text), sink, format=format)
+
+    return n_records, n_errors, list(csv.reader(io.StringIO(sink.getvalue())))
+
+
+def test_header_from_input_with_malformed_first_record():
+    n_records, n_errors, rows = run('id,ha,dec,az\n0,0\n1,0,0,0\n')
+
+    assert (n_records, n_errors) == (2, 1)
+    assert rows[0] == ['id', 'ha', 'dec', 'az', 'telescope', 'error']
+    assert rows[1][:3] == ['0', '0', ''] and rows[1][-1] == 'expected 4 fields, got 2'
+    assert rows[2][:4] == ['1', '0', '0', '0'] and rows[2][-1] == ''
+
+
+def test_headerless_with_malformed_first_line():
+    n_records, n_errors, rows = run('x,30,180\n0,0,0\n')
+
+    assert (n_records, n_errors) == (2, 1)
+    assert rows[0] == ['ha', 'dec', 'az', 'telescope', 'error']
+    assert rows[1][:3] == ['x', '30', '180'] and rows[1][-1] == 'non-numeric ha, dec, or az'
+    assert rows[2][:3] == ['0', '0', '0'] and rows[2][3] != ''
@@ -0,0 +1,17 @@
+import io
+
+import numpy as np
+
+from obstruction.cube import QuantizedCube
+from obstruction.field import ObstructionField, bulk_query
+
+
+def test_bulk_skips_header_comments_and_malformed_lines():
+    field = ObstructionField(QuantizedCube.from_counts(np.ones((360, 360, 181), dtype=np.uint8), 4))
+
+    out = io.StringIO()
+
+    n_queries, n_skipped = bulk_query(field, io.StringIO('ha,dec,az\n# comment\n1,30,90\n2,30\nx,30,90\n\n2,-20,180\n1,95,0\n'), out)
+
+    assert (n_queries, n_skipped) == (2, 3)
+    assert out.getvalue().splitlines() == ['ha,dec,az,obstruction', '1,30,90,0.25', '2,-20,180,0.25']
@@ -0,0 +1,34 @@
+import io
+
+import numpy as np
+import pytest
+
+from obstruction.lookup import AzimuthTable, bulk_query
+
+
+def make_table():
+    ha, dec = np.meshgrid(np.arange(360.), np.arange(-90., 91.), indexing='ij')
+
+    return AzimuthTable(np.column_stack([ha.ravel(), dec.ravel(), (ha.ravel() + 90) % 360, np.full(ha.size, 10)]))
+
+
+def test_bulk_skips_header_and_malformed_lines():
+    out = io.StringIO()
+
+    n_queries, n_skipped = bulk_query(make_table(), io.StringIO('ha,dec\n1,30\nnot,a number\n2\n\n2,-20\n0,95\n'), out)
+
+    assert (n_queries, n_skipped) == (2, 3)
+
+    rows = out.getvalue().splitlines()
+
+    assert rows[0] == 'ha,dec,azimuth,dwell'
+    assert [row.split(',')[:3] for row in rows[1:]] == [['1', '30', '105'], ['2', '-20', '120']]
+
+
+def test_query_rejects_non_finite_coordinates():
+    table = make_table()
+
+    for ha, dec in [(np.nan, 30), (15, np.inf), (np.array([15, np.nan]), np.array([30, 30]))]:
+        for interpolate in (False, True):
+            with pytest.raises(ValueError):
+                table.query(ha, dec, interpolate=interpolate)
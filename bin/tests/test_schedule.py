@@ -0,0 +1,15 @@
+import numpy as np
+
+from obstruction.schedule import DomeScheduler
+
+
+def test_back_to_back_targets_share_no_step():
+    scheduler = DomeScheduler(np.ones((360, 360, 181), dtype=bool), longitude=6.5)
+
+    plan = scheduler.plan([(30, 20, 600), (60, 40, 600)], '2024-03-01T21:00:00', step=120)
+
+    # [0, 600) s of the first target, and [600, 1200] s of the second
+    assert np.array_equal(np.bincount(plan['target']), [5, 6])
+    assert np.unique(plan['time']).size == plan['time'].size
+    assert plan['time'][5] == np.datetime64('2024-03-01T21:10:00')
+    assert plan['n_obstructed'] == 0
@@ -0,0 +1,42 @@
+import argparse, datetime, sys
+import numpy as np
+
+from obstruction.aperture import APERTURE_TYPES
+from obstruction.timeline import obstruction_timeline
+
+parser = argparse.ArgumentParser(
+            allow_abbrev=True,
+            description='Compute the % obstruction of the main aperture/finder/guider by the dome while tracking a target (RA/Dec) w/ the dome at a fixed azimuth; writes csv to stdout'
+        )
+
+parser.add_argument('--ra', action='store', type=float, default=0.0, help='target right ascension: 0 to 24 h | default: 0 h')
+parser.add_argument('--dec', action='store', type=float, default=0.0, help='target declination -90 to 90 deg | default: 0 deg')
+parser.add_argument('--az', action='store', type=float, default=0.0, help='dome azimuth: 0 to 360 deg | default: 0 deg')
+parser.add_argument('--start', action='store', type=str, default=None, help='UTC start time, e.g. 2024-03-01T21:00:00 | default: now')
+parser.add_argument('-d', '--duration', action='store', type=float, default=240.0, help='duration of the track in minutes | default: 240 min')
+parser.add_argument('-s', '--step', action='store', type=float, default=60.0, help='time step in seconds | default: 60 s')
+parser.add_argument('-a', '--aperture', action='store', type=str, default='telescope', help='select aperture: telescope, finder, guider | default: telescope')
+parser.add_argument('-r', '--rate', action='store', type=int, default=4, help='no. radial circles of rays | default: 4')
+
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    if args.aperture not in APERTURE_TYPES:
+        parser.error('unknown aperture "{}"'.format(args.aperture))
+
+    aperture = APERTURE_TYPES[args.aperture](rate=args.rate)
+
+    start = args.start if args.start is not None else datetime.datetime.now(datetime.timezone.utc)
+
+    timeline = obstruction_timeline(aperture, args.ra*15, args.dec, start, args.duration*60, args.step, args.az)
+
+    sys.stdout.write('time,ha,dec,dome_az,obstruction,window_start,window_end,dwell\n')
+
+    for i, time in enumerate(timeline['time']):
+        values = [timeline[key][i] for key in ('ha', 'dec', 'dome_az', 'obstruction', 'window_start', 'window_end', 'dwell')]
+
+        sys.stdout.write(str(time)[:19] + ',' + ','.join('{:.6g}'.format(value) for value in values) + '\n')
+
+    clear = timeline['obstruction'] == 0
+
+    print('{:.0%} of the track is clear; the aperture is {:.2%} obstructed on average'.format(clear.mean(), timeline['obstruction'].mean()), file=sys.stderr)